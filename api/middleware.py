@@ -0,0 +1,53 @@
+import logging
+
+from django.conf import settings
+
+from api.queries import (
+    find_repeated_queries, get_query_budget, record_queries
+)
+
+# Response headers with the number of queries run for the request and
+# the time they took in milliseconds (only when DEBUG is on)
+QUERY_COUNT_HEADER = 'X-Query-Count'
+QUERY_TIME_HEADER = 'X-Query-Time'
+
+
+class QueryCountMiddleware:
+    """Records the SQL queries run for each request.
+
+    Meant for development: a warning is logged for each query shape
+    repeated more than `settings.API_QUERY_REPEAT_LIMIT` times (a
+    likely N+1 query pattern), and for requests that run more queries
+    than their view's budget (see `api.queries.get_query_budget`).
+    When DEBUG is on, responses carry the query count and the total
+    time spent in the database. Queries run while a streaming
+    response is consumed are not counted.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries() as queries:
+            response = self.get_response(request)
+
+        endpoint = f'{request.method} {request.path}'
+        for shape, count in find_repeated_queries(queries):
+            logging.warning(
+                f'{endpoint} ran {count} queries like: {shape[:300]}'
+            )
+
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is not None:
+            budget = get_query_budget(resolver_match.func, request.method)
+            if budget is not None and len(queries) > budget:
+                logging.warning(
+                    f'{endpoint} ran {len(queries)} queries, '
+                    f'over its budget of {budget}'
+                )
+
+        if settings.DEBUG:
+            query_time = sum(query.duration for query in queries) * 1000
+            response[QUERY_COUNT_HEADER] = len(queries)
+            response[QUERY_TIME_HEADER] = f'{query_time:.1f}'
+        return response
@@ -1,4 +1,4 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class SmallResultsSetPagination(PageNumberPagination):
@@ -17,3 +17,31 @@ class StandardResultsSetPagination(PageNumberPagination):
     page_size = 100
     page_size_query_param = 'page_size'
     max_page_size = 1000
+
+
+class EntryCursorPagination(CursorPagination):
+    """Keyset pagination for entries on (published, id).
+
+    Pages are fetched with a `WHERE published < ...` range on the 
+    `published` index instead of an OFFSET scan, and no COUNT(*) is 
+    run, so deep pages cost the same as the first one.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ['-published', '-id']
+
+
+def get_entry_paginator(request):
+    """Returns the paginator to use for a list of entries.
+
+    Entries are paginated with a cursor, unless the request opts in 
+    to page-number pagination by passing a `page` query parameter, 
+    or searches entries (search results are ordered by rank, which 
+    a cursor on `published` cannot follow).
+    """
+    params = request.query_params
+    if (StandardResultsSetPagination.page_query_param in params
+            or params.get('search')):
+        return StandardResultsSetPagination()
+    return EntryCursorPagination()
@@ -0,0 +1,119 @@
+"""
+Module for recording the SQL queries run while handling API requests
+
+Queries are recorded with a database execute wrapper, so that they are
+seen whatever the value of DEBUG. Repeated query shapes, the usual
+sign of an N+1 query pattern (e.g., one query per serialized object),
+are found by comparing queries with their parameters left out.
+
+API views may declare how many queries each of their actions may run,
+in a `query_budgets` dict that maps action names (or HTTP method names
+for views that are not viewsets) to query counts. The budgets are
+enforced by tests (see `api.tests.helpers.QueryBudgetTestMixin`) and
+checked on each request by `api.middleware.QueryCountMiddleware`.
+
+Functions:
+    record_queries()
+    get_query_shape(sql)
+    find_repeated_queries(queries, limit=None)
+    get_query_budget(view, method)
+"""
+from collections import Counter, namedtuple
+from contextlib import contextmanager, ExitStack
+import re
+import time
+
+from django.conf import settings
+from django.db import connections
+
+Query = namedtuple('Query', ['sql', 'duration'])
+
+# Lists of query parameters, e.g., the values of an IN clause
+PARAMS_LIST_PATTERN = re.compile(r'%s(?:\s*,\s*%s)+')
+
+# Whitespace runs, so that formatting does not change a query's shape
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+class QueryRecorder:
+    """Execute wrapper that records each query and its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                Query(sql=sql, duration=time.perf_counter() - started)
+            )
+
+
+@contextmanager
+def record_queries():
+    """Records the queries run on all databases within the context.
+
+    Yields:
+        list: Query namedtuples (SQL without parameters, and duration
+            in seconds), filled in as queries run
+    """
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder.queries
+
+
+def get_query_shape(sql):
+    """Returns a query without what varies between similar queries.
+
+    Parameters are already left out of the SQL passed to execute
+    wrappers; lists of parameters are collapsed, so that e.g. IN
+    clauses of different lengths have the same shape.
+    """
+    sql = PARAMS_LIST_PATTERN.sub('%s, ...', sql)
+    return WHITESPACE_PATTERN.sub(' ', sql).strip()
+
+
+def find_repeated_queries(queries, limit=None):
+    """Finds query shapes run more often than a limit.
+
+    Args:
+        queries (iterable): recorded queries (see `record_queries`)
+        limit (int): number of times a shape may be run (defaults to
+            `settings.API_QUERY_REPEAT_LIMIT`)
+
+    Returns:
+        list: (shape, count) tuples of the shapes over the limit,
+            the most repeated first
+    """
+    if limit is None:
+        limit = settings.API_QUERY_REPEAT_LIMIT
+    shapes = Counter(get_query_shape(query.sql) for query in queries)
+    return [
+        (shape, count) for shape, count in shapes.most_common()
+        if count > limit
+    ]
+
+
+def get_query_budget(view, method):
+    """Returns the number of queries a view may run for a request.
+
+    Args:
+        view (callable): the view function, as returned by `as_view()`
+            (e.g., `request.resolver_match.func`)
+        method (str): HTTP method of the request
+
+    Returns:
+        int: the budget, or None if the view declares none
+    """
+    view_class = getattr(view, 'cls', None)
+    budgets = getattr(view_class, 'query_budgets', None)
+    if not budgets:
+        return None
+
+    method = method.lower()
+    actions = getattr(view, 'actions', None) or {}
+    return budgets.get(actions.get(method, method))
@@ -1,7 +1,14 @@
+from urllib.parse import urlsplit
+
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import resolve
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
+from api.queries import (
+    find_repeated_queries, get_query_budget, record_queries
+)
 from feeds.api.serializers import EntrySerializer, FeedSerializer
 from feeds.models import Entry
 from feeds.tests.helpers import (
@@ -47,6 +54,10 @@ def create_user_and_auth_token(username, is_staff=False):
 class BaseRSSAPITestCase(APITestCase):
     """Includes methods common to all test cases in this project."""
 
+    def setUp(self):
+        # Cached pages of entries are not rolled back between tests
+        cache.clear()
+
     def assert_http_status(self, response, expected_status_code=200):
         """Asserts if response status code is exactly as expected."""
         self.assertEqual(
@@ -74,3 +85,44 @@ class BaseFeedAPITestCase(BaseRSSAPITestCase):
             is_staff=is_staff
         )
         self.client.force_authenticate(user=user, token=token)
+
+
+class QueryBudgetTestMixin:
+    """Includes assertions on the queries run by API requests."""
+
+    def assert_within_query_budget(self, url, method='get', **kwargs):
+        """Requests a URL and checks the queries run for it.
+
+        The request may run no more queries than the budget its view 
+        declares (see `api.queries.get_query_budget`), and no query 
+        shape may be repeated as in an N+1 query pattern (see 
+        `api.queries.find_repeated_queries`). Streaming responses are 
+        consumed, so that the queries they run are counted.
+
+        Args:
+            url (str): URL to request
+            method (str): name of the test client method to call
+            kwargs: passed on to the test client method
+
+        Returns:
+            Response: the response to the request
+        """
+        view = resolve(urlsplit(url).path).func
+        budget = get_query_budget(view, method)
+        self.assertIsNotNone(budget, f'{url} declares no query budget')
+
+        with record_queries() as queries:
+            response = getattr(self.client, method)(url, **kwargs)
+            if response.streaming:
+                body = b''.join(response.streaming_content)
+                response.streaming_content = [body]
+
+        sql = '\n'.join(query.sql for query in queries)
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            f'{method.upper()} {url} ran {len(queries)} queries, over '
+            f'its budget of {budget}:\n{sql}'
+        )
+        self.assertEqual(find_repeated_queries(queries), [])
+        return response
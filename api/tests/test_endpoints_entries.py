@@ -1,11 +1,26 @@
+from datetime import timedelta
+from decimal import Decimal
+import json
+
+from django.conf import settings
+from django.db import connection
 from django.shortcuts import reverse
+from django.test import override_settings, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ErrorDetail
+from rest_framework.renderers import JSONRenderer
 
 from api.tests.helpers import (
-    BaseRSSAPITestCase, create_entry_objects
+    BaseRSSAPITestCase, create_entry_objects, ENTRY_DETAIL_FIELDS
 )
+from feeds.api.renderers import EntryListRenderer
+from feeds.api.serializers import EntrySerializer, serialize_entry_values
 from feeds.models import Entry
+from feeds.utils.cache_tools import bump_generations
 
 
+@override_settings(ENTRY_PAGE_CACHE_ENABLED=True)
 class EntryListTest(BaseRSSAPITestCase):
     """Tests GET request on `entry-list` endpoint.
 
@@ -30,7 +45,212 @@ class EntryListTest(BaseRSSAPITestCase):
         payload = response.json()
         self.assert_http_status(response)
         self.assertIsInstance(payload['results'], list)
-        self.assertEqual(payload['count'], self.n_items)
+        self.assertEqual(len(payload['results']), 100)
+        self.assertIsNotNone(payload['next'])
+        self.assertNotIn('count', payload)
+
+    def test_cursor_pagination_walks_all_entries(self):
+        links = []
+        url = self.endpoint_url
+        while url:
+            response = self.client.get(url)
+            self.assert_http_status(response)
+            payload = response.json()
+            links.extend(item['link'] for item in payload['results'])
+            url = payload['next']
+
+        expected = Entry.objects.order_by(
+            '-published', '-id'
+        ).values_list('link', flat=True)
+        self.assertEqual(links, list(expected))
+
+    def test_cursor_pagination_page_size(self):
+        response = self.client.get(self.endpoint_url, data={'page_size': 10})
+        payload = response.json()
+        self.assert_http_status(response)
+        self.assertEqual(len(payload['results']), 10)
+
+    def test_pages_are_served_from_cache(self):
+        first_payload = self.client.get(self.endpoint_url).json()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.endpoint_url)
+        self.assert_http_status(response)
+        self.assertEqual(response.json(), first_payload)
+        # Only the sync token is read from the database
+        self.assertEqual(len(queries), 1)
+
+    def test_new_entries_invalidate_cached_pages(self):
+        self.client.get(self.endpoint_url)
+        Entry.objects.all().delete()
+        bump_generations([])
+        payload = self.client.get(self.endpoint_url).json()
+        self.assertFalse(payload['results'])
+
+    @override_settings(ENTRY_PAGE_CACHE_ENABLED=False)
+    def test_pages_are_not_cached_without_shared_cache(self):
+        self.client.get(self.endpoint_url)
+
+        # Entries deleted by a worker, whose cache is not this one
+        Entry.objects.all().delete()
+        response = self.client.get(self.endpoint_url)
+        self.assert_http_status(response)
+        self.assertFalse(response.json()['results'])
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertTrue(response.has_header('X-Sync-Token'))
+
+    def test_conditional_request_with_etag(self):
+        response = self.client.get(self.endpoint_url)
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                self.endpoint_url,
+                HTTP_IF_NONE_MATCH=etag
+            )
+        self.assert_http_status(response, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+        self.assertEqual(len(queries), 0)
+
+        # Other pages have other tags
+        response = self.client.get(
+            self.endpoint_url,
+            data={'page': 2},
+            HTTP_IF_NONE_MATCH=etag
+        )
+        self.assert_http_status(response)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_changes_when_new_entries_are_saved(self):
+        etag = self.client.get(self.endpoint_url)['ETag']
+        bump_generations([])
+        response = self.client.get(self.endpoint_url, HTTP_IF_NONE_MATCH=etag)
+        self.assert_http_status(response)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_conditional_request_with_last_modified(self):
+        bump_generations([])
+        last_modified = self.client.get(self.endpoint_url)['Last-Modified']
+        response = self.client.get(
+            self.endpoint_url,
+            HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assert_http_status(response, 304)
+
+    @override_settings(ENTRY_SYNC_TOKEN_LAG=0)
+    def test_sync_token(self):
+        response = self.client.get(self.endpoint_url)
+        self.assertEqual(
+            int(response['X-Sync-Token']),
+            Entry.objects.order_by('-id').first().id
+        )
+
+        # Cached pages carry the token they were cached with
+        response = self.client.get(self.endpoint_url)
+        self.assertEqual(
+            int(response['X-Sync-Token']),
+            Entry.objects.order_by('-id').first().id
+        )
+
+    def test_sync_token_of_cached_page_catches_up(self):
+        Entry.objects.update(timestamp=timezone.now())
+        response = self.client.get(self.endpoint_url)
+        self.assertEqual(int(response['X-Sync-Token']), 0)
+
+        # Once the entries are older than the lag, the token of the
+        # cached page includes them
+        Entry.objects.update(timestamp=timezone.now() - timedelta(minutes=5))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.endpoint_url)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            int(response['X-Sync-Token']),
+            Entry.objects.order_by('-id').first().id
+        )
+
+    @override_settings(ENTRY_SYNC_TOKEN_LAG=0)
+    def test_entries_after_sync_token(self):
+        sync_token = int(self.client.get(self.endpoint_url)['X-Sync-Token'])
+        new_entries = create_entry_objects(
+            n_items=5,
+            feed_url='https://www.newfeed.com/'
+        )
+        bump_generations([])
+
+        response = self.client.get(
+            self.endpoint_url,
+            data={'after_id': sync_token}
+        )
+        payload = response.json()
+        self.assert_http_status(response)
+        self.assertCountEqual(
+            [item['link'] for item in payload['results']],
+            [entry.link for entry in new_entries]
+        )
+        self.assertGreater(int(response['X-Sync-Token']), sync_token)
+
+    def test_entries_committed_out_of_order_are_not_skipped(self):
+        Entry.objects.update(timestamp=timezone.now() - timedelta(minutes=5))
+        newest_id = Entry.objects.order_by('-id')[0].id
+
+        # An entry is committed while an entry saved before it, with
+        # a lower ID, is not committed yet
+        later_entry = Entry.objects.create(
+            id=newest_id + 2,
+            link='https://www.newfeed.com/2',
+            title='Later entry',
+            summary='Committed first'
+        )
+        bump_generations([])
+        response = self.client.get(self.endpoint_url)
+        sync_token = int(response['X-Sync-Token'])
+        self.assertEqual(sync_token, newest_id)
+
+        earlier_entry = Entry.objects.create(
+            id=newest_id + 1,
+            link='https://www.newfeed.com/1',
+            title='Earlier entry',
+            summary='Committed last'
+        )
+        bump_generations([])
+        response = self.client.get(
+            self.endpoint_url,
+            data={'after_id': sync_token}
+        )
+        self.assert_http_status(response)
+        self.assertCountEqual(
+            [item['link'] for item in response.json()['results']],
+            [earlier_entry.link, later_entry.link]
+        )
+
+    def test_entries_since_timestamp(self):
+        since = timezone.now()
+        Entry.objects.filter(
+            pk__in=Entry.objects.order_by('id').values('id')[:10]
+        ).update(timestamp=since + timedelta(minutes=1))
+
+        response = self.client.get(
+            self.endpoint_url,
+            data={'since': since.isoformat()}
+        )
+        self.assert_http_status(response)
+        self.assertEqual(len(response.json()['results']), 10)
+
+    def test_invalid_sync_parameters(self):
+        invalid_params = [
+            {'since': 'yesterday'},
+            {'after_id': '-1'},
+            {'after_id': 'abc'},
+        ]
+        for params in invalid_params:
+            response = self.client.get(self.endpoint_url, data=params)
+            self.assert_http_status(response, 400)
+            self.assertIn(list(params)[0], response.json())
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.endpoint_url, data={'cursor': 'bad'})
+        self.assert_http_status(response, 404)
 
     def test_valid_entries_pagination(self):
         # Pass in a page number within range
@@ -53,4 +273,235 @@ class EntryListTest(BaseRSSAPITestCase):
         self.assert_http_status(response)
         self.assertIsInstance(payload['results'], list)
         self.assertFalse(payload['results'])
+        self.assertIsNone(payload['next'])
+
+
+class EntrySearchTest(BaseRSSAPITestCase):
+    """Tests GET request with `search` on `entry-list` endpoint.
+
+    This API call should return entries matching the search terms, 
+    ranked by relevance.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.endpoint_url = reverse('entry-list')
+        create_entry_objects(n_items=30)
+        Entry.objects.bulk_create([
+            Entry(
+                link='https://www.myfeed.com/summary-match',
+                title='Weekly news roundup',
+                summary='Astronomers spotted a new comet this week'
+            ),
+            Entry(
+                link='https://www.myfeed.com/title-match',
+                title='Comets spotted over the city',
+                summary='Residents reported bright lights in the sky'
+            ),
+        ])
+        Entry.objects.update_search_vectors()
+
+    def search(self, text, **params):
+        response = self.client.get(
+            self.endpoint_url,
+            data={'search': text, **params}
+        )
+        self.assert_http_status(response)
+        return response.json()
+
+    def test_matches_are_ranked(self):
+        payload = self.search('comet')
+        self.assertEqual(payload['count'], 2)
+        self.assertEqual(
+            [item['link'] for item in payload['results']],
+            [
+                'https://www.myfeed.com/title-match',
+                'https://www.myfeed.com/summary-match',
+            ]
+        )
+
+    def test_all_search_terms_must_match(self):
+        payload = self.search('comet city')
+        self.assertEqual(
+            [item['link'] for item in payload['results']],
+            ['https://www.myfeed.com/title-match']
+        )
+
+    def test_no_matches(self):
+        payload = self.search('volcano')
         self.assertEqual(payload['count'], 0)
+        self.assertFalse(payload['results'])
+
+    def test_search_results_pagination(self):
+        payload = self.search('comet', page_size=1, page=2)
+        self.assertEqual(payload['count'], 2)
+        self.assertEqual(
+            [item['link'] for item in payload['results']],
+            ['https://www.myfeed.com/summary-match']
+        )
+
+    def test_search_uses_index(self):
+        # The test table is too small for the planner to prefer
+        # the index on its own
+        with connection.cursor() as cursor:
+            cursor.execute('SET enable_seqscan = off')
+        plan = Entry.objects.search('comet').explain()
+        self.assertIn('Bitmap Index Scan on feeds_entry_search', plan)
+
+
+class EntryExportTest(BaseRSSAPITestCase):
+    """Tests GET request on `entry-export` endpoint.
+
+    This API call should stream all entries as newline-delimited JSON.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.endpoint_url = reverse('entry-export')
+        cls.n_items = 50
+        cls.entries = create_entry_objects(n_items=cls.n_items)
+
+    def get_exported_entries(self, **params):
+        response = self.client.get(self.endpoint_url, data=params)
+        self.assert_http_status(response)
+        self.assertTrue(response.streaming)
+        self.assertEqual(
+            response['Content-Type'],
+            'application/x-ndjson; charset=utf-8'
+        )
+        content = b''.join(response.streaming_content).decode()
+        return [json.loads(line) for line in content.splitlines()]
+
+    def test_exports_all_entries(self):
+        exported = self.get_exported_entries()
+        self.assertEqual(len(exported), self.n_items)
+        self.assertEqual(
+            list(exported[0].keys()),
+            ENTRY_DETAIL_FIELDS + ['timestamp']
+        )
+        self.assertEqual(
+            [item['link'] for item in exported],
+            list(Entry.objects.order_by(
+                'timestamp', 'id'
+            ).values_list('link', flat=True))
+        )
+
+    @override_settings(ENTRY_SYNC_TOKEN_LAG=0)
+    def test_exports_entries_after_sync_token(self):
+        response = self.client.get(self.endpoint_url)
+        sync_token = int(response['X-Sync-Token'])
+        self.assertEqual(sync_token, Entry.objects.order_by('-id')[0].id)
+
+        create_entry_objects(n_items=5, feed_url='https://www.newfeed.com/')
+        exported = self.get_exported_entries(after_id=sync_token)
+        self.assertEqual(len(exported), 5)
+
+    def test_exports_entries_since_timestamp(self):
+        since = timezone.now()
+        Entry.objects.filter(
+            pk__in=Entry.objects.order_by('id').values('id')[:10]
+        ).update(timestamp=since + timedelta(minutes=1))
+
+        exported = self.get_exported_entries(since=since.isoformat())
+        self.assertEqual(len(exported), 10)
+
+    def test_export_lines_escape_line_separators(self):
+        Entry.objects.update(title='Line\u2028separator')
+        exported = self.get_exported_entries()
+        self.assertEqual(len(exported), self.n_items)
+        self.assertEqual(exported[0]['title'], 'Line\u2028separator')
+
+    def test_invalid_since_timestamp(self):
+        for since in ['yesterday', '2020-13-45T00:00:00']:
+            response = self.client.get(
+                self.endpoint_url,
+                data={'since': since}
+            )
+            self.assert_http_status(response, 400)
+            self.assertIn('since', response.json())
+
+    def test_does_not_allow_post_request(self):
+        response = self.client.post(self.endpoint_url)
+        self.assert_http_status(response, 405)
+
+class EntryValuesSerializationTest(TestCase):
+    """Tests the fast path used to serialize lists of entries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        create_entry_objects(n_items=20)
+
+    def test_output_matches_entry_serializer(self):
+        entries = Entry.objects.all()
+        rows = entries.values(*EntrySerializer.Meta.fields)
+
+        renderer = JSONRenderer()
+        self.assertEqual(
+            renderer.render(serialize_entry_values(rows)),
+            renderer.render(EntrySerializer(entries, many=True).data)
+        )
+
+    def test_output_matches_with_unicode_and_utc(self):
+        row = {
+            'title': 'Caf\u00e9 \u2028 \U0001f4f0',
+            'summary': 'Line one\nLine "two"',
+            'published': Entry.objects.first().published,
+            'link': 'https://www.myfeed.com/caf\u00e9',
+        }
+        entry = Entry(**row)
+
+        renderer = JSONRenderer()
+        with self.settings(TIME_ZONE='UTC'):
+            self.assertEqual(
+                renderer.render(serialize_entry_values([row])),
+                renderer.render(EntrySerializer([entry], many=True).data)
+            )
+
+    def test_entry_list_renderer_output_matches(self):
+        rows = list(
+            Entry.objects.values(*EntrySerializer.Meta.fields)
+        )
+        rows[0]['title'] = 'Caf\u00e9 \u2028 \u2029 \U0001f4f0 "quoted"\n'
+        data = {
+            'count': len(rows),
+            'next': None,
+            'results': serialize_entry_values(rows),
+        }
+        self.assertEqual(
+            EntryListRenderer().render(data),
+            JSONRenderer().render(data)
+        )
+
+    def test_entry_list_renderer_falls_back_to_json_renderer(self):
+        data = [
+            {'detail': ErrorDetail('Not found.', code='not_found')},
+            {'published': Entry.objects.first().published},
+            {'amount': Decimal('1.50')},
+        ]
+        for value in data:
+            self.assertEqual(
+                EntryListRenderer().render(value),
+                JSONRenderer().render(value)
+            )
+        self.assertEqual(
+            EntryListRenderer().render(
+                data[0],
+                'application/json; indent=4'
+            ),
+            JSONRenderer().render(data[0], 'application/json; indent=4')
+        )
+
+    def test_output_matches_with_custom_datetime_format(self):
+        entries = Entry.objects.all()
+        rows = entries.values(*EntrySerializer.Meta.fields)
+
+        renderer = JSONRenderer()
+        rest_framework_settings = dict(
+            settings.REST_FRAMEWORK,
+            DATETIME_FORMAT='%d %b %Y %H:%M'
+        )
+        with self.settings(REST_FRAMEWORK=rest_framework_settings):
+            self.assertEqual(
+                renderer.render(serialize_entry_values(rows)),
+                renderer.render(EntrySerializer(entries, many=True).data)
+            )
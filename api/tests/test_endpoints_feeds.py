@@ -1,11 +1,15 @@
 from unittest.mock import patch
 
+from django.db import connection
 from django.shortcuts import reverse
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 from api.tests.helpers import (
     BaseFeedAPITestCase, create_entry_objects, FEED_DETAIL_FIELDS
 )
-from feeds.models import Feed
+from feeds.models import Entry, Feed, FeedEntry
+from feeds.utils.cache_tools import bump_generations
 
 
 class FeedListTest(BaseFeedAPITestCase):
@@ -26,6 +30,26 @@ class FeedListTest(BaseFeedAPITestCase):
         self.assertIsInstance(payload['results'], list)
         self.assertEqual(payload['count'], self.n_items)
 
+    def test_entries_count_of_each_feed(self):
+        feed = Feed.objects.get(pk=self.pk)
+        for entry in create_entry_objects(12, feed.link):
+            feed.entries.add(Entry.objects.get(link=entry.link))
+
+        response = self.client.get(self.endpoint_url)
+        counts = {
+            item['id']: item['entries_count']
+            for item in response.json()['results']
+        }
+        self.assertEqual(counts.pop(self.pk), 12)
+        self.assertFalse(any(counts.values()))
+
+    def test_query_count_does_not_grow_with_feeds(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.endpoint_url)
+        self.assert_http_status(response)
+        self.assertEqual(len(response.json()['results']), self.n_items)
+        self.assertLessEqual(len(queries), 2)
+
     def test_has_no_feeds_to_fetch(self):
         # delete all entries currently in db
         Feed.objects.all().delete()
@@ -36,6 +60,49 @@ class FeedListTest(BaseFeedAPITestCase):
         self.assertEqual(payload['count'], 0)
 
 
+class UnhealthyFeedListTest(BaseFeedAPITestCase):
+    """Tests GET request on `feed-unhealthy` endpoint.
+
+    This API call should return a paginated list of the Feed objects 
+    whose recent updates have kept failing.
+    """
+
+    def setUp(self):
+        self.create_and_authenticate_user('testadmin')
+        self.endpoint_url = reverse('feed-unhealthy')
+
+        feeds = list(self.feeds[:3])
+        for failures, feed in zip([3, 5, 2], feeds):
+            feed.consecutive_failures = failures
+            feed.last_error = 'ConnectionError: Name does not resolve'
+            feed.save()
+        self.unhealthy_ids = [feeds[1].pk, feeds[0].pk]
+
+    def test_lists_unhealthy_feeds(self):
+        response = self.client.get(self.endpoint_url)
+        payload = response.json()
+        self.assert_http_status(response)
+        self.assertEqual(payload['count'], 2)
+        self.assertEqual(
+            [item['id'] for item in payload['results']],
+            self.unhealthy_ids
+        )
+        self.assertEqual(payload['results'][0]['consecutive_failures'], 5)
+        self.assertEqual(
+            payload['results'][0]['last_error'],
+            'ConnectionError: Name does not resolve'
+        )
+
+    def test_health_fields_are_read_only(self):
+        url = reverse('feed-detail', kwargs={'pk': self.unhealthy_ids[0]})
+        response = self.client.patch(url, {'consecutive_failures': 0})
+        self.assert_http_status(response)
+        self.assertEqual(
+            Feed.objects.get(pk=self.unhealthy_ids[0]).consecutive_failures,
+            5
+        )
+
+
 class FeedDetailTest(BaseFeedAPITestCase):
     """Tests GET request on `feed-detail` endpoint.
 
@@ -165,10 +232,12 @@ class FeedEntriesListTest(BaseFeedAPITestCase):
     """
 
     def setUp(self):
+        super().setUp()
         self.create_and_authenticate_user('testadmin')
         self.endpoint_url = reverse('feed-entries', kwargs={'pk': self.pk})
         self.feed = Feed.objects.get(pk=self.pk)
 
+    @override_settings(ENTRY_SYNC_TOKEN_LAG=0)
     def test_valid_feed_entries_retrieval(self):
         # Create some Entry objects and associate with a Feed
         n_entries = 120
@@ -182,4 +251,51 @@ class FeedEntriesListTest(BaseFeedAPITestCase):
         payload = response.json()
         self.assert_http_status(response)
         self.assertIsInstance(payload['results'], list)
-        self.assertEqual(payload['count'], self.feed.entries.count())
+        self.assertEqual(len(payload['results']), 100)
+        self.assertNotIn('count', payload)
+
+        # Follow the cursor to the last page
+        response = self.client.get(payload['next'])
+        payload = response.json()
+        self.assert_http_status(response)
+        self.assertEqual(len(payload['results']), 20)
+        self.assertIsNone(payload['next'])
+
+        # Only entries newer than the sync token are listed
+        sync_token = int(response['X-Sync-Token'])
+        self.assertEqual(
+            sync_token,
+            FeedEntry.objects.order_by('-id')[0].id
+        )
+        response = self.client.get(
+            self.endpoint_url,
+            data={'after_id': sync_token}
+        )
+        self.assert_http_status(response)
+        self.assertFalse(response.json()['results'])
+
+        # Page numbers are still accepted
+        response = self.client.get(self.endpoint_url, data={'page': 1})
+        payload = response.json()
+        self.assert_http_status(response)
+        self.assertEqual(payload['count'], n_entries)
+
+    @override_settings(ENTRY_SYNC_TOKEN_LAG=0)
+    def test_entries_newly_linked_to_feed_are_synced(self):
+        entries = create_entry_objects(10, self.feed.link)
+        self.feed.entries.add(*entries[:5])
+        response = self.client.get(self.endpoint_url)
+        sync_token = int(response['X-Sync-Token'])
+
+        # An entry saved earlier for another feed is found in this feed
+        self.feed.entries.add(entries[5])
+        bump_generations([self.feed.pk])
+        response = self.client.get(
+            self.endpoint_url,
+            data={'after_id': sync_token}
+        )
+        self.assert_http_status(response)
+        self.assertEqual(
+            [item['link'] for item in response.json()['results']],
+            [entries[5].link]
+        )
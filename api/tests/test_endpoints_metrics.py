@@ -0,0 +1,47 @@
+from django.shortcuts import reverse
+from rest_framework import status
+
+from api.tests.helpers import (
+    BaseRSSAPITestCase, create_user_and_auth_token
+)
+
+
+class MetricsTest(BaseRSSAPITestCase):
+    """Tests GET request on `metrics` endpoint.
+
+    This API call should return the ingestion metrics in the
+    Prometheus text format, to admin users only.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.endpoint_url = reverse('metrics')
+
+    def authenticate(self, username, is_staff):
+        user, token = create_user_and_auth_token(
+            username=username,
+            is_staff=is_staff
+        )
+        self.client.force_authenticate(user=user, token=token)
+
+    def test_successful_get_request(self):
+        self.authenticate('testadmin', is_staff=True)
+        response = self.client.get(
+            self.endpoint_url,
+            HTTP_ACCEPT='text/plain;version=0.0.4;q=0.5,*/*;q=0.1'
+        )
+        self.assert_http_status(response)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn(
+            b'# TYPE rss_apifier_entries_saved_total counter',
+            response.content
+        )
+
+    def test_non_admin_users_are_forbidden(self):
+        self.authenticate('testuser', is_staff=False)
+        response = self.client.get(self.endpoint_url)
+        self.assert_http_status(response, status.HTTP_403_FORBIDDEN)
+
+    def test_anonymous_users_are_unauthorized(self):
+        response = self.client.get(self.endpoint_url)
+        self.assert_http_status(response, status.HTTP_401_UNAUTHORIZED)
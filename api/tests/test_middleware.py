@@ -0,0 +1,128 @@
+import logging
+
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.shortcuts import reverse
+from django.test import override_settings, RequestFactory, TestCase
+from django.urls import resolve
+
+from api.middleware import (
+    QUERY_COUNT_HEADER, QUERY_TIME_HEADER, QueryCountMiddleware
+)
+from api.queries import (
+    find_repeated_queries, get_query_budget, get_query_shape, Query
+)
+from feeds.api.views import EntryListViewSet, MetricsView
+
+
+def make_view(n_queries):
+    """Returns a view running the same query a number of times."""
+    def view(request):
+        for i in range(n_queries):
+            User.objects.filter(id=i).exists()
+        return HttpResponse('OK')
+    return view
+
+
+class QueryCountMiddlewareTest(TestCase):
+    """Tests the middleware recording the queries run for requests."""
+
+    def setUp(self):
+        # Logging is disabled while the tests of `feeds` are loaded
+        self.addCleanup(logging.disable, logging.root.manager.disable)
+        logging.disable(logging.NOTSET)
+
+        self.request = RequestFactory().get('/api/metrics/')
+        self.request.resolver_match = resolve(reverse('metrics'))
+
+    def test_query_count_headers_when_debug(self):
+        middleware = QueryCountMiddleware(make_view(1))
+        with override_settings(DEBUG=True):
+            response = middleware(self.request)
+        self.assertEqual(response[QUERY_COUNT_HEADER], '1')
+        self.assertGreaterEqual(float(response[QUERY_TIME_HEADER]), 0)
+
+    def test_no_query_count_headers_without_debug(self):
+        middleware = QueryCountMiddleware(make_view(1))
+        response = middleware(self.request)
+        self.assertFalse(response.has_header(QUERY_COUNT_HEADER))
+        self.assertFalse(response.has_header(QUERY_TIME_HEADER))
+
+    def test_warns_about_repeated_queries(self):
+        middleware = QueryCountMiddleware(make_view(5))
+        self.request.resolver_match = None
+        with self.assertLogs(level='WARNING') as logs:
+            middleware(self.request)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('ran 5 queries like: SELECT', logs.output[0])
+
+    def test_warns_about_requests_over_budget(self):
+        budget = MetricsView.query_budgets['get']
+        middleware = QueryCountMiddleware(make_view(budget + 1))
+        with self.assertLogs(level='WARNING') as logs:
+            middleware(self.request)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn(
+            f'ran {budget + 1} queries, over its budget of {budget}',
+            logs.output[0]
+        )
+
+    def test_no_warnings_within_budget(self):
+        middleware = QueryCountMiddleware(make_view(1))
+        with self.assertRaises(AssertionError):
+            with self.assertLogs(level='WARNING'):
+                middleware(self.request)
+
+
+class QueryToolsTest(TestCase):
+    """Tests the functions for finding repeated queries and budgets."""
+
+    def test_query_shape(self):
+        sql = (
+            'SELECT "id"\n  FROM "feeds_entry" '
+            'WHERE "id" IN (%s, %s,%s) AND "link" = %s'
+        )
+        self.assertEqual(
+            get_query_shape(sql),
+            'SELECT "id" FROM "feeds_entry" '
+            'WHERE "id" IN (%s, ...) AND "link" = %s'
+        )
+        self.assertEqual(
+            get_query_shape(sql),
+            get_query_shape(sql.replace('%s, %s,%s', '%s, %s'))
+        )
+
+    def test_find_repeated_queries(self):
+        queries = [
+            *[Query(f'SELECT 1 WHERE "id" IN (%s{", %s" * i})', 0)
+              for i in range(1, 5)],
+            *[Query('SELECT 2', 0)] * 3,
+        ]
+        self.assertEqual(
+            find_repeated_queries(queries, limit=3),
+            [('SELECT 1 WHERE "id" IN (%s, ...)', 4)]
+        )
+        self.assertEqual(find_repeated_queries(queries, limit=4), [])
+
+    @override_settings(API_QUERY_REPEAT_LIMIT=2)
+    def test_find_repeated_queries_default_limit(self):
+        queries = [Query('SELECT 2', 0)] * 3
+        self.assertEqual(find_repeated_queries(queries), [('SELECT 2', 3)])
+
+    def test_query_budget_of_viewset_action(self):
+        view = EntryListViewSet.as_view({'get': 'list'})
+        self.assertEqual(
+            get_query_budget(view, 'GET'),
+            EntryListViewSet.query_budgets['list']
+        )
+
+    def test_query_budget_of_api_view(self):
+        view = MetricsView.as_view()
+        self.assertEqual(
+            get_query_budget(view, 'GET'),
+            MetricsView.query_budgets['get']
+        )
+        self.assertIsNone(get_query_budget(view, 'POST'))
+
+    def test_no_query_budget(self):
+        self.assertIsNone(get_query_budget(make_view(0), 'GET'))
@@ -0,0 +1,128 @@
+from unittest.mock import patch
+
+from django.conf import settings
+from django.shortcuts import reverse
+from django.urls import URLPattern
+
+from api.queries import get_query_budget
+from api.tests.helpers import (
+    BaseFeedAPITestCase, create_entry_objects, create_user_and_auth_token,
+    QueryBudgetTestMixin
+)
+from api.urls import urlpatterns
+from feeds.api.routers import router as feed_api_router
+from feeds.models import Entry, Feed
+
+
+class QueryBudgetTest(QueryBudgetTestMixin, BaseFeedAPITestCase):
+    """Tests the queries run by each API endpoint.
+
+    Each endpoint should stay within the query budget declared by its
+    view, with enough feeds and entries that an N+1 query pattern
+    would show.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        # Give some feeds (including the one at `cls.pk`) 30 entries
+        # each, and mark them as unhealthy
+        entries = create_entry_objects(150)
+        feeds = [Feed.objects.get(pk=cls.pk)]
+        feeds.extend(cls.feeds.exclude(pk=cls.pk)[:4])
+        for i, feed in enumerate(feeds):
+            feed.entries.add(*entries[i * 30:(i + 1) * 30])
+            feed.consecutive_failures = settings.FEED_UNHEALTHY_FAILURES
+            feed.save()
+
+    def setUp(self):
+        super().setUp()
+        user, token = create_user_and_auth_token('testadmin', is_staff=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.feed_url = reverse('feed-detail', kwargs={'pk': self.pk})
+
+    def test_entry_list(self):
+        response = self.assert_within_query_budget(reverse('entry-list'))
+        self.assert_http_status(response)
+        self.assert_within_query_budget(response.json()['next'])
+        self.assert_within_query_budget(f'{reverse("entry-list")}?page=2')
+        self.assert_within_query_budget(
+            f'{reverse("entry-list")}?search=summary'
+        )
+
+    def test_entry_export(self):
+        response = self.assert_within_query_budget(reverse('entry-export'))
+        self.assert_http_status(response)
+
+    def test_feed_list(self):
+        response = self.assert_within_query_budget(reverse('feed-list'))
+        self.assert_http_status(response)
+        self.assertEqual(response.json()['count'], self.n_items)
+
+    def test_unhealthy_feed_list(self):
+        response = self.assert_within_query_budget(reverse('feed-unhealthy'))
+        self.assert_http_status(response)
+        self.assertEqual(response.json()['count'], 5)
+
+    def test_feed_detail(self):
+        response = self.assert_within_query_budget(self.feed_url)
+        self.assert_http_status(response)
+
+    def test_feed_entries(self):
+        url = reverse('feed-entries', kwargs={'pk': self.pk})
+        response = self.assert_within_query_budget(url)
+        self.assert_http_status(response)
+        self.assertEqual(len(response.json()['results']), 30)
+
+    @patch('feeds.api.views.Feed.fetch_and_set_feed_details')
+    def test_feed_create(self, mock_fetch):
+        response = self.assert_within_query_budget(
+            reverse('feed-list'),
+            method='post',
+            data={'link': 'https://www.feeds-me-up.com/'},
+            format='json'
+        )
+        self.assert_http_status(response, 201)
+
+    def test_feed_update(self):
+        feed = Feed.objects.get(pk=self.pk)
+        response = self.assert_within_query_budget(
+            self.feed_url,
+            method='put',
+            data={'link': feed.link, 'title': 'New Title'},
+            format='json'
+        )
+        self.assert_http_status(response)
+        response = self.assert_within_query_budget(
+            self.feed_url,
+            method='patch',
+            data={'title': 'Newer Title'},
+            format='json'
+        )
+        self.assert_http_status(response)
+
+    def test_feed_delete(self):
+        response = self.assert_within_query_budget(
+            self.feed_url,
+            method='delete'
+        )
+        self.assert_http_status(response, 204)
+        self.assertFalse(Entry.objects.filter(feeds=self.pk).exists())
+
+    def test_metrics(self):
+        response = self.assert_within_query_budget(reverse('metrics'))
+        self.assert_http_status(response)
+
+    def test_all_api_views_declare_budgets(self):
+        patterns = [
+            pattern for pattern in feed_api_router.urls + urlpatterns
+            if isinstance(pattern, URLPattern)
+            and pattern.callback.cls.__module__.startswith('feeds.')
+        ]
+        self.assertTrue(patterns)
+        for pattern in patterns:
+            view = pattern.callback
+            methods = getattr(view, 'actions', None) or {'get': 'get'}
+            for method in methods:
+                with self.subTest(pattern=str(pattern.pattern), method=method):
+                    self.assertIsNotNone(get_query_budget(view, method))
@@ -2,8 +2,10 @@ from django.urls import include, path
 from rest_framework.authtoken import views
 
 from feeds.api.routers import router as feed_api_router
+from feeds.api.views import MetricsView
 
 urlpatterns = [
     path('', include(feed_api_router.urls)),
     path('accounts/token/', views.obtain_auth_token, name='obtain-auth-token'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
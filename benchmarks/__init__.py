@@ -0,0 +1,26 @@
+"""
+Benchmarks for the app's hot paths
+
+The whole suite of ingestion and API benchmarks, whose results can be
+saved and compared with those of earlier runs, is run with:
+
+    $ python -m benchmarks
+
+Each module can also be run on its own, e.g.:
+
+    $ python -m benchmarks.bench_serializers
+
+Django is set up on import, using the development settings unless
+DJANGO_SETTINGS_MODULE is set. Micro-benchmarks (`bench_clean_text`,
+`bench_serializers`) do not touch the database; the others run against
+a throwaway test database (see `benchmarks.runner.test_database`).
+"""
+import os
+
+import django
+
+os.environ.setdefault(
+    'DJANGO_SETTINGS_MODULE',
+    'rss_apifier.settings.development'
+)
+django.setup()
@@ -0,0 +1,76 @@
+"""
+Benchmark suite for ingestion and the API's hot paths
+
+Runs the ingestion benchmarks (see `benchmarks.bench_ingestion`) and
+the API benchmarks (see `benchmarks.bench_api`) against a throwaway
+test database, and optionally saves the results as JSON and compares
+them with those of an earlier run.
+
+Usage:
+    $ python -m benchmarks [--output results.json]
+          [--baseline baseline.json] [--threshold 0.2]
+
+The command exits with status 1 if any result is worse than its
+baseline by more than the threshold, or if any query count grew.
+"""
+import argparse
+import sys
+
+from benchmarks import bench_api, bench_ingestion
+from benchmarks.runner import (
+    compare_results, load_results, test_database, write_results
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    bench_ingestion.add_arguments(parser)
+    bench_api.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs of each ingestion benchmark')
+    parser.add_argument('--requests', type=int, default=20,
+                        help='number of requests made to each endpoint')
+    parser.add_argument('--output', help='path of the JSON results file')
+    parser.add_argument('--baseline',
+                        help='path of the JSON results file to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='fraction by which results may regress')
+    parser.add_argument('--keepdb', action='store_true',
+                        help='keep the test database between runs')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with test_database(keepdb=args.keepdb):
+        results.update(bench_ingestion.run(
+            n_entries=args.entries,
+            n_feeds=args.feeds,
+            summary_size=args.summary_size,
+            repeat=args.repeat
+        ))
+        results.update(bench_api.run(
+            scales=args.scales,
+            repeat=args.requests
+        ))
+
+        if args.output:
+            write_results(results, args.output, options=vars(args))
+
+    width = max(len(name) for name in results)
+    for name, result in sorted(results.items()):
+        print(f'{name:{width}}  {result["value"]:>12} {result["unit"]}')
+
+    if args.baseline:
+        regressions = compare_results(
+            results,
+            load_results(args.baseline),
+            args.threshold
+        )
+        for name, old, new in regressions:
+            print(f'REGRESSION {name}: {old} -> {new}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions beyond {args.threshold:.0%} of the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Benchmark of the API endpoints that list entries and feeds
+
+The database is filled with synthetic entries, spread over one feed
+per thousand entries, at each of the given scales (e.g., 10k and 1M
+entries), and each endpoint is requested through Django's test client
+to measure its latency and the number of queries it runs:
+
+- `/api/entries/`, its next page, and a page of a feed's entries,
+  each with the page cache cleared before every request (cold) and,
+  for the list of all entries, served from the page cache (cached)
+- `/api/feeds/`
+
+Rows are inserted with set-based SQL, so that filling the database
+with a million entries takes seconds rather than hours.
+
+Usage:
+    $ python -m benchmarks.bench_api [--scales N [N ...]] [--repeat N]
+"""
+import argparse
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from benchmarks.runner import (
+    make_result, QUERIES, summarize_times, test_database, time_calls
+)
+from feeds.models import Entry, Feed, FeedEntry
+
+ENTRIES_PER_FEED = 1000
+
+
+def fill_database(n_entries):
+    """Adds synthetic feeds and entries up to the given count.
+
+    Entries already saved by a smaller scale are kept, so that
+    scales are filled one after the other.
+    """
+    n_feeds = max(n_entries // ENTRIES_PER_FEED, 1)
+    first_feed = Feed.objects.count() + 1
+    Feed.objects.bulk_create(
+        Feed(
+            link=f'https://bench.example.com/feeds/{i}',
+            title=f'Benchmark feed {i}',
+            version='rss20'
+        )
+        for i in range(first_feed, n_feeds + 1)
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {Entry._meta.db_table}
+                (link, published, timestamp, title, summary)
+            SELECT
+                'https://bench.example.com/entries/' || i,
+                now() - i * interval '1 minute',
+                now(),
+                'Benchmark entry ' || i,
+                repeat('Summary of a benchmark entry. ', 15)
+            FROM generate_series(%s, %s) AS i
+            """,
+            [Entry.objects.count() + 1, n_entries]
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {FeedEntry._meta.db_table}
+                (entry_id, feed_id, linked_at)
+            SELECT entry.id, feed.id, now()
+            FROM {Entry._meta.db_table} AS entry
+            JOIN (
+                SELECT id, row_number() OVER (ORDER BY id) - 1 AS n
+                FROM {Feed._meta.db_table}
+            ) AS feed ON feed.n = entry.id %% %s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {FeedEntry._meta.db_table} AS link
+                WHERE link.entry_id = entry.id
+            )
+            """,
+            [n_feeds]
+        )
+        cursor.execute(f'ANALYZE {Entry._meta.db_table}')
+        cursor.execute(f'ANALYZE {FeedEntry._meta.db_table}')
+
+
+def measure_request(client, url, repeat, cold=True):
+    """Requests a URL several times.
+
+    Args:
+        client (APIClient): authenticated client
+        url (str): URL to request
+        repeat (int): number of requests
+        cold (bool): if True, the page cache is cleared before each
+            request, so that pages are never served from it
+
+    Returns:
+        tuple: (median ms, 95th percentile ms, queries per request)
+    """
+    def request():
+        if cold:
+            cache.clear()
+        response = client.get(url)
+        assert response.status_code == 200, f'{url}: {response.status_code}'
+        return response
+
+    request()   # warm up connections and caches other than the page cache
+    if cold:
+        cache.clear()
+    with CaptureQueriesContext(connection) as queries:
+        client.get(url)
+    n_queries = len(queries)
+
+    median, p95 = summarize_times(time_calls(request, repeat))
+    return median, p95, n_queries
+
+
+def bench_endpoints(client, scale, repeat):
+    """Measures each endpoint at the current scale.
+
+    Returns:
+        dict: results by name
+    """
+    entries_url = reverse('entry-list')
+    next_url = client.get(entries_url).json()['next']
+    feed = Feed.objects.order_by('id').first()
+    cases = [
+        ('entries.list', entries_url, True),
+        ('entries.list_cached', entries_url, False),
+        ('entries.next_page', next_url, True),
+        ('feeds.entries', reverse('feed-entries', args=[feed.pk]), True),
+        ('feeds.list', reverse('feed-list'), True),
+    ]
+
+    results = {}
+    for case, url, cold in cases:
+        median, p95, n_queries = measure_request(client, url, repeat, cold)
+        name = f'api.{case}.{scale}'
+        results[f'{name}.median_ms'] = make_result(median, 'ms')
+        results[f'{name}.p95_ms'] = make_result(p95, 'ms')
+        results[f'{name}.queries'] = make_result(n_queries, QUERIES)
+    return results
+
+
+def run(scales=(10000, 1000000), repeat=20):
+    """Runs the API benchmarks at each scale.
+
+    All feeds and entries are deleted first, so that only synthetic 
+    ones are listed.
+
+    Args:
+        scales (iterable): numbers of entries in the database
+        repeat (int): number of requests made to each endpoint
+
+    Returns:
+        dict: results by name (see `benchmarks.runner`)
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'TRUNCATE {FeedEntry._meta.db_table}, {Entry._meta.db_table}, '
+            f'{Feed._meta.db_table} RESTART IDENTITY'
+        )
+    user, _ = User.objects.get_or_create(
+        username='benchmark-admin',
+        defaults={'is_staff': True}
+    )
+    client = APIClient()
+    client.force_authenticate(user=user)
+
+    # Requests are all served by this process, which shares its cache
+    # with itself, so pages may be cached without Redis
+    results = {}
+    with override_settings(ENTRY_PAGE_CACHE_ENABLED=True):
+        for scale in sorted(scales):
+            fill_database(scale)
+            results.update(bench_endpoints(client, scale, repeat))
+
+    user.delete()
+    return results
+
+
+def add_arguments(parser):
+    parser.add_argument('--scales', type=int, nargs='+',
+                        default=[10000, 1000000],
+                        help='numbers of entries to measure endpoints at')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--keepdb', action='store_true')
+    args = parser.parse_args(argv)
+
+    with test_database(keepdb=args.keepdb):
+        results = run(scales=args.scales, repeat=args.repeat)
+    for name, result in results.items():
+        print(f'{name}: {result["value"]} {result["unit"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark of the HTML stripping applied to each ingested entry
+
+Compares `clean_text` with its previous implementation, built on
+Django's `strip_tags`, over summaries as found in real feeds, and over
+one long summary made of all of them.
+
+Usage:
+    $ python -m benchmarks.bench_clean_text [--number N] [--repeat N]
+"""
+import argparse
+import json
+import timeit
+
+from django.utils.html import strip_tags
+
+from feeds.tests.helpers import FEED_SUMMARIES_PATH
+from feeds.utils.feed_tools import clean_text
+
+
+def strip_tags_clean_text(text):
+    """Previous implementation of `clean_text`."""
+    no_html_tags = strip_tags(text)
+    return no_html_tags.replace('&nbsp;', ' ')
+
+
+def load_summaries():
+    """Returns the corpus of summaries, plus one long summary."""
+    with open(FEED_SUMMARIES_PATH, encoding='utf-8') as f:
+        summaries = json.load(f)
+    return summaries + [''.join(summaries * 10)]
+
+
+def time_per_summary(func, summaries, number, repeat):
+    """Returns the best time per summary of the given function in µs."""
+    def run():
+        for summary in summaries:
+            func(summary)
+
+    best = min(timeit.repeat(run, number=number, repeat=repeat))
+    return best / number / len(summaries) * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--number', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    summaries = load_summaries()
+    corpora = [
+        ('feed summaries', summaries[:-1]),
+        ('long summary', summaries[-1:]),
+    ]
+    print(f'Cleaning summaries (best of {args.repeat}):')
+    for name, corpus in corpora:
+        before = time_per_summary(
+            strip_tags_clean_text, corpus, args.number, args.repeat
+        )
+        after = time_per_summary(clean_text, corpus, args.number, args.repeat)
+        print(f'  {name}:')
+        print(f'    strip_tags: {before:10.2f} µs/summary')
+        print(f'    clean_text: {after:10.2f} µs/summary')
+        print(f'    speedup:    {before / after:10.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Benchmark of fetching and saving the entries of feeds
+
+Feeds are served by a local HTTP stand-in (see
+`benchmarks.feed_server`), and entries are saved into the database, so
+this measures the whole ingestion path but the network:
+
+- `Feed.update_feed_entries` throughput for a single RSS or Atom
+  feed, in entries saved per second
+- `fetch_entries` end-to-end time for several feeds, both when all
+  entries are new and when no feed has changed (HTTP 304)
+
+Host throttling (see `feeds.utils.throttling`) is relaxed, since all
+feeds are served from the same local host.
+
+Usage:
+    $ python -m benchmarks.bench_ingestion [--entries N] [--feeds N]
+"""
+import argparse
+import itertools
+import uuid
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from benchmarks.feed_server import FEED_FORMATS, FeedServer
+from benchmarks.runner import (
+    make_result, summarize_times, test_database, time_calls
+)
+from feeds.models import Feed
+from feeds.tasks import fetch_entries
+
+
+def relaxed_throttling(n_feeds):
+    """Lets all feeds be downloaded from the local host at once."""
+    return override_settings(
+        FEED_HOST_RATE=1000,
+        FEED_HOST_BURST=max(n_feeds, 1),
+        FEED_FETCH_MAX_PER_HOST=10000,
+        FEED_FETCH_MAX_CONCURRENCY=10000
+    )
+
+
+def create_feed(url):
+    """Creates a Feed, which downloads the feed once for its details."""
+    return Feed.objects.create(link=url)
+
+
+def bench_update_feed_entries(server, n_entries, repeat):
+    """Measures how fast a feed's entries are saved.
+
+    Each repetition updates a new feed, so that all of its entries
+    are new.
+
+    Returns:
+        dict: results by name
+    """
+    results = {}
+    for feed_format in FEED_FORMATS:
+        feeds = iter([
+            create_feed(
+                server.feed_url(feed_format, n_entries, uuid.uuid4().hex)
+            )
+            for _ in range(repeat)
+        ])
+        times = time_calls(
+            lambda: next(feeds).update_feed_entries(),
+            repeat
+        )
+
+        name = f'ingest.update_feed_entries.{feed_format}.{n_entries}'
+        results[f'{name}.entries_per_second'] = make_result(
+            n_entries / min(times),
+            'entries/s',
+            better='higher'
+        )
+        results[f'{name}.median_ms'] = make_result(
+            summarize_times(times)[0],
+            'ms'
+        )
+    return results
+
+
+def bench_fetch_entries(server, n_feeds, n_entries, repeat):
+    """Measures `fetch_entries` end to end for several feeds.
+
+    Each repetition fetches a new set of feeds, first when all of
+    their entries are new, then again when none of them has changed.
+
+    Returns:
+        dict: results by name
+    """
+    formats = itertools.cycle(FEED_FORMATS)
+    updated_times = []
+    unchanged_times = []
+    for _ in range(repeat):
+        Feed.objects.all().delete()
+        for _ in range(n_feeds):
+            create_feed(
+                server.feed_url(next(formats), n_entries, uuid.uuid4().hex)
+            )
+
+        updated_times.extend(time_calls(
+            lambda: fetch_entries(fan_out=False),
+            1
+        ))
+        Feed.objects.update(next_fetch_at=None)
+        unchanged_times.extend(time_calls(
+            lambda: fetch_entries(fan_out=False),
+            1
+        ))
+
+    name = f'ingest.fetch_entries.{n_feeds}x{n_entries}'
+    return {
+        f'{name}.updated.seconds': make_result(min(updated_times), 's'),
+        f'{name}.updated.feeds_per_second': make_result(
+            n_feeds / min(updated_times),
+            'feeds/s',
+            better='higher'
+        ),
+        f'{name}.not_modified.seconds': make_result(
+            min(unchanged_times),
+            's'
+        ),
+    }
+
+
+def run(n_entries=500, n_feeds=50, summary_size=500, repeat=3):
+    """Runs the ingestion benchmarks.
+
+    Args:
+        n_entries (int): number of entries in each feed document
+        n_feeds (int): number of feeds fetched by `fetch_entries`
+        summary_size (int): approximate size of each entry's summary
+        repeat (int): number of times each benchmark is run
+
+    Returns:
+        dict: results by name (see `benchmarks.runner`)
+    """
+    cache.clear()
+    results = {}
+    with FeedServer(summary_size=summary_size) as server, \
+            relaxed_throttling(n_feeds):
+        results.update(bench_update_feed_entries(server, n_entries, repeat))
+        results.update(
+            bench_fetch_entries(server, n_feeds, n_entries, repeat)
+        )
+    return results
+
+
+def add_arguments(parser):
+    parser.add_argument('--entries', type=int, default=500,
+                        help='number of entries in each feed document')
+    parser.add_argument('--feeds', type=int, default=50,
+                        help='number of feeds fetched by fetch_entries')
+    parser.add_argument('--summary-size', type=int, default=500,
+                        help='approximate size of each entry summary')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--keepdb', action='store_true')
+    args = parser.parse_args(argv)
+
+    with test_database(keepdb=args.keepdb):
+        results = run(
+            n_entries=args.entries,
+            n_feeds=args.feeds,
+            summary_size=args.summary_size,
+            repeat=args.repeat
+        )
+    for name, result in results.items():
+        print(f'{name}: {result["value"]} {result["unit"]}')
+
+
+if __name__ == '__main__':
+    main()
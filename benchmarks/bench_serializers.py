@@ -0,0 +1,85 @@
+"""
+Benchmark of the serialization of a page of entries
+
+Compares the per-row cost of `EntrySerializer` with that of the fast
+path used by the API (`serialize_entry_values`, rendered by
+`EntryListRenderer`), both including the rendering of the JSON
+response body.
+
+Usage:
+    $ python -m benchmarks.bench_serializers [--rows N] [--repeat N]
+"""
+import argparse
+from datetime import timedelta
+import timeit
+
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from feeds.api.renderers import EntryListRenderer
+from feeds.api.serializers import EntrySerializer, serialize_entry_values
+from feeds.models import Entry
+
+
+def make_rows(n_rows):
+    """Returns fake rows as returned by `Entry.objects.values()`."""
+    now = timezone.now()
+    return [
+        {
+            'title': f'Entry title number {i}',
+            'summary': f'Summary of entry number {i}. ' * 10,
+            'published': now - timedelta(minutes=i),
+            'link': f'https://www.samplefeeds.com/entries/{i}',
+        }
+        for i in range(n_rows)
+    ]
+
+
+def bench_entry_serializer(rows):
+    """Builds model instances and runs EntrySerializer, as DRF does."""
+    renderer = JSONRenderer()
+
+    def run():
+        entries = [Entry(**row) for row in rows]
+        return renderer.render(EntrySerializer(entries, many=True).data)
+
+    return run
+
+
+def bench_entry_values(rows):
+    """Serializes the rows with the fast path."""
+    renderer = EntryListRenderer()
+
+    def run():
+        return renderer.render(serialize_entry_values(rows))
+
+    return run
+
+
+def time_per_row(func, n_rows, repeat):
+    """Returns the best per-row time of the given function in µs."""
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    return best / n_rows * 1e6
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    rows = make_rows(args.rows)
+    before = bench_entry_serializer(rows)
+    after = bench_entry_values(rows)
+    assert before() == after(), 'Fast path output differs'
+
+    before_time = time_per_row(before, args.rows, args.repeat)
+    after_time = time_per_row(after, args.rows, args.repeat)
+    print(f'Serializing {args.rows} entries (best of {args.repeat}):')
+    print(f'  EntrySerializer:        {before_time:8.2f} µs/row')
+    print(f'  serialize_entry_values: {after_time:8.2f} µs/row')
+    print(f'  speedup:                {before_time / after_time:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
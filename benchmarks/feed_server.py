@@ -0,0 +1,207 @@
+"""
+Local HTTP stand-in serving synthetic feeds to benchmarks
+
+Feeds are served at paths of the form `/<format>/<entries>/<name>.xml`,
+where format is either `rss` or `atom`, and entries is the number of
+entries in the document. Documents with the same path are the same, so
+that feeds can be fetched again, and each entry's link includes the
+feed's name, so that feeds with different names have no entries in
+common. Documents are generated on first request and kept in memory,
+so that generating them is not part of what is measured. Conditional
+requests are answered with HTTP 304.
+
+Usage:
+    with FeedServer(summary_size=500) as server:
+        url = server.feed_url('rss', 100, 'feed-1')
+"""
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+import hashlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import threading
+from xml.sax.saxutils import escape
+
+import pytz
+
+FEED_FORMATS = ('rss', 'atom')
+
+CONTENT_TYPES = {
+    'rss': 'application/rss+xml; charset=utf-8',
+    'atom': 'application/atom+xml; charset=utf-8',
+}
+
+# Published date of the newest entry of every document, so that the
+# same path always yields the same document
+NEWEST_ENTRY_DATE = datetime(2020, 1, 1, tzinfo=pytz.UTC)
+
+SUMMARY_WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+    'eiusmod tempor incididunt ut labore et dolore magna aliqua'
+).split()
+
+
+def make_summary(size, seed):
+    """Returns an HTML summary of roughly `size` characters."""
+    words = []
+    length = 0
+    i = seed
+    while length < size:
+        word = SUMMARY_WORDS[i % len(SUMMARY_WORDS)]
+        words.append(word)
+        length += len(word) + 1
+        i += 7
+    text = ' '.join(words)
+    return f'<p>{text[:size // 2]}</p><p><b>{text[size // 2:]}</b></p>'
+
+
+def make_feed_document(feed_format, n_entries, base_url, summary_size=500):
+    """Generates an RSS 2.0 or Atom document.
+
+    Args:
+        feed_format (str): either 'rss' or 'atom'
+        n_entries (int): number of entries in the document
+        base_url (str): URL of the feed; entry links are made from it
+        summary_size (int): approximate size of each entry's summary
+
+    Returns:
+        bytes: the UTF-8 encoded document
+    """
+    entries = []
+    for i in range(n_entries):
+        link = escape(f'{base_url}/entries/{i}')
+        title = escape(f'Entry number {i}')
+        summary = escape(make_summary(summary_size, i))
+        published = NEWEST_ENTRY_DATE - timedelta(minutes=i)
+        if feed_format == 'rss':
+            entries.append(
+                f'<item><title>{title}</title><link>{link}</link>'
+                f'<description>{summary}</description>'
+                f'<pubDate>{format_datetime(published)}</pubDate></item>'
+            )
+        else:
+            entries.append(
+                f'<entry><title>{title}</title>'
+                f'<link rel="alternate" href="{link}"/><id>{link}</id>'
+                f'<summary type="html">{summary}</summary>'
+                f'<updated>{published.isoformat()}</updated></entry>'
+            )
+
+    url = escape(base_url)
+    if feed_format == 'rss':
+        document = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<rss version="2.0"><channel>\n'
+            f'<title>Benchmark Feed</title><link>{url}</link>\n'
+            '<description>Synthetic feed</description>\n'
+            f'{"".join(entries)}</channel></rss>\n'
+        )
+    else:
+        document = (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<feed xmlns="http://www.w3.org/2005/Atom">\n'
+            f'<title>Benchmark Feed</title><id>{url}</id>\n'
+            f'<link rel="alternate" href="{url}"/>\n'
+            f'<updated>{NEWEST_ENTRY_DATE.isoformat()}</updated>\n'
+            f'{"".join(entries)}</feed>\n'
+        )
+    return document.encode()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    """Serves the documents of the server's `FeedServer`."""
+
+    def do_GET(self):
+        try:
+            content, feed_format = self.server.feed_server.get_document(
+                self.path
+            )
+        except ValueError:
+            self.send_error(404)
+            return
+
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[feed_format])
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FeedServer:
+    """Serves synthetic feeds on a local port from a background thread.
+
+    Args:
+        summary_size (int): approximate size of each entry's summary
+    """
+
+    def __init__(self, summary_size=500):
+        self.summary_size = summary_size
+        self._documents = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(
+            ('127.0.0.1', 0),
+            FeedRequestHandler
+        )
+        self._server.feed_server = self
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            daemon=True
+        )
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def feed_url(self, feed_format, n_entries, name):
+        """Returns the URL of a synthetic feed."""
+        return f'{self.base_url}/{feed_format}/{n_entries}/{name}.xml'
+
+    def get_document(self, path):
+        """Returns the document served at a path, and its format.
+
+        Raises:
+            ValueError: if no document is served at the path
+        """
+        feed_format, n_entries, name = path.lstrip('/').split('/')
+        if feed_format not in FEED_FORMATS or not name.endswith('.xml'):
+            raise ValueError(f'No feed at {path}')
+
+        with self._lock:
+            if path not in self._documents:
+                self._documents[path] = make_feed_document(
+                    feed_format,
+                    int(n_entries),
+                    f'{self.base_url}/{feed_format}/{name[:-4]}',
+                    self.summary_size
+                )
+            return self._documents[path], feed_format
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
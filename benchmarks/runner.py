@@ -0,0 +1,150 @@
+"""
+Helpers for running the benchmark suite and comparing its results
+
+Results are kept as a dict mapping result names (e.g.,
+`api.entries.list.10000.median_ms`) to dicts with the measured
+`value`, its `unit`, and whether `higher` or `lower` values are
+better. Results saved as JSON by one run can be compared with those
+of another, so that regressions fail a threshold.
+
+Functions:
+    test_database(keepdb=False)
+    make_result(value, unit, better='lower')
+    time_calls(func, repeat)
+    summarize_times(times)
+    compare_results(results, baseline, threshold)
+    write_results(results, path, options=None)
+    load_results(path)
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import platform
+import statistics
+import time
+
+import django
+from django.db import connection
+from django.test import override_settings
+
+# Unit of query counts, which regress on any increase
+QUERIES = 'queries'
+
+
+@contextmanager
+def test_database(keepdb=False):
+    """Runs benchmarks against a throwaway copy of the database.
+
+    The database is created as for the test suite, but under its own
+    name (`benchmark_<NAME>`), so that benchmarks touch neither the
+    data of the configured database nor the test suite's database.
+    A database left by an interrupted run is replaced. As in the test
+    suite, DEBUG is turned off, so that queries are not logged.
+
+    Args:
+        keepdb (bool): if True, the database is kept between runs
+            instead of being created and destroyed each time
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.settings_dict['TEST']['NAME'] = f'benchmark_{old_name}'
+    connection.creation.create_test_db(
+        verbosity=0,
+        autoclobber=True,
+        keepdb=keepdb
+    )
+    try:
+        with override_settings(DEBUG=False):
+            yield
+    finally:
+        connection.creation.destroy_test_db(
+            old_name,
+            verbosity=0,
+            keepdb=keepdb
+        )
+
+
+def make_result(value, unit, better='lower'):
+    """Returns a result as stored in the results dict."""
+    return {'value': round(value, 3), 'unit': unit, 'better': better}
+
+
+def time_calls(func, repeat):
+    """Calls a function several times and returns how long each took.
+
+    Returns:
+        list: seconds taken by each call
+    """
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def summarize_times(times):
+    """Returns the median and 95th percentile of times, in ms."""
+    ordered = sorted(times)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return statistics.median(ordered) * 1000, p95 * 1000
+
+
+def compare_results(results, baseline, threshold):
+    """Finds results that regressed since a baseline run.
+
+    Args:
+        results (dict): results of this run
+        baseline (dict): results of the baseline run; results missing
+            from either run are not compared
+        threshold (float): fraction by which a result may be worse
+            than its baseline (e.g., 0.2 for 20%); query counts may
+            not grow at all
+
+    Returns:
+        list: (name, baseline value, value) tuples of regressed results
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+
+        old = baseline[name]['value']
+        new = result['value']
+        if result['unit'] == QUERIES:
+            regressed = new > old
+        elif result['better'] == 'higher':
+            regressed = new < old * (1 - threshold)
+        else:
+            regressed = new > old * (1 + threshold)
+        if regressed:
+            regressions.append((name, old, new))
+    return regressions
+
+
+def write_results(results, path, options=None):
+    """Saves results as JSON, along with how they were obtained.
+
+    Args:
+        results (dict): results of this run
+        path (str): path of the JSON file
+        options (dict): options the suite was run with
+    """
+    document = {
+        'created': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'machine': platform.machine(),
+        },
+        'options': options or {},
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+
+def load_results(path):
+    """Returns the results saved by `write_results`."""
+    with open(path) as f:
+        return json.load(f)['results']
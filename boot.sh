@@ -22,6 +22,13 @@ if [ $1 = "gunicorn" ]; then
   python manage.py collectstatic --noinput
   python manage.py migrate --noinput
   python manage.py create_auth_admin_user
+
+fi
+
+# Drop metrics left by processes of this container before it restarted;
+# files of other containers sharing the directory are in use by them
+if [ -n "${prometheus_multiproc_dir:-}" ]; then
+  rm -f "$prometheus_multiproc_dir"/*_"$(hostname)"_*.db
 fi
 
 exec $cmd
\ No newline at end of file
@@ -1,15 +1,52 @@
 from django.contrib import admin, messages
 from django.http import HttpResponseRedirect
+from django.utils import timezone
 
 from feeds.forms import FeedAdminAddForm, FeedAdminChangeForm
 from feeds.models import Feed
 
 
+class FeedHealthListFilter(admin.SimpleListFilter):
+    """Filters feeds by how their recent updates went."""
+    title = 'health'
+    parameter_name = 'health'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('unhealthy', 'Unhealthy'),
+            ('backed_off', 'Backed off after failures'),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'unhealthy':
+            return queryset.unhealthy()
+        if self.value() == 'backed_off':
+            return queryset.filter(disabled_until__gt=timezone.now())
+        return queryset
+
+
 @admin.register(Feed)
 class FeedAdmin(admin.ModelAdmin):
-    list_display = ['title', 'description', 'version', 'link']
+    list_display = [
+        'title',
+        'description',
+        'version',
+        'link',
+        'next_fetch_at',
+        'consecutive_failures',
+        'last_success_at',
+    ]
+    list_filter = [FeedHealthListFilter]
     form = FeedAdminAddForm
 
+    # Health of a saved feed, shown but not edited on its change page
+    health_fields = [
+        'consecutive_failures',
+        'last_error',
+        'last_success_at',
+        'disabled_until',
+    ]
+
     def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
         """Ensures errors are handled when submitting forms in admin.
 
@@ -23,6 +60,11 @@ class FeedAdmin(admin.ModelAdmin):
             return HttpResponseRedirect(form_url)
         return response
 
+    def get_readonly_fields(self, request, obj=None):
+        if obj:
+            return self.health_fields
+        return super().get_readonly_fields(request, obj)
+
     def get_form(self, request, obj=None, **kwargs):
         if obj:
             return FeedAdminChangeForm
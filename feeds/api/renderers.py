@@ -0,0 +1,51 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+
+# Values that orjson would encode otherwise than DRF's JSONEncoder
+# (e.g., datetimes, or lazy strings) are passed to `reject_value`, so
+# that the data is rendered by JSONRenderer instead
+ORJSON_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATACLASS |
+    orjson.OPT_PASSTHROUGH_DATETIME |
+    orjson.OPT_PASSTHROUGH_SUBCLASS
+)
+
+
+def reject_value(value):
+    """Leaves a value orjson does not encode as DRF does to DRF."""
+    raise TypeError(f'{type(value).__name__} is left to JSONRenderer')
+
+
+class EntryListRenderer(JSONRenderer):
+    """Renders lists of entries with orjson, byte-for-byte as DRF does.
+
+    Pages of serialized entries (see `serialize_entry_values`) only
+    hold strings, integers, and None, which orjson encodes the same
+    way as `JSONRenderer`, only faster. Any other data (e.g., an error
+    response), indented output, and settings under which DRF escapes
+    non-ASCII characters or adds spaces, are left to `JSONRenderer`.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if data is not None and not (
+                indent or self.ensure_ascii or not self.compact):
+            try:
+                ret = orjson.dumps(
+                    data,
+                    default=reject_value,
+                    option=ORJSON_OPTIONS
+                )
+            except TypeError:
+                pass
+            else:
+                # As JSONRenderer does, escape the line and paragraph
+                # separators, which are valid in JSON but not in
+                # JavaScript
+                return ret.replace(
+                    '\u2028'.encode(), b'\\u2028'
+                ).replace(
+                    '\u2029'.encode(), b'\\u2029'
+                )
+
+        return super().render(data, accepted_media_type, renderer_context)
@@ -1,4 +1,7 @@
-from rest_framework import serializers
+import json
+
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
 from feeds.models import Entry, Feed
 
@@ -10,6 +13,76 @@ class EntrySerializer(serializers.ModelSerializer):
         fields = ['title', 'summary', 'published', 'link']
 
 
+def serialize_entry_values(rows):
+    """Serializes entries fetched with `.values()`, read-only.
+
+    This is a fast path for lists of entries: instead of building 
+    model instances and running every field of `EntrySerializer` 
+    on each row, it only formats `published`, the same way as 
+    `EntrySerializer` does, so the rendered JSON is identical.
+
+    Args:
+        rows (iterable): dicts returned by 
+            `Entry.objects.values(*EntrySerializer.Meta.fields)`
+
+    Returns:
+        list: the serialized entries
+    """
+    format_datetime = get_datetime_formatter()
+    return [
+        dict(row, published=format_datetime(row['published']))
+        for row in rows
+    ]
+
+
+def iter_entry_lines(rows, datetime_fields=('published',)):
+    """Serializes entries fetched with `.values()` as JSON lines.
+
+    Each entry is encoded as compact JSON on a line of its own 
+    (newline-delimited JSON), with line and paragraph separators 
+    escaped so that they cannot be mistaken for line breaks.
+
+    Args:
+        rows (iterable): dicts returned by `Entry.objects.values()`
+        datetime_fields (tuple): names of the datetime fields in rows
+
+    Yields:
+        str: one line per entry, including the trailing newline
+    """
+    format_datetime = get_datetime_formatter()
+    for row in rows:
+        for field in datetime_fields:
+            row[field] = format_datetime(row[field])
+        line = json.dumps(row, ensure_ascii=False, separators=(',', ':'))
+        yield line.replace('\u2028', '\\u2028').replace(
+            '\u2029', '\\u2029'
+        ) + '\n'
+
+
+def get_datetime_formatter():
+    """Returns a function that formats datetimes like DRF does.
+
+    With the default ISO 8601 format and time zone support, the 
+    output format and time zone are looked up once instead of for 
+    every value, as `DateTimeField.to_representation` does.
+    """
+    datetime_field = serializers.DateTimeField()
+    output_format = api_settings.DATETIME_FORMAT
+    field_timezone = datetime_field.default_timezone()
+    if (output_format is None
+            or output_format.lower() != ISO_8601
+            or field_timezone is None):
+        return datetime_field.to_representation
+
+    def format_datetime(value):
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    return format_datetime
+
+
 class FeedSerializer(serializers.HyperlinkedModelSerializer):
     entries_list = serializers.HyperlinkedIdentityField(
         view_name='feed-entries',
@@ -29,7 +102,17 @@ class FeedSerializer(serializers.HyperlinkedModelSerializer):
             'link',
             'version',
             'entries_count',
-            'entries_list'
+            'entries_list',
+            'consecutive_failures',
+            'last_error',
+            'last_success_at',
+            'disabled_until',
+        ]
+        read_only_fields = [
+            'consecutive_failures',
+            'last_error',
+            'last_success_at',
+            'disabled_until',
         ]
         extra_kwargs = {
             'title': {'required': False},
@@ -38,4 +121,9 @@ class FeedSerializer(serializers.HyperlinkedModelSerializer):
         }
 
     def count_entries(self, feed):
-        return feed.entries.count()
+        # Use the count annotated by Feed.objects.with_entries_count(), 
+        # if any, to avoid one COUNT query per feed
+        entries_count = getattr(feed, 'entries_count', None)
+        if entries_count is None:
+            entries_count = feed.entries.count()
+        return entries_count
@@ -1,29 +1,309 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from api.pagination import get_entry_paginator
+from feeds.api.renderers import EntryListRenderer
+from feeds.api.serializers import (
+    EntrySerializer, FeedSerializer, iter_entry_lines, serialize_entry_values
+)
+from feeds.models import Entry, Feed, FeedEntry
+from feeds.utils.cache_tools import (
+    get_last_modified, make_etag, make_page_key
+)
+from feeds.utils.metrics import CONTENT_TYPE_LATEST, generate_metrics
+
+# Response header with a sync token; passing it back as `after_id`
+# returns only entries saved (or linked to the feed) since
+SYNC_TOKEN_HEADER = 'X-Sync-Token'
+
+
+class CachedEntryListMixin:
+    """Serves pages of entries from the cache when possible."""
+
+    def filter_entries(self, queryset, feed_id=None):
+        """Filters entries by the sync-related query parameters.
+
+        Args:
+            queryset (QuerySet): the entries to filter
+            feed_id (int): ID of the feed whose entries are filtered, 
+                or None for the list of all entries
+
+        Returns:
+            QuerySet: entries saved at or after `since` (an ISO 8601 
+                datetime), and saved (or, for a feed's entries, linked 
+                to the feed) after `after_id` (a sync token from an 
+                earlier response, see `get_sync_token`), if given
+
+        Raises:
+            ValidationError: if a parameter has an invalid value
+        """
+        params = self.request.query_params
+
+        since = params.get('since')
+        if since:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                raise ValidationError(
+                    {'since': 'Enter a valid ISO 8601 datetime.'}
+                )
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            queryset = queryset.filter(timestamp__gte=since)
+
+        after_id = params.get('after_id')
+        if after_id:
+            if not after_id.isdecimal():
+                raise ValidationError(
+                    {'after_id': 'Enter a valid sync token.'}
+                )
+            if feed_id is None:
+                queryset = queryset.filter(id__gt=int(after_id))
+            else:
+                queryset = queryset.filter(id__in=FeedEntry.objects.filter(
+                    feed_id=feed_id,
+                    id__gt=int(after_id)
+                ).values('entry_id'))
+
+        return queryset
+
+    def get_sync_token(self, feed_id=None):
+        """Returns a sync token to be passed back as `after_id`.
+
+        IDs are given out when rows are inserted rather than when they 
+        are committed, so an entry may become visible after entries 
+        with greater IDs, and an entry found in another feed keeps its 
+        ID when it is linked to a feed. The token is thus the ID of the 
+        newest entry (or, for a feed's entries, the newest link between 
+        an entry and a feed) saved at least 
+        `settings.ENTRY_SYNC_TOKEN_LAG` seconds ago, by which time 
+        entries with lower IDs are committed. Entries saved since may 
+        be returned again by the next sync.
+
+        Args:
+            feed_id (int): ID of the feed whose entries are listed, 
+                or None for the list of all entries
+
+        Returns:
+            int: the sync token, or 0 if no entry is old enough
+        """
+        saved_before = timezone.now() - timedelta(
+            seconds=settings.ENTRY_SYNC_TOKEN_LAG
+        )
+        if feed_id is None:
+            rows = Entry.objects.filter(
+                timestamp__lte=saved_before
+            ).order_by('-timestamp', '-id')
+        else:
+            rows = FeedEntry.objects.filter(
+                linked_at__lte=saved_before
+            ).order_by('-linked_at', '-id')
+        return rows.values_list('id', flat=True).first() or 0
+
+    def read_page(self, queryset):
+        """Returns the serialized page of entries.
+
+        Args:
+            queryset (QuerySet): the filtered entries to list
+
+        Returns:
+            dict: paginated response data
+        """
+        page = self.paginate_queryset(
+            queryset.values(*EntrySerializer.Meta.fields)
+        )
+        return self.get_paginated_response(
+            serialize_entry_values(page)
+        ).data
+
+    def list_entries(self, queryset, feed_id=None):
+        """Returns a paginated response with the given entries.
+
+        Entries are filtered by the `since` and `after_id` query 
+        parameters (see `filter_entries`), and responses carry a sync 
+        token to pass as `after_id` on the next poll. Serialized pages 
+        are cached until new entries are saved (see 
+        `feeds.utils.cache_tools`), but the sync token is not, so that 
+        it keeps up with entries getting older than the lag. Responses carry ETag and 
+        Last-Modified headers, and conditional requests for a page 
+        that has not changed since are answered with a bodiless 304 
+        response without querying the database. Pages are neither 
+        cached nor revalidated unless `settings.ENTRY_PAGE_CACHE_ENABLED` 
+        is set, i.e., unless the cache is shared with the workers that 
+        save new entries.
+
+        Args:
+            queryset (QuerySet): the entries to list
+            feed_id (int): ID of the feed whose entries are listed, 
+                or None for the list of all entries
+
+        Returns:
+            Response: the requested page of entries
+        """
+        queryset = self.filter_entries(queryset, feed_id)
+        if not settings.ENTRY_PAGE_CACHE_ENABLED:
+            # Get the token first, so that no entry saved while the 
+            # page is read can be newer than the token yet missing
+            sync_token = self.get_sync_token(feed_id)
+            response = Response(self.read_page(queryset))
+            response[SYNC_TOKEN_HEADER] = sync_token
+            return response
 
-from feeds.api.serializers import EntrySerializer, FeedSerializer
-from feeds.models import Entry, Feed
+        url = self.request.build_absolute_uri()
+        etag = make_etag(url, feed_id)
+        last_modified = get_last_modified(feed_id)
+        not_modified = get_conditional_response(
+            self.request,
+            etag=etag,
+            last_modified=last_modified
+        )
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
 
+        # A cached page has no entry saved since it was read, as 
+        # saving entries invalidates it
+        sync_token = self.get_sync_token(feed_id)
+        key = make_page_key(url, feed_id)
+        data = cache.get(key)
+        if data is None:
+            data = self.read_page(queryset)
+            cache.set(key, data, settings.ENTRY_PAGE_CACHE_TIMEOUT)
 
-class EntryListViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+        response = Response(data)
+        response[SYNC_TOKEN_HEADER] = sync_token
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class EntryListViewSet(CachedEntryListMixin,
+                       mixins.ListModelMixin,
+                       viewsets.GenericViewSet):
     """Lists all saved entries."""
     queryset = Entry.objects.all()
     serializer_class = EntrySerializer
+    renderer_classes = [EntryListRenderer]
+
+    # Queries each action may run (see `api.queries.get_query_budget`)
+    query_budgets = {'list': 4, 'export': 3}
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = get_entry_paginator(self.request)
+        return self._paginator
+
+    def list(self, request, *args, **kwargs):
+        """Lists entries, or those matching the `search` parameter."""
+        queryset = self.get_queryset()
+        search = request.query_params.get('search')
+        if search:
+            queryset = queryset.search(search)
+        return self.list_entries(queryset)
+
+    @action(detail=False, url_name='export')
+    def export(self, request, *args, **kwargs):
+        """Streams all entries as newline-delimited JSON.
 
+        Entries are streamed in the order they were saved, and read 
+        from the database in chunks (with a server-side cursor on 
+        PostgreSQL), so memory use does not grow with the number of 
+        entries. Like lists of entries, the export can be limited to 
+        entries saved since an earlier sync (see `filter_entries`).
+        """
+        queryset = self.filter_entries(
+            self.get_queryset().order_by('timestamp', 'id')
+        )
+        sync_token = self.get_sync_token()
 
-class FeedViewSet(viewsets.ModelViewSet):
+        rows = queryset.values(
+            *EntrySerializer.Meta.fields,
+            'timestamp'
+        ).iterator(chunk_size=settings.ENTRY_EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(
+            iter_entry_lines(rows, ('published', 'timestamp')),
+            content_type='application/x-ndjson; charset=utf-8'
+        )
+        response[SYNC_TOKEN_HEADER] = sync_token
+        return response
+
+
+class FeedViewSet(CachedEntryListMixin, viewsets.ModelViewSet):
     """Handles list, detail, and custom view methods for Feed."""
     permission_classes = [IsAdminUser, IsAuthenticated]
     queryset = Feed.objects.all()
     serializer_class = FeedSerializer
 
-    @action(detail=True, url_name='entries')
+    # Queries each action may run (see `api.queries.get_query_budget`)
+    query_budgets = {
+        'list': 3,
+        'retrieve': 2,
+        'create': 5,
+        'update': 5,
+        'partial_update': 5,
+        'destroy': 4,
+        'unhealthy': 3,
+        'entries': 4,
+    }
+
+    def get_queryset(self):
+        return super().get_queryset().with_entries_count()
+
+    @property
+    def paginator(self):
+        if self.action == 'entries' and not hasattr(self, '_paginator'):
+            self._paginator = get_entry_paginator(self.request)
+        return super().paginator
+
+    @action(detail=False, url_name='unhealthy')
+    def unhealthy(self, request, *args, **kwargs):
+        """Lists feeds whose recent updates have kept failing."""
+        queryset = self.filter_queryset(self.get_queryset().unhealthy())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    @action(
+        detail=True,
+        url_name='entries',
+        renderer_classes=[EntryListRenderer]
+    )
     def entries(self, *args, **kwargs):
         """Lists all entries associated with a given RSS feed."""
         feed = self.get_object()
-        page = self.paginate_queryset(feed.entries.all())
-        if page is not None:
-            serializer = EntrySerializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
+        return self.list_entries(feed.entries.all(), feed_id=feed.pk)
+
+
+class MetricsView(APIView):
+    """Exposes ingestion metrics in the Prometheus text format."""
+    permission_classes = [IsAdminUser, IsAuthenticated]
+
+    # Queries each method may run (see `api.queries.get_query_budget`)
+    query_budgets = {'get': 1}
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(
+            generate_metrics(),
+            content_type=CONTENT_TYPE_LATEST
+        )
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.8 on 2026-10-18 11:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0007_feed_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='etag',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='fetch_status',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='modified',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.8 on 2026-10-18 11:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0009_feed_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='last_new_entry_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='next_fetch_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='publish_interval',
+            field=models.DurationField(blank=True, null=True),
+        ),
+    ]
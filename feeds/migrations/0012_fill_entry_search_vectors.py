@@ -0,0 +1,53 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:11
+
+from django.conf import settings
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+
+BATCH_SIZE = 10000
+
+
+def fill_search_vectors(apps, schema_editor):
+    """Fills the search vectors of existing entries in batches.
+
+    The migration is not atomic, so each batch is committed on its 
+    own and the table is never locked for long.
+    """
+    Entry = apps.get_model('feeds', 'Entry')
+    config = settings.ENTRY_SEARCH_CONFIG
+    search_vector = (
+        SearchVector('title', weight='A', config=config) +
+        SearchVector('summary', weight='B', config=config)
+    )
+
+    entry_ids = Entry.objects.filter(
+        search_vector__isnull=True
+    ).order_by('id').values_list('id', flat=True)
+    last_id = 0
+    while True:
+        batch_ids = list(entry_ids.filter(id__gt=last_id)[:BATCH_SIZE])
+        if not batch_ids:
+            break
+        Entry.objects.filter(id__in=batch_ids).update(
+            search_vector=search_vector
+        )
+        last_id = batch_ids[-1]
+
+
+class Migration(migrations.Migration):
+    # Build the index without blocking writes to the entries table
+    atomic = False
+
+    dependencies = [
+        ('feeds', '0011_entry_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_vectors, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='entry',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='feeds_entry_search__9257b6_gin'),
+        ),
+    ]
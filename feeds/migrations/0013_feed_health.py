@@ -0,0 +1,33 @@
+# Generated by Django 3.0.8 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeds', '0012_fill_entry_search_vectors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feed',
+            name='consecutive_failures',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='disabled_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='last_error',
+            field=models.CharField(blank=True, default='', max_length=1024),
+        ),
+        migrations.AddField(
+            model_name='feed',
+            name='last_success_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 3.0.8 on 2026-10-18 14:02
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    # Build the index without blocking writes to the links table
+    atomic = False
+
+    dependencies = [
+        ('feeds', '0013_feed_health'),
+    ]
+
+    operations = [
+        # The links table of `Entry.feeds` is kept as is, and becomes
+        # the table of the FeedEntry model
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='FeedEntry',
+                    fields=[
+                        ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('entry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='feeds.Entry')),
+                        ('feed', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='feeds.Feed')),
+                    ],
+                    options={
+                        'db_table': 'feeds_entry_feeds',
+                        'unique_together': {('entry', 'feed')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='entry',
+                    name='feeds',
+                    field=models.ManyToManyField(related_name='entries', through='feeds.FeedEntry', to='feeds.Feed'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='linked_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        AddIndexConcurrently(
+            model_name='feedentry',
+            index=models.Index(fields=['linked_at'], name='feeds_entry_linked__1b2c6f_idx'),
+        ),
+    ]
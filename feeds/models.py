@@ -1,10 +1,96 @@
+from contextlib import ExitStack
+from datetime import timedelta
+from functools import partial
+from itertools import islice
+import time
+
 from django.conf import settings
-from django.db import IntegrityError, models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, SearchVectorField
+)
+from django.db import DatabaseError, IntegrityError, models, transaction
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+from feeds.utils.cache_tools import bump_generations
 from feeds.utils.feed_tools import (
-    fetch_feedparser_dict, preprocess_feed_entry_item
+    fetch_feedparser_dict, iter_feed_entries, log_invalid_dates,
+    parse_feed_response, preprocess_feed_entry_item
+)
+from feeds.utils import metrics
+from feeds.utils.fetcher import (
+    download_feed, FeedTooLargeError, open_feed
 )
+from feeds.utils.scheduling import (
+    compute_failure_backoff, compute_poll_delay, smooth_interval
+)
+
+
+class EntryQuerySet(models.QuerySet):
+
+    def delete_in_batches(self, batch_size):
+        """Deletes the entries a batch at a time.
+
+        Each batch, including the entries' links to feeds, is deleted 
+        in a short transaction of its own, so that rows are never 
+        locked for long. Cached pages of the affected feeds are 
+        invalidated after each batch.
+
+        Args:
+            batch_size (int): maximum number of entries per batch
+
+        Returns:
+            int: count of deleted entries
+        """
+        deleted_count = 0
+        while True:
+            entry_ids = list(
+                self.order_by().values_list('id', flat=True)[:batch_size]
+            )
+            if not entry_ids:
+                break
+
+            with transaction.atomic():
+                feed_ids = set(FeedEntry.objects.filter(
+                    entry_id__in=entry_ids
+                ).values_list('feed_id', flat=True))
+                Entry.objects.filter(id__in=entry_ids).delete()
+                transaction.on_commit(partial(bump_generations, feed_ids))
+            deleted_count += len(entry_ids)
+
+        return deleted_count
+
+    def update_search_vectors(self):
+        """Fills the search vectors of entries from their text.
+
+        Titles are weighted above summaries when ranking results.
+
+        Returns:
+            int: count of updated entries
+        """
+        config = settings.ENTRY_SEARCH_CONFIG
+        return self.update(search_vector=(
+            SearchVector('title', weight='A', config=config) +
+            SearchVector('summary', weight='B', config=config)
+        ))
+
+    def search(self, text):
+        """Filters entries matching a full-text search, best first.
+
+        Matches are looked up in the GIN index on `search_vector`, 
+        and only matching entries are ranked.
+
+        Args:
+            text (str): words to search for; all of them must match
+
+        Returns:
+            QuerySet: matching entries annotated with their `rank`
+        """
+        query = SearchQuery(text, config=settings.ENTRY_SEARCH_CONFIG)
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(models.F('search_vector'), query)
+        ).order_by('-rank', '-published', '-id')
 
 
 class Entry(models.Model):
@@ -13,13 +99,21 @@ class Entry(models.Model):
     summary = models.TextField()
     title = models.CharField(max_length=280)
     timestamp = models.DateTimeField(default=timezone.now)
-    feeds = models.ManyToManyField('Feed', related_name='entries')
+    feeds = models.ManyToManyField(
+        'Feed',
+        related_name='entries',
+        through='FeedEntry'
+    )
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = EntryQuerySet.as_manager()
 
     class Meta:
         indexes = [
             models.Index(fields=['link']),
             models.Index(fields=['published']),
             models.Index(fields=['timestamp']),
+            GinIndex(fields=['search_vector']),
         ]
         ordering = ['-published']
 
@@ -27,12 +121,92 @@ class Entry(models.Model):
         return self.title
 
 
+class FeedEntry(models.Model):
+    """Link between an entry and one of the feeds it was found in.
+
+    Links are numbered in the order they are saved, and the time each 
+    link is saved is kept, so that clients syncing a feed's entries 
+    also get older entries newly found in the feed (see 
+    `feeds.api.views.CachedEntryListMixin`).
+    """
+    entry = models.ForeignKey('Entry', on_delete=models.CASCADE)
+    feed = models.ForeignKey('Feed', on_delete=models.CASCADE)
+    linked_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'feeds_entry_feeds'
+        indexes = [models.Index(fields=['linked_at'])]
+        unique_together = [['entry', 'feed']]
+
+
+class FeedQuerySet(models.QuerySet):
+
+    def due(self, now=None):
+        """Filters feeds whose next scheduled fetch is due.
+
+        Feeds left alone after failed updates (see 
+        `Feed.record_failure`) are not due until their backoff is over.
+        """
+        now = now or timezone.now()
+        return self.filter(
+            models.Q(next_fetch_at__isnull=True) |
+            models.Q(next_fetch_at__lte=now)
+        ).exclude(disabled_until__gt=now)
+
+    def unhealthy(self):
+        """Filters feeds whose recent updates have kept failing.
+
+        Feeds are unhealthy after `settings.FEED_UNHEALTHY_FAILURES` 
+        consecutive failed updates, and are listed from the one that 
+        has been failing the longest.
+        """
+        return self.filter(
+            consecutive_failures__gte=settings.FEED_UNHEALTHY_FAILURES
+        ).order_by('-consecutive_failures', 'link')
+
+    def with_entries_count(self):
+        """Annotates each feed with the number of its entries.
+
+        The count is a correlated subquery on the feed-entry link 
+        table rather than a join with GROUP BY, so that each feed's 
+        count is an index lookup, and counting the feeds (e.g., for 
+        pagination) does not need to aggregate the whole table.
+        """
+        entries_count = FeedEntry.objects.filter(
+            feed_id=models.OuterRef('pk')
+        ).order_by().values('feed_id').annotate(
+            count=models.Count('*')
+        ).values('count')
+        return self.annotate(entries_count=Coalesce(
+            models.Subquery(entries_count, output_field=models.IntegerField()),
+            0
+        ))
+
+
 class Feed(models.Model):
+    # Outcomes of the last call to update_feed_entries
+    FETCH_STATUS_UPDATED = 'updated'
+    FETCH_STATUS_NOT_MODIFIED = 'not_modified'
+    FETCH_STATUS_UNCHANGED = 'unchanged'
+
     title = models.CharField(max_length=1024)
     description = models.CharField(max_length=2048, default='')
     link = models.URLField(max_length=400, null=False, unique=True)
     version = models.CharField(max_length=64)
     timestamp = models.DateTimeField(default=timezone.now)
+    etag = models.CharField(max_length=255, blank=True, default='')
+    modified = models.CharField(max_length=64, blank=True, default='')
+    fetch_status = models.CharField(max_length=16, blank=True, default='')
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    next_fetch_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_new_entry_at = models.DateTimeField(null=True, blank=True)
+    publish_interval = models.DurationField(null=True, blank=True)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    last_error = models.CharField(max_length=1024, blank=True, default='')
+    last_success_at = models.DateTimeField(null=True, blank=True)
+    disabled_until = models.DateTimeField(null=True, blank=True)
+
+    objects = FeedQuerySet.as_manager()
 
     class Meta:
         indexes = [models.Index(fields=['link'])]
@@ -78,44 +252,465 @@ class Feed(models.Model):
         self.description = parsed_feed.feed.get('description', '')
         self.version = parsed_feed.get('version', '')
 
-    def update_feed_entries(self):
+    def update_feed_entries(self, response=None, items=None):
         """Fetches a given feed's available entries.
 
-        The method then tries to save all new entries.
+        The method then tries to save all new entries. The feed is 
+        requested with the ETag and Last-Modified values saved from 
+        the last fetch, so that a feed that has not changed since is 
+        neither downloaded nor parsed again. For servers that do not 
+        support conditional requests, a digest of the downloaded 
+        document is compared with that of the last fetch, so that an 
+        unchanged document is not parsed again. The outcome is saved 
+        in `fetch_status`.
+
+        Args:
+            response (FeedResponse): the feed document, if it has 
+                already been downloaded (e.g., by `download_feeds`)
+            items (list): processed entries of the document, if it 
+                has already been parsed (e.g., by `parse_feeds`)
 
         Returns:
             int: count of successfully saved entries
         """
-        parsed_feed = fetch_feedparser_dict(self.link)
-        saved_entries_count = 0
-        old_entries_count = 0
-        for feed_entry in parsed_feed.entries:
-            # Check if max count is reached
-            if old_entries_count >= settings.MAX_SAVED_ENTRIES_COUNT:
-                break
+        if response is None:
+            try:
+                response = download_feed(
+                    self.link,
+                    etag=self.etag,
+                    modified=self.modified,
+                    max_size=settings.FEED_STREAM_MIN_SIZE
+                )
+            except FeedTooLargeError as e:
+                return self.stream_feed_entries(e)
+
+        if response.status == 304:
+            return self.record_update(self.FETCH_STATUS_NOT_MODIFIED)
+
+        self.set_validators(response.headers)
+        content_hash = response.content_hash
+        if content_hash == self.content_hash:
+            return self.record_update(self.FETCH_STATUS_UNCHANGED)
+
+        if items is None:
+            parsed_feed = parse_feed_response(response)
+            saved_entries_count = self.ingest_entries(parsed_feed.entries)
+        else:
+            saved_entries_count = self.ingest_entries(
+                items,
+                preprocessed=True
+            )
+
+        # Save validators and digest only once entries are saved,
+        # so that a failed update is retried with a full download
+        self.content_hash = content_hash
+        return self.record_update(
+            self.FETCH_STATUS_UPDATED,
+            saved_entries_count
+        )
+
+    def stream_feed_entries(self, too_large=None):
+        """Fetches and saves new entries while the feed is downloaded.
+
+        The document is parsed a chunk at a time as it is downloaded 
+        (see `iter_feed_entries`), and the download is stopped as 
+        soon as enough known entries are found (see `ingest_entries`), 
+        so that memory and time spent on a large feed depend on its 
+        count of new entries rather than on its size. Since a document 
+        read in part cannot be compared with that of the last fetch, 
+        its digest is not saved. A document that cannot be parsed 
+        as it is read (e.g., one that is not well-formed XML) is 
+        downloaded again, conditionally, and parsed whole instead (see 
+        `parse_feed_response`), unless it is larger than 
+        `settings.FEED_STREAM_MIN_SIZE`, which fails the update.
 
+        Args:
+            too_large (FeedTooLargeError): the error raised by 
+                `download_feed`, if any; the document is read on from 
+                the download left open in it rather than requested again
+
+        Returns:
+            int: count of successfully saved entries
+
+        Raises:
+            ValueError: if the document cannot be parsed as it is 
+                read and is too large to be parsed whole
+        """
+        etag, modified = self.etag, self.modified
+        with ExitStack() as stack:
+            if too_large is not None and too_large.stream is not None:
+                stack.callback(too_large.close)
+                stream = too_large.stream
+            else:
+                stream = stack.enter_context(
+                    open_feed(self.link, etag=etag, modified=modified)
+                )
+            if stream.status == 304:
+                return self.record_update(self.FETCH_STATUS_NOT_MODIFIED)
+
+            self.set_validators(stream.headers)
             try:
-                # Process raw entry and 
-                # create Entry object if it does not exist yet
-                item = preprocess_feed_entry_item(feed_entry)
-                entry, _ = Entry.objects.get_or_create(
-                    link=item['link'],
-                    defaults={k: v for k, v in item.items() if k != 'link'}
+                saved_entries_count = self.ingest_entries(
+                    iter_feed_entries(stream.chunks, base_url=stream.url)
+                )
+            except ValueError:
+                saved_entries_count = None
+
+        if saved_entries_count is None:
+            # Nothing has been saved, as entries are only saved once 
+            # they are all read, so the document is parsed whole
+            try:
+                response = download_feed(
+                    self.link,
+                    etag=etag,
+                    modified=modified,
+                    max_size=settings.FEED_STREAM_MIN_SIZE
                 )
+            except FeedTooLargeError as e:
+                e.close()
+                raise ValueError(
+                    f'Feed {self.link} could not be parsed as it was read '
+                    f'and is too large to be parsed whole'
+                ) from e
+            if response.status == 304:
+                return self.record_update(self.FETCH_STATUS_NOT_MODIFIED)
+
+            parsed_feed = parse_feed_response(response)
+            saved_entries_count = self.ingest_entries(parsed_feed.entries)
+
+        self.content_hash = ''
+        return self.record_update(
+            self.FETCH_STATUS_UPDATED,
+            saved_entries_count
+        )
+
+    def needs_parsing(self, response):
+        """Tells whether a downloaded document may have new entries.
+
+        Documents that have not been modified (HTTP 304), or whose 
+        digest is that of the last fetch, are not parsed again 
+        (see `update_feed_entries`).
 
-                # Check existing entry is already part of current feed
-                old_entry = self.entries.filter(link=entry.link)
+        Args:
+            response (FeedResponse): the downloaded feed
 
-                if old_entry.exists():
+        Returns:
+            bool: True if the document has changed since the last fetch
+        """
+        return (
+            response.status != 304 and
+            response.content_hash != self.content_hash
+        )
+
+    def record_update(self, fetch_status, entries_saved=0):
+        """Saves the outcome of an update and schedules the next one.
+
+        Args:
+            fetch_status (str): one of the FETCH_STATUS_* values
+            entries_saved (int): count of entries saved by the update
+
+        Returns:
+            int: the given count of saved entries
+        """
+        self.fetch_status = fetch_status
+        self.schedule_next_fetch(entries_saved)
+        self.consecutive_failures = 0
+        self.last_error = ''
+        self.last_success_at = timezone.now()
+        self.disabled_until = None
+        self.save(update_fields=[
+            'etag',
+            'modified',
+            'content_hash',
+            'fetch_status',
+            'next_fetch_at',
+            'last_new_entry_at',
+            'publish_interval',
+            'consecutive_failures',
+            'last_error',
+            'last_success_at',
+            'disabled_until',
+        ])
+        return entries_saved
+
+    def record_failure(self, error, now=None):
+        """Saves the failure of an update and backs off the next one.
+
+        The feed is left alone for a while after each failed update 
+        (its circuit is open), and the delay doubles with each further 
+        consecutive failure (see `compute_failure_backoff`), so that 
+        dead feeds are tried less and less often. A successful update 
+        resets the count (see `record_update`).
+
+        Args:
+            error (Exception): the error that failed the update
+            now (datetime): time of the update (defaults to now)
+        """
+        now = now or timezone.now()
+        self.consecutive_failures += 1
+        self.last_error = f'{type(error).__name__}: {error}'[:1024]
+        self.disabled_until = now + compute_failure_backoff(
+            self.consecutive_failures
+        )
+        self.save(update_fields=[
+            'consecutive_failures',
+            'last_error',
+            'disabled_until',
+        ])
+
+    def schedule_next_fetch(self, entries_saved, now=None):
+        """Sets when the feed should next be fetched.
+
+        Feeds that publish often are fetched often, while feeds 
+        without new entries are backed off (see 
+        `feeds.utils.scheduling`). Note that the method does not 
+        call save().
+
+        Args:
+            entries_saved (int): count of entries saved by the update
+            now (datetime): time of the update (defaults to now)
+        """
+        now = now or timezone.now()
+        if entries_saved:
+            if self.last_new_entry_at:
+                observed = (now - self.last_new_entry_at) / entries_saved
+                self.publish_interval = smooth_interval(
+                    self.publish_interval,
+                    observed
+                )
+            self.last_new_entry_at = now
+
+        idle_time = None
+        if self.last_new_entry_at:
+            idle_time = now - self.last_new_entry_at
+        self.next_fetch_at = now + compute_poll_delay(
+            self.publish_interval,
+            idle_time
+        )
+
+    def ingest_entries(self, feed_entries, preprocessed=False):
+        """Processes raw feed entries and saves the new ones in bulk.
+
+        Entries are processed in order until `MAX_SAVED_ENTRIES_COUNT` 
+        consecutive entries already associated with this feed are 
+        found. Which entries are already associated is looked up with 
+        one query per `ENTRY_LOOKUP_BATCH_SIZE` entries, and entries 
+        are only taken from `feed_entries` a batch at a time, so that 
+        an iterator over a large feed is not read further than needed. 
+        Entries published before the retention cutoff (see 
+        `get_retention_cutoff`) are skipped like those already 
+        associated, so that entries deleted for being too old are 
+        not saved again.
+
+        Args:
+            feed_entries (iterable): FeedParserDict entries of the feed
+            preprocessed (bool): if True, the entries have already 
+                been processed (see `preprocess_feed_entry_item`)
+
+        Returns:
+            int: count of successfully saved entries
+        """
+        feed_entries = iter(feed_entries)
+        feed_links = set()
+        new_items = []
+        old_entries_count = 0
+        duplicates_count = 0
+        expired_count = 0
+        invalid_dates = []
+        cutoff = get_retention_cutoff()
+        while old_entries_count < settings.MAX_SAVED_ENTRIES_COUNT:
+            batch = list(
+                islice(feed_entries, settings.ENTRY_LOOKUP_BATCH_SIZE)
+            )
+            if not batch:
+                break
+
+            links = [
+                feed_entry['link'] for feed_entry in batch
+                if feed_entry.get('link')
+            ]
+            feed_links.update(
+                self.entries.filter(
+                    link__in=links
+                ).values_list('link', flat=True)
+            )
+
+            for feed_entry in batch:
+                # Check if max count is reached
+                if old_entries_count >= settings.MAX_SAVED_ENTRIES_COUNT:
+                    break
+
+                if preprocessed:
+                    item = feed_entry
+                else:
+                    try:
+                        item = preprocess_feed_entry_item(
+                            feed_entry,
+                            invalid_dates
+                        )
+                    except Exception as e:
+                        continue
+
+                # Check entry is already part of current feed
+                if item['link'] in feed_links:
                     old_entries_count += 1
+                    duplicates_count += 1
                     continue
-                else:
-                    self.entries.add(entry)
 
-            except Exception as e:
-                pass
-            else:
-                saved_entries_count += 1
+                if cutoff is not None and item['published'] < cutoff:
+                    old_entries_count += 1
+                    expired_count += 1
+                    continue
+
+                feed_links.add(item['link'])
+                new_items.append(item)
                 old_entries_count = 0
 
+        log_invalid_dates(self.link, invalid_dates)
+        metrics.ENTRY_DUPLICATES.inc(duplicates_count)
+        metrics.ENTRIES_EXPIRED.inc(expired_count)
+        return self.save_new_entries(new_items)
+
+    def save_new_entries(self, items):
+        """Saves processed entries and associates them with this feed.
+
+        New Entry objects and their links to this feed are inserted 
+        in bulk in one transaction; entries whose link is already 
+        saved (e.g., by another feed) are reused, and the search 
+        vectors of new entries are filled in the same transaction. If 
+        the bulk insert fails (e.g., a value is too long for its 
+        column), the entries are saved one by one so that only the 
+        bad ones are dropped. 
+        Cached pages of entries are invalidated once the entries are 
+        committed. The time taken and the count of saved entries are 
+        recorded (see `feeds.utils.metrics`).
+
+        Args:
+            items (list): processed entries (see 
+                `preprocess_feed_entry_item`) not yet in this feed
+
+        Returns:
+            int: count of successfully saved entries
+        """
+        if not items:
+            return 0
+
+        started = time.monotonic()
+        try:
+            with transaction.atomic():
+                links = [item['link'] for item in items]
+                Entry.objects.bulk_create(
+                    [Entry(**item) for item in items],
+                    ignore_conflicts=True
+                )
+                Entry.objects.filter(
+                    link__in=links,
+                    search_vector__isnull=True
+                ).update_search_vectors()
+                entry_ids = Entry.objects.filter(
+                    link__in=links
+                ).values_list('id', flat=True)
+                FeedEntry.objects.bulk_create(
+                    [
+                        FeedEntry(entry_id=entry_id, feed_id=self.pk)
+                        for entry_id in entry_ids
+                    ],
+                    ignore_conflicts=True
+                )
+            saved_entries_count = len(items)
+        except DatabaseError as e:
+            saved_entries_count = sum(
+                self.save_new_entry(item) for item in items
+            )
+
+        metrics.ENTRY_WRITE_SECONDS.observe(time.monotonic() - started)
+        metrics.ENTRIES_SAVED.inc(saved_entries_count)
+        if saved_entries_count:
+            transaction.on_commit(lambda: bump_generations([self.pk]))
         return saved_entries_count
+
+    def save_new_entry(self, item):
+        """Saves a single processed entry and adds it to this feed.
+
+        Returns:
+            int: 1 if the entry was saved, 0 otherwise
+        """
+        try:
+            with transaction.atomic():
+                entry, created = Entry.objects.get_or_create(
+                    link=item['link'],
+                    defaults={k: v for k, v in item.items() if k != 'link'}
+                )
+                if created:
+                    Entry.objects.filter(pk=entry.pk).update_search_vectors()
+                self.entries.add(entry)
+        except Exception as e:
+            return 0
+        return 1
+
+    def trim_entries(self, max_count, batch_size):
+        """Removes all but the newest entries from this feed.
+
+        Links to older entries are deleted a batch at a time, each 
+        batch in a short transaction of its own, and entries that are 
+        left without any feed are deleted as well.
+
+        Args:
+            max_count (int): number of entries to keep
+            batch_size (int): maximum number of entries per batch
+
+        Returns:
+            int: count of entries removed from this feed
+        """
+        links = FeedEntry.objects.filter(feed_id=self.pk).order_by(
+            '-entry__published',
+            '-entry_id'
+        ).values_list('id', 'entry_id')
+
+        trimmed_count = 0
+        while True:
+            batch = list(links[max_count:max_count + batch_size])
+            if not batch:
+                break
+
+            link_ids, entry_ids = zip(*batch)
+            with transaction.atomic():
+                FeedEntry.objects.filter(id__in=link_ids).delete()
+                Entry.objects.filter(
+                    id__in=entry_ids,
+                    feeds__isnull=True
+                ).delete()
+                transaction.on_commit(partial(bump_generations, [self.pk]))
+            trimmed_count += len(batch)
+
+        return trimmed_count
+
+    def set_validators(self, headers):
+        """Sets the ETag and Last-Modified values from response headers.
+
+        Values too long to be saved are dropped, which only means 
+        the next request is not conditional. Note that the method 
+        does not call save().
+
+        Args:
+            headers (dict): response headers (lowercased names)
+        """
+        etag = headers.get('etag', '')
+        modified = headers.get('last-modified', '')
+        etag_length = self._meta.get_field('etag').max_length
+        modified_length = self._meta.get_field('modified').max_length
+        self.etag = etag if len(etag) <= etag_length else ''
+        self.modified = modified if len(modified) <= modified_length else ''
+
+
+def get_retention_cutoff(now=None):
+    """Returns the publication date before which entries are deleted.
+
+    Returns:
+        datetime: `settings.ENTRY_MAX_AGE_DAYS` days before now, or 
+            None if entries are kept regardless of their age
+    """
+    if not settings.ENTRY_MAX_AGE_DAYS:
+        return None
+    now = now or timezone.now()
+    return now - timedelta(days=settings.ENTRY_MAX_AGE_DAYS)
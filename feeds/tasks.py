@@ -1,37 +1,401 @@
+from collections import Counter
 import logging
 
-from celery import shared_task
+from celery import chord, shared_task
+from django.conf import settings
 
-from .models import Feed
+from .models import Entry, Feed, get_retention_cutoff
+from .utils import metrics
+from .utils.feed_tools import parse_feeds
+from .utils.fetcher import (
+    download_feeds, FeedTooLargeError, interleave_hosts
+)
+from .utils.leases import FETCH_ENTRIES_LEASE, feed_lease, Heartbeat, Lease
+from .utils.throttling import FetchThrottledError
+
+# Status of a feed whose update raised an error
+FETCH_STATUS_ERROR = 'error'
+
+# Status of a feed skipped because its host may not be downloaded
+# from for now (see `feeds.utils.throttling`)
+FETCH_STATUS_THROTTLED = 'throttled'
+
+# Status of a feed skipped because another worker is updating it, or
+# has just updated it (see `feeds.utils.leases`)
+FETCH_STATUS_LOCKED = 'locked'
 
 
 @shared_task(name='fetch-entries')
-def fetch_entries():
-    """Fetches and saves all new entries for each RSS feed in the db.
+def fetch_entries(fan_out=None):
+    """Fetches and saves all new entries for each RSS feed that is due.
+
+    Each feed is scheduled for its next fetch based on how often it 
+    publishes new entries (see `Feed.schedule_next_fetch`), so this 
+    task can run often without fetching quiet feeds on every run.
+
+    Runs do not overlap: a run that starts while another one is still 
+    in progress, on any worker, does nothing. When feeds are fanned 
+    out, the run's lease is handed over to the chord, and released 
+    once its results are summarized (or it fails), or at the latest 
+    `settings.FETCH_ENTRIES_FAN_OUT_TIMEOUT` seconds after dispatch. 
+    Each feed is updated by one worker at a time (see `update_feeds` 
+    and `fetch_feed_entries`).
+
+    Args:
+        fan_out (bool): if True, enqueues a `fetch-feed-entries`
+            subtask per feed instead of processing feeds one after
+            the other (defaults to `settings.FETCH_ENTRIES_FAN_OUT`)
 
     Returns:
-        int: count of all RSS entries successfully saved
+        dict: summary of the run (see `summarize_fetch_results`), or
+            str: ID of the chord result when feeds are fanned out
     """
     logging.info('Fetching new RSS entries')
-    feeds = Feed.objects.all()
+    run_lease = Lease(FETCH_ENTRIES_LEASE)
+    if not run_lease.acquire():
+        logging.warning('Skipped, as another run is still in progress')
+        return None
 
-    if feeds.exists():
-        logging.info(f'Found {feeds.count()} total RSS feeds to process')
+    try:
+        with Heartbeat([run_lease]):
+            feeds = Feed.objects.due()
 
-        total_entries_saved = 0
-        for feed in feeds:
-            try:
-                entries_saved = feed.update_feed_entries()
-            except Exception as e:
-                logging.error(e)
-            else:
+            if fan_out is None:
+                fan_out = settings.FETCH_ENTRIES_FAN_OUT
+
+            if feeds.exists():
                 logging.info(
-                    f'Saved {entries_saved} new entries from {feed.link}'
+                    f'Found {feeds.count()} RSS feeds due for fetching'
                 )
-                total_entries_saved += entries_saved
 
-        logging.info(f'Processed and saved a total of {total_entries_saved} new RSS Entries')
-        return total_entries_saved
+                if fan_out:
+                    lease_token = run_lease.token
+                    release = release_fetch_lease.si(lease_token)
+                    result = chord(
+                        fetch_feed_entries.s(feed_id)
+                        for feed_id in feeds.values_list('id', flat=True)
+                    )(summarize_fetch_results.s(
+                        lease_token=lease_token
+                    ).on_error(release))
+                    run_lease.hand_over(
+                        settings.FETCH_ENTRIES_FAN_OUT_TIMEOUT
+                    )
+                    logging.info(
+                        f'Dispatched per-feed subtasks (chord {result.id})'
+                    )
+                    return result.id
+
+                return summarize_fetch_results(update_feeds(feeds))
+
+            else:
+                logging.warning('No RSS feeds due for fetching')
+    finally:
+        run_lease.release()
+
+
+@shared_task(name='fetch-feed-entries')
+def fetch_feed_entries(feed_id):
+    """Fetches and saves new entries for a single RSS feed.
+
+    Errors are logged rather than raised, so that one bad feed
+    does not fail the chord it belongs to. The feed is skipped if 
+    another worker holds its lease, or if it is no longer due (e.g., 
+    another worker has just updated it).
+
+    Args:
+        feed_id (int): primary key of the Feed to process
+
+    Returns:
+        dict: result of the update (see `update_feed`)
+    """
+    lease = feed_lease(feed_id)
+    if not lease.acquire():
+        return skip_locked_feed(feed_id)
+
+    try:
+        with Heartbeat([lease]):
+            feed = Feed.objects.due().filter(pk=feed_id).first()
+            if feed is not None:
+                return update_feed(feed)
+
+            # Only tell a missing feed from one that is not due once
+            # the feed is not found among the due ones
+            if Feed.objects.filter(pk=feed_id).exists():
+                return skip_locked_feed(feed_id)
+
+            logging.error(f'Feed {feed_id} does not exist')
+            return {
+                'feed_id': feed_id,
+                'entries_saved': 0,
+                'status': FETCH_STATUS_ERROR
+            }
+    finally:
+        lease.release()
+
+
+@shared_task(name='release-fetch-lease')
+def release_fetch_lease(lease_token):
+    """Releases the lease of a `fetch-entries` run handed over to it.
+
+    Args:
+        lease_token (str): token of the run's lease
+    """
+    Lease(FETCH_ENTRIES_LEASE, token=lease_token).release()
+
+
+@shared_task(name='summarize-fetch-results')
+def summarize_fetch_results(results, lease_token=None):
+    """Adds up the results of updating each feed.
+
+    Args:
+        results (list): return values of `update_feed` or of
+            `fetch-feed-entries` subtasks
+        lease_token (str): token of the lease of the `fetch-entries` 
+            run whose results these are, if it was handed over to 
+            this task; the lease is released
+
+    Returns:
+        dict: number of feeds processed, count of all RSS entries
+            successfully saved, and number of feeds skipped because
+            they were not modified (HTTP 304), unchanged (same
+            content), throttled (their host asked to wait), or 
+            locked (updated by another worker), or that failed
+    """
+    if lease_token is not None:
+        release_fetch_lease(lease_token)
+
+    statuses = Counter(result['status'] for result in results)
+    summary = {
+        'feeds': len(results),
+        'entries_saved': sum(result['entries_saved'] for result in results),
+        'not_modified': statuses[Feed.FETCH_STATUS_NOT_MODIFIED],
+        'unchanged': statuses[Feed.FETCH_STATUS_UNCHANGED],
+        'throttled': statuses[FETCH_STATUS_THROTTLED],
+        'locked': statuses[FETCH_STATUS_LOCKED],
+        'errors': statuses[FETCH_STATUS_ERROR],
+    }
+    logging.info(
+        f'Processed and saved a total of {summary["entries_saved"]} '
+        f'new RSS Entries (skipped {summary["not_modified"]} not modified, '
+        f'{summary["unchanged"]} unchanged, {summary["throttled"]} '
+        f'throttled, and {summary["locked"]} locked feeds, '
+        f'{summary["errors"]} errors)'
+    )
+    return summary
+
+
+@shared_task(name='purge-entries')
+def purge_entries():
+    """Deletes entries that are past the retention limits.
+
+    Entries published more than `settings.ENTRY_MAX_AGE_DAYS` days 
+    ago are deleted (and are not saved again when their feed is 
+    updated, see `Feed.ingest_entries`), and each feed is trimmed to its newest 
+    `settings.ENTRY_MAX_PER_FEED` entries (see `Feed.trim_entries`). 
+    Deletes are done in batches of `settings.ENTRY_PURGE_BATCH_SIZE` 
+    entries, so that the task never holds locks for long.
+
+    Returns:
+        dict: count of entries deleted for being too old, and count 
+            of entries removed from feeds with too many entries
+    """
+    batch_size = settings.ENTRY_PURGE_BATCH_SIZE
+    summary = {'expired': 0, 'trimmed': 0}
+
+    cutoff = get_retention_cutoff()
+    if cutoff is not None:
+        summary['expired'] = Entry.objects.filter(
+            published__lt=cutoff
+        ).delete_in_batches(batch_size)
+
+    if settings.ENTRY_MAX_PER_FEED:
+        summary['trimmed'] = sum(
+            feed.trim_entries(settings.ENTRY_MAX_PER_FEED, batch_size)
+            for feed in Feed.objects.only('id')
+        )
+
+    logging.info(
+        f'Purged {summary["expired"]} expired entries and removed '
+        f'{summary["trimmed"]} entries from feeds over their limit'
+    )
+    return summary
+
+
+def update_feeds(feeds):
+    """Updates the feeds no other worker is updating.
+
+    The lease of each feed (see `feeds.utils.leases`) is taken just 
+    before its download starts, and released as soon as it is updated, 
+    so that only the leases of the few feeds going through the 
+    pipeline are held (and renewed) at a time. Feeds whose lease is 
+    held by another worker are skipped, and so are feeds that no 
+    longer match the query once leased (e.g., that are no longer due 
+    because another worker has just updated them).
+
+    Args:
+        feeds (QuerySet): the Feed objects to update
+
+    Returns:
+        list: result of updating each feed (see `update_feed`)
+    """
+    feeds_by_link = {feed.link: feed for feed in feeds}
+    results = []
+    leases = {}
+
+    def leased_feeds():
+        for link in interleave_hosts(feeds_by_link):
+            feed = feeds_by_link[link]
+            lease = feed_lease(feed.pk)
+            if not lease.acquire():
+                results.append(skip_locked_feed(feed.pk))
+            elif not feeds.filter(pk=feed.pk).exists():
+                lease.release()
+                results.append(skip_locked_feed(feed.pk))
+            else:
+                heartbeat.add(lease)
+                leases[feed.pk] = lease
+                yield feed
+
+    def release_feed(result):
+        leases.pop(result['feed_id']).release()
+        results.append(result)
+
+    with Heartbeat() as heartbeat:
+        try:
+            update_leased_feeds(leased_feeds(), release_feed)
+        finally:
+            for lease in leases.values():
+                lease.release()
+
+    return results
+
+
+def update_leased_feeds(feeds, done):
+    """Downloads, parses, and saves new entries of several feeds at once.
 
+    Updates run in three stages: feeds are downloaded by a pool of 
+    threads (see `download_feeds`), changed documents are parsed by 
+    a pool of processes, one per CPU core by default (see 
+    `parse_feeds`), and new entries are saved in this thread as soon 
+    as each document is parsed. Each stage only takes in more work 
+    while few enough documents are waiting for the next one, so that 
+    memory use does not grow with the number of feeds. Documents 
+    larger than `settings.FEED_STREAM_MIN_SIZE` are instead parsed 
+    in this thread as they are downloaded (see 
+    `Feed.stream_feed_entries`).
+
+    Args:
+        feeds (iterable): the Feed objects to update, in the order to 
+            download them; they are only taken in as downloads start
+        done (callable): called with the result of updating each feed 
+            (see `update_feed`) as soon as the feed is updated
+    """
+    feeds_by_link = {}
+    validators = {}
+    responses = {}
+
+    def feed_links():
+        for feed in feeds:
+            feeds_by_link[feed.link] = feed
+            validators[feed.link] = (feed.etag, feed.modified)
+            yield feed.link
+
+    def changed_documents():
+        # Feeds that failed to download, are too large to download
+        # whole, or have not changed are done with here, so that only
+        # changed documents are sent to be parsed
+        downloads = download_feeds(
+            feed_links(),
+            validators,
+            max_size=settings.FEED_STREAM_MIN_SIZE,
+            interleave=False
+        )
+        for link, response in downloads:
+            feed = feeds_by_link[link]
+            if (isinstance(response, Exception) or
+                    not feed.needs_parsing(response)):
+                done(update_feed(feed, response))
+            else:
+                responses[link] = response
+                yield link, response
+
+    for link, items in parse_feeds(changed_documents()):
+        response = responses.pop(link)
+        if isinstance(items, Exception):
+            response, items = items, None
+        done(update_feed(feeds_by_link[link], response, items))
+
+
+def skip_locked_feed(feed_id):
+    """Returns the result of a feed left to another worker."""
+    logging.info(f'Feed {feed_id} is being updated by another worker')
+    metrics.FEED_UPDATES.labels(status=FETCH_STATUS_LOCKED).inc()
+    return {
+        'feed_id': feed_id,
+        'entries_saved': 0,
+        'status': FETCH_STATUS_LOCKED
+    }
+
+
+def update_feed(feed, response=None, items=None):
+    """Saves new entries of a feed, logging rather than raising errors.
+
+    Failed updates are recorded on the feed, which is then left alone 
+    for a while (see `Feed.record_failure`). The outcome of each update 
+    is counted (see `feeds.utils.metrics`).
+
+    Args:
+        feed (Feed): the feed to update
+        response (FeedResponse): the downloaded feed, if any; an
+            exception raised while downloading or parsing may be 
+            passed instead, and a document that was too large to 
+            download whole is parsed as the rest of it is downloaded
+        items (list): processed entries of the downloaded feed, if 
+            it has already been parsed
+
+    Returns:
+        dict: the feed's ID, count of RSS entries successfully saved,
+            and fetch status (one of the Feed.FETCH_STATUS_* values,
+            or FETCH_STATUS_ERROR)
+    """
+    try:
+        if isinstance(response, FeedTooLargeError):
+            entries_saved = feed.stream_feed_entries(response)
+        elif isinstance(response, Exception):
+            raise response
+        else:
+            entries_saved = feed.update_feed_entries(
+                response=response,
+                items=items
+            )
+    except FetchThrottledError as e:
+        logging.info(f'Feed {feed.link} is skipped for now: {e}')
+        metrics.FEED_UPDATES.labels(status=FETCH_STATUS_THROTTLED).inc()
+        return {
+            'feed_id': feed.pk,
+            'entries_saved': 0,
+            'status': FETCH_STATUS_THROTTLED
+        }
+    except Exception as e:
+        logging.error(f'Failed to fetch entries from {feed.link}: {e}')
+        feed.record_failure(e)
+        metrics.FEED_UPDATES.labels(status=FETCH_STATUS_ERROR).inc()
+        return {
+            'feed_id': feed.pk,
+            'entries_saved': 0,
+            'status': FETCH_STATUS_ERROR
+        }
+
+    if feed.fetch_status == Feed.FETCH_STATUS_NOT_MODIFIED:
+        logging.info(f'Feed {feed.link} has not been modified (HTTP 304)')
+    elif feed.fetch_status == Feed.FETCH_STATUS_UNCHANGED:
+        logging.info(f'Feed {feed.link} content has not changed')
     else:
-        logging.warning('No RSS feeds found in the database')
+        logging.info(f'Saved {entries_saved} new entries from {feed.link}')
+
+    metrics.FEED_UPDATES.labels(status=feed.fetch_status).inc()
+    return {
+        'feed_id': feed.pk,
+        'entries_saved': entries_saved,
+        'status': feed.fetch_status
+    }
@@ -2,20 +2,53 @@
 Module that contains helper functions and resources for running unit tests
 
 Functions:
+    make_fake_feed_response(feed_url, content=b'', status=200, headers=None)
     make_fake_feedparser_dict(feed_url, n_items=30)
     make_feed_entries_list(n_items=10, feed_url='')
     make_preprocessed_entries_list(n_items=10, feed_url='')
     create_and_save_feeds(n_feeds=10)
+    get_metric_value(name, **labels)
+    run_in_daemonic_process(func, *args)
 """
 from datetime import datetime, timedelta
+import multiprocessing
+import os
 import random
 from unittest.mock import patch
 from urllib.parse import urljoin
+from xml.sax.saxutils import escape
 
+from django.db import connections
 from django.utils import timezone
 from feedparser import FeedParserDict
+from prometheus_client import REGISTRY
 
 from feeds.models import Feed
+from feeds.utils.fetcher import FeedResponse
+
+# Summaries of entries as found in real feeds (JSON list of strings)
+FEED_SUMMARIES_PATH = os.path.join(
+    os.path.dirname(__file__),
+    'data',
+    'feed_summaries.json'
+)
+
+
+def make_fake_feed_response(feed_url, content=b'', status=200, headers=None):
+    """Creates a fake FeedResponse object.
+
+    Args:
+        feed_url (str): Fake URL for fake Feed
+        content (bytes): raw body of the response
+        status (int): HTTP status code
+        headers (dict): response headers
+    """
+    return FeedResponse(
+        url=feed_url,
+        status=status,
+        content=content,
+        headers=headers or {}
+    )
 
 
 def make_fake_feedparser_dict(feed_url, n_items=30):
@@ -84,6 +117,30 @@ def make_preprocessed_entries_list(n_items=10, feed_url=''):
     ]
 
 
+def make_rss_document(feed_entries, feed_url=''):
+    """Generates a raw RSS 2.0 document.
+
+    Args:
+        feed_entries (list): feed entries to include, e.g., as made 
+            by `make_feed_entries_list`
+        feed_url (str): base URL
+    """
+    items = ''.join(
+        f'<item><title>{escape(entry["title"])}</title>'
+        f'<link>{escape(entry["link"])}</link>'
+        f'<description>{escape(entry["summary"])}</description>'
+        f'<pubDate>{escape(entry["published"])}</pubDate></item>\n'
+        for entry in feed_entries
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n'
+        '<rss version="2.0"><channel>\n'
+        f'<title>Sample Feed</title><link>{escape(feed_url)}</link>\n'
+        '<description>Sample feed</description>\n'
+        f'{items}</channel></rss>\n'
+    ).encode()
+
+
 def create_and_save_feeds(n_feeds=10):
     """Convenience function for creating Feed objects.
 
@@ -97,3 +154,57 @@ def create_and_save_feeds(n_feeds=10):
             Feed.objects.create(link=url)
 
     return Feed.objects.all()
+
+
+def get_metric_value(name, **labels):
+    """Returns the current value of a metric sample in this process.
+
+    Args:
+        name (str): name of the sample, e.g.,
+            'rss_apifier_entries_saved_total'
+        labels: label values of the sample, if any
+
+    Returns:
+        float: the value, or 0 if the sample has not been recorded yet
+    """
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def run_in_daemonic_process(func, *args):
+    """Calls a function in a daemonic child process, as Celery would.
+
+    The child process is forked, so that mocks are in effect there 
+    too. Database connections are opened anew in the child; the ones 
+    inherited from this process are left untouched, as closing them 
+    would close them for this process too. Data saved within a test 
+    case's transaction is not seen by the child (see 
+    `django.test.TransactionTestCase`).
+
+    Returns:
+        the return value of the function, or the exception it raised
+    """
+    context = multiprocessing.get_context('fork')
+    inherited_connections = []
+    queue = context.Queue()
+
+    def target():
+        # Inherited connections are kept referenced until the child 
+        # exits (without cleaning up), so that they are never closed
+        inherited_connections.extend(
+            conn.connection for conn in connections.all()
+        )
+        for conn in connections.all():
+            conn.connection = None
+        try:
+            result = func(*args)
+        except Exception as e:
+            result = e
+        finally:
+            connections.close_all()
+        queue.put(result)
+
+    process = context.Process(target=target, daemon=True)
+    process.start()
+    result = queue.get(timeout=60)
+    process.join()
+    return result
@@ -69,3 +69,29 @@ class FeedAdminTest(TestCase):
         # Page shows error message and redirects user
         self.assertTrue(mock_message.called)
         self.assertEqual(response.status_code, 302)
+
+    def test_health_filter(self):
+        healthy, unhealthy = Feed.objects.bulk_create([
+            Feed(link='https://www.healthyfeed.com/rss'),
+            Feed(link='https://www.deadfeed.com/rss', consecutive_failures=4),
+        ])
+        response = self.client.get(
+            '/admin/feeds/feed/',
+            {'health': 'unhealthy'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(response.context['cl'].queryset),
+            [unhealthy]
+        )
+
+    def test_health_fields_are_read_only(self):
+        feed = Feed(link='https://www.samplefeeds.com/rss')
+        self.assertIn(
+            'consecutive_failures',
+            self.feed_admin.get_readonly_fields(self.request, feed)
+        )
+        self.assertNotIn(
+            'consecutive_failures',
+            self.feed_admin.get_readonly_fields(self.request)
+        )
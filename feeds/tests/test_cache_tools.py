@@ -0,0 +1,64 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from feeds.utils.cache_tools import (
+    bump_generations, get_generation, get_last_modified,
+    make_etag, make_page_key
+)
+
+
+class CacheToolsTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.url = 'http://testserver/api/entries/?page_size=10'
+
+    def test_generation_is_stable_until_bumped(self):
+        generation = get_generation()
+        self.assertEqual(get_generation(), generation)
+        bump_generations([])
+        self.assertGreater(get_generation(), generation)
+
+    def test_bumping_a_feed_bumps_global_generation(self):
+        global_generation = get_generation()
+        feed_generation = get_generation(feed_id=1)
+        other_generation = get_generation(feed_id=2)
+
+        bump_generations([1])
+        self.assertGreater(get_generation(), global_generation)
+        self.assertGreater(get_generation(feed_id=1), feed_generation)
+        self.assertEqual(get_generation(feed_id=2), other_generation)
+
+    def test_bumping_an_evicted_generation(self):
+        bump_generations([3])
+        self.assertIsNotNone(get_generation(feed_id=3))
+
+    def test_page_keys(self):
+        key = make_page_key(self.url)
+        self.assertEqual(make_page_key(self.url), key)
+        self.assertNotEqual(make_page_key(self.url, feed_id=1), key)
+        self.assertNotEqual(make_page_key(self.url + '&page=2'), key)
+
+        bump_generations([])
+        self.assertNotEqual(make_page_key(self.url), key)
+
+    def test_etags(self):
+        etag = make_etag(self.url)
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'))
+        self.assertEqual(make_etag(self.url), etag)
+        self.assertNotEqual(make_etag(self.url, feed_id=1), etag)
+
+        bump_generations([])
+        self.assertNotEqual(make_etag(self.url), etag)
+
+    @patch('feeds.utils.cache_tools.time.time', return_value=1577836800.5)
+    def test_last_modified(self, mock_time):
+        self.assertIsNone(get_last_modified())
+        self.assertIsNone(get_last_modified(feed_id=1))
+
+        bump_generations([1])
+        self.assertEqual(get_last_modified(), 1577836800)
+        self.assertEqual(get_last_modified(feed_id=1), 1577836800)
+        self.assertIsNone(get_last_modified(feed_id=2))
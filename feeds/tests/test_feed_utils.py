@@ -1,16 +1,29 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+import html
+import json
+import logging
 import pytz
 import random
+import re
+import time
 from unittest.mock import patch
 
+import requests
+
 from django.test import TestCase
 from django.utils import timezone
+from django.utils.html import strip_tags
 from feedparser import FeedParserDict
 
-from feeds.tests.helpers import make_fake_feedparser_dict
+from feeds.tests.helpers import (
+    FEED_SUMMARIES_PATH, get_metric_value, make_fake_feed_response,
+    make_fake_feedparser_dict, run_in_daemonic_process
+)
 from feeds.utils.feed_tools import (
     clean_text, convert_to_utc, ENTRY_ITEM_FIELDS,
-    fetch_feedparser_dict, preprocess_feed_entry_item
+    fetch_feedparser_dict, get_parse_context, iter_feed_entries,
+    parse_feed_items, parse_feed_response, parse_feeds,
+    preprocess_feed_entry_item, UNSAFE_HTML_ELEMENT_RE
 )
 
 
@@ -24,6 +37,14 @@ class FetchFeedParserDictTest(TestCase):
         # to be used or overridden in the tests
         self.feedparser_dict = make_fake_feedparser_dict(self.feed_url)
 
+        # Patch the downloader so that no HTTP requests are made
+        patcher = patch(
+            'feeds.utils.feed_tools.download_feed',
+            return_value=make_fake_feed_response(self.feed_url)
+        )
+        self.mock_download = patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_returns_feedparser_dict_object(self, mock_parse):
         mock_parse.return_value = self.feedparser_dict
         feed = fetch_feedparser_dict(feed_url=self.feed_url)
@@ -65,6 +86,324 @@ class FetchFeedParserDictTest(TestCase):
         with self.assertRaises(ValueError):
             fetch_feedparser_dict(self.feed_url)
 
+    def test_parse_time_and_failures_are_recorded(self, mock_parse):
+        parses = get_metric_value('rss_apifier_feed_parse_seconds_count')
+        failures = get_metric_value(
+            'rss_apifier_parse_failures_total',
+            kind='document'
+        )
+        mock_parse.return_value = self.feedparser_dict
+        fetch_feedparser_dict(self.feed_url)
+        self.feedparser_dict['bozo'] = 1
+        with self.assertRaises(ValueError):
+            fetch_feedparser_dict(self.feed_url)
+
+        self.assertEqual(
+            get_metric_value('rss_apifier_feed_parse_seconds_count'),
+            parses + 2
+        )
+        self.assertEqual(
+            get_metric_value(
+                'rss_apifier_parse_failures_total',
+                kind='document'
+            ),
+            failures + 1
+        )
+
+    def test_downloaded_content_is_parsed(self, mock_parse):
+        mock_parse.return_value = self.feedparser_dict
+        fetch_feedparser_dict(self.feed_url)
+        self.mock_download.assert_called_once_with(self.feed_url)
+        self.assertEqual(
+            mock_parse.call_args[0][0],
+            self.mock_download.return_value.content
+        )
+
+    def test_download_errors_are_raised(self, mock_parse):
+        self.mock_download.side_effect = requests.ConnectionError
+        with self.assertRaises(requests.ConnectionError):
+            fetch_feedparser_dict(self.feed_url)
+        self.assertFalse(mock_parse.called)
+
+    def test_only_relevant_headers_are_passed_to_parser(self, mock_parse):
+        mock_parse.return_value = self.feedparser_dict
+        response = make_fake_feed_response(
+            self.feed_url,
+            headers={
+                'Content-Type': 'application/rss+xml; charset=utf-8',
+                'Content-Encoding': 'gzip',
+            }
+        )
+        parse_feed_response(response)
+        self.assertEqual(
+            mock_parse.call_args[1]['response_headers'],
+            {
+                'content-type': 'application/rss+xml; charset=utf-8',
+                'content-location': self.feed_url,
+            }
+        )
+
+
+RSS_DOCUMENT = b"""<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0"><channel>
+<title>Sample Feed</title>
+<link>https://www.samplefeeds.com/</link>
+<description>Sample feed</description>
+<item>
+<title>First &lt;b&gt;entry&lt;/b&gt;</title>
+<link>https://www.samplefeeds.com/1</link>
+<description>&lt;p&gt;First summary&lt;/p&gt;</description>
+<pubDate>Thu, 05 Dec 2019 10:00:00 +0000</pubDate>
+</item>
+<item>
+<title>Entry without a summary</title>
+<link>https://www.samplefeeds.com/2</link>
+<pubDate>Thu, 05 Dec 2019 09:00:00 +0000</pubDate>
+</item>
+<item>
+<title>Third entry</title>
+<link>https://www.samplefeeds.com/3</link>
+<description>Third summary</description>
+<pubDate>Thu, 05 Dec 2019 08:00:00 +0000</pubDate>
+</item>
+</channel></rss>
+"""
+
+
+class ParseFeedsTest(TestCase):
+
+    def setUp(self):
+        self.feed_url = 'https://www.samplefeeds.com/rss'   # fake URL
+
+    def make_response(self, content):
+        return make_fake_feed_response(
+            self.feed_url,
+            content=content,
+            headers={'content-type': 'application/rss+xml'}
+        )
+
+    def test_parse_feed_items_skips_invalid_entries(self):
+        items = parse_feed_items(
+            self.make_response(RSS_DOCUMENT)
+        )
+        self.assertEqual(
+            [item['link'] for item in items],
+            ['https://www.samplefeeds.com/1', 'https://www.samplefeeds.com/3']
+        )
+        self.assertEqual(items[0]['title'], 'First entry')
+        self.assertEqual(items[0]['summary'], 'First summary')
+        self.assertEqual(
+            items[0]['published'],
+            datetime(2019, 12, 5, 10, tzinfo=pytz.utc)
+        )
+
+    def test_documents_are_parsed_in_worker_processes(self):
+        responses = [
+            (i, self.make_response(RSS_DOCUMENT))
+            for i in range(3)
+        ]
+        responses.append(
+            ('bad', self.make_response(b'<p>'))
+        )
+        results = dict(parse_feeds(responses, max_workers=2, max_pending=2))
+        self.assertEqual(len(results), 4)
+        for i in range(3):
+            self.assertEqual(len(results[i]), 2)
+        self.assertIsInstance(results['bad'], ValueError)
+
+    def test_worker_processes_are_not_forked_from_this_one(self):
+        # A forked child would inherit locks held by other threads
+        self.assertNotEqual(get_parse_context().get_start_method(), 'fork')
+
+    def test_documents_are_parsed_in_daemonic_processes(self):
+        # Daemonic processes, e.g., children of Celery's prefork pool, 
+        # may not start worker processes
+        responses = [
+            (i, self.make_response(RSS_DOCUMENT))
+            for i in range(3)
+        ]
+        responses.append(
+            ('bad', self.make_response(b'<p>'))
+        )
+        results = run_in_daemonic_process(
+            lambda: dict(parse_feeds(responses, max_workers=2))
+        )
+        self.assertEqual(len(results), 4)
+        for i in range(3):
+            self.assertEqual(len(results[i]), 2)
+        self.assertIsInstance(results['bad'], ValueError)
+
+
+ATOM_DOCUMENT = b"""<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+<title>Sample Feed</title>
+<entry>
+<title type="html">First &lt;em&gt;entry&lt;/em&gt;</title>
+<link rel="self" href="https://www.samplefeeds.com/atom/1"/>
+<link href="/entries/1"/>
+<summary>First summary</summary>
+<updated>2019-12-05T10:00:00Z</updated>
+</entry>
+<entry>
+<title>Second entry</title>
+<link rel="alternate" href="https://www.samplefeeds.com/entries/2"/>
+<content type="xhtml"><div xmlns="http://www.w3.org/1999/xhtml">
+<p>Second content</p></div></content>
+<published>2019-12-05T09:00:00Z</published>
+</entry>
+</feed>
+"""
+
+
+class IterFeedEntriesTest(TestCase):
+
+    def setUp(self):
+        self.feed_url = 'https://www.samplefeeds.com/rss'   # fake URL
+
+    def iter_chunks(self, document, size=16):
+        return (document[i:i + size] for i in range(0, len(document), size))
+
+    def test_rss_entries(self):
+        entries = list(iter_feed_entries(self.iter_chunks(RSS_DOCUMENT)))
+        self.assertEqual(len(entries), 3)
+        self.assertEqual(entries[0], {
+            'link': 'https://www.samplefeeds.com/1',
+            'published': 'Thu, 05 Dec 2019 10:00:00 +0000',
+            'summary': '<p>First summary</p>',
+            'title': 'First <b>entry</b>',
+        })
+        self.assertNotIn('summary', entries[1])
+
+        items = [preprocess_feed_entry_item(entries[0])]
+        self.assertEqual(
+            items,
+            parse_feed_items(
+                make_fake_feed_response(
+                    self.feed_url,
+                    content=RSS_DOCUMENT,
+                    headers={'content-type': 'application/rss+xml'}
+                )
+            )[:1]
+        )
+
+    def test_atom_entries(self):
+        entries = list(iter_feed_entries(
+            self.iter_chunks(ATOM_DOCUMENT),
+            base_url='https://www.samplefeeds.com/atom'
+        ))
+        self.assertEqual(entries[0], {
+            'link': 'https://www.samplefeeds.com/entries/1',
+            'published': '2019-12-05T10:00:00Z',
+            'summary': 'First summary',
+            'title': 'First <em>entry</em>',
+        })
+        self.assertEqual(
+            entries[1]['link'],
+            'https://www.samplefeeds.com/entries/2'
+        )
+        self.assertEqual(entries[1]['summary'], 'Second content')
+
+    def test_guid_is_used_for_entries_without_link(self):
+        document = (
+            b'<rss version="2.0"><channel><item><title>A</title>'
+            b'<guid isPermaLink="false">tag:1</guid></item><item>'
+            b'<title>B</title><guid>https://www.samplefeeds.com/b</guid>'
+            b'</item></channel></rss>'
+        )
+        entries = list(iter_feed_entries([document]))
+        self.assertNotIn('link', entries[0])
+        self.assertEqual(entries[1]['link'], 'https://www.samplefeeds.com/b')
+
+    def test_entries_are_yielded_as_chunks_are_read(self):
+        chunks_read = []
+
+        def iter_chunks():
+            for chunk in self.iter_chunks(RSS_DOCUMENT):
+                chunks_read.append(chunk)
+                yield chunk
+
+        entries = iter_feed_entries(iter_chunks())
+        next(entries)
+        self.assertLess(
+            len(b''.join(chunks_read)),
+            RSS_DOCUMENT.index(b'Third entry')
+        )
+
+    def test_html_entities(self):
+        document = (
+            b'<rss version="2.0"><channel><title>Sample&nbsp;Feed</title>'
+            b'<item><title>Caf&eacute; &mdash; news &amp; views</title>'
+            b'<link>https://www.samplefeeds.com/1</link>'
+            b'<description>A&nbsp;summary&hellip;</description>'
+            b'<pubDate>Thu, 05 Dec 2019 10:00:00 +0000</pubDate>'
+            b'</item></channel></rss>'
+        )
+        for size in (1, 7, 16, len(document)):
+            with self.subTest(size=size):
+                entries = list(
+                    iter_feed_entries(self.iter_chunks(document, size))
+                )
+                self.assertEqual(
+                    entries[0]['title'],
+                    'Caf\xe9 \u2014 news & views'
+                )
+                self.assertEqual(
+                    entries[0]['summary'],
+                    'A\xa0summary\u2026'
+                )
+
+        items = parse_feed_items(
+            make_fake_feed_response(
+                self.feed_url,
+                content=document,
+                headers={'content-type': 'application/rss+xml'}
+            )
+        )
+        self.assertEqual(items[0]['title'], 'Caf\xe9 \u2014 news & views')
+
+    def test_scripts_and_styles_are_dropped(self):
+        document = (
+            b'<rss version="2.0"><channel><item><title>Title'
+            b'&lt;script&gt;alert(1)&lt;/script&gt;</title>'
+            b'<link>https://www.samplefeeds.com/1</link>'
+            b'<description><![CDATA[<style>p {}</style><p>Summary</p>'
+            b'<SCRIPT type="text/javascript">alert(2)</SCRIPT>]]>'
+            b'</description>'
+            b'<pubDate>Thu, 05 Dec 2019 10:00:00 +0000</pubDate>'
+            b'</item></channel></rss>'
+        )
+        entries = list(iter_feed_entries([document]))
+        items = [preprocess_feed_entry_item(entries[0])]
+        self.assertEqual(items[0]['title'], 'Title')
+        self.assertEqual(items[0]['summary'], 'Summary')
+        self.assertEqual(
+            items,
+            parse_feed_items(
+                make_fake_feed_response(
+                    self.feed_url,
+                    content=document,
+                    headers={'content-type': 'application/rss+xml'}
+                )
+            )
+        )
+
+    def test_entity_declarations_are_refused(self):
+        document = (
+            b'<!DOCTYPE rss [<!ENTITY a "aaaaaaaaaa">]>'
+            b'<rss version="2.0"><channel><item><title>&a;&a;</title>'
+            b'</item></channel></rss>'
+        )
+        with self.assertRaises(ValueError):
+            list(iter_feed_entries([document]))
+
+    def test_invalid_documents_raise_error(self):
+        with self.assertRaises(ValueError):
+            list(iter_feed_entries([b'<rss><channel><item>']))
+        with self.assertRaises(ValueError):
+            list(iter_feed_entries([b'<html><body></body></html>']))
+        with self.assertRaises(ValueError):
+            list(iter_feed_entries([b'']))
+
 
 class ProcessEntryItemTests(TestCase):
 
@@ -107,13 +446,156 @@ class ProcessEntryItemTests(TestCase):
         self.assertFalse(mock_utc.called)
         self.assertFalse(mock_clean.called)
 
+    def test_unprocessable_items_are_counted(self):
+        failures = get_metric_value(
+            'rss_apifier_parse_failures_total',
+            kind='entry'
+        )
+        del self.entry_item['link']
+        with self.assertRaises(TypeError):
+            preprocess_feed_entry_item(self.entry_item)
+        self.assertEqual(
+            get_metric_value('rss_apifier_parse_failures_total', kind='entry'),
+            failures + 1
+        )
+
     def test_date_string_conversion(self):
         datetime_str = self.entry_item['published']
         datetime_utc = convert_to_utc(datetime_str)
         self.assertIsInstance(datetime_utc, datetime)
         self.assertEqual(datetime_utc.tzinfo, pytz.UTC)
 
+    @patch('feeds.utils.feed_tools.parser.parse')
+    def test_date_parsed_by_feedparser_is_used(self, mock_dateutil):
+        published_parsed = time.strptime('2019-12-05 02:00', '%Y-%m-%d %H:%M')
+        datetime_utc = convert_to_utc('not a date', published_parsed)
+        self.assertEqual(
+            datetime_utc,
+            datetime(2019, 12, 5, 2, 0, tzinfo=pytz.UTC)
+        )
+        self.assertFalse(mock_dateutil.called)
+
+    def test_item_preprocessing_uses_parsed_dates(self):
+        self.entry_item['published'] = 'not a date'
+        self.entry_item['published_parsed'] = time.gmtime(0)
+        item = preprocess_feed_entry_item(self.entry_item)
+        self.assertEqual(
+            item['published'],
+            datetime(1970, 1, 1, tzinfo=pytz.UTC)
+        )
+
+        # The update date is only used if the published date cannot
+        # be parsed from the string either
+        del self.entry_item['published_parsed']
+        self.entry_item['updated_parsed'] = time.gmtime(60)
+        item = preprocess_feed_entry_item(self.entry_item)
+        self.assertEqual(
+            item['published'],
+            datetime(1970, 1, 1, 0, 1, tzinfo=pytz.UTC)
+        )
+
+        self.entry_item['published'] = '2019-12-05T02:00:00Z'
+        item = preprocess_feed_entry_item(self.entry_item)
+        self.assertEqual(
+            item['published'],
+            datetime(2019, 12, 5, 2, 0, tzinfo=pytz.UTC)
+        )
+
+    @patch('feeds.utils.feed_tools.parser.parse')
+    def test_fixed_format_dates_are_not_parsed_by_dateutil(
+            self,
+            mock_dateutil
+        ):
+        expected = datetime(2019, 12, 5, 2, 0, tzinfo=pytz.UTC)
+        datetime_strings = [
+            'Thu, 05 Dec 2019 10:00:00 +0800',
+            '05 Dec 2019 02:00 GMT',
+            '2019-12-05T02:00:00Z',
+            '2019-12-05T10:00:00+08:00',
+            '2019-12-05 02:00:00',
+        ]
+        for datetime_str in datetime_strings:
+            self.assertEqual(convert_to_utc(datetime_str), expected)
+        self.assertFalse(mock_dateutil.called)
+
+    def test_other_date_formats_are_parsed_by_dateutil(self):
+        self.assertEqual(
+            convert_to_utc('December 5, 2019 10:00 AM +0800'),
+            datetime(2019, 12, 5, 2, 0, tzinfo=pytz.UTC)
+        )
+
+    def test_unparseable_dates_are_counted(self):
+        fallbacks = get_metric_value('rss_apifier_entry_date_fallbacks_total')
+        for datetime_str in ['not a date', 'Thu, 31 Feb 2019 10:00:00 GMT']:
+            datetime_utc = convert_to_utc(datetime_str)
+            self.assertLess(
+                timezone.now() - datetime_utc,
+                timedelta(seconds=5)
+            )
+        self.assertEqual(
+            get_metric_value('rss_apifier_entry_date_fallbacks_total'),
+            fallbacks + 2
+        )
+
+    def test_unparseable_dates_are_logged_once_per_feed(self):
+        self.addCleanup(logging.disable, logging.root.manager.disable)
+        logging.disable(logging.NOTSET)
+        document = re.sub(
+            rb'<pubDate>.*?</pubDate>',
+            b'<pubDate>not a date</pubDate>',
+            RSS_DOCUMENT
+        )
+        with self.assertLogs(level='WARNING') as logs:
+            items = parse_feed_items(
+                make_fake_feed_response(
+                    self.feed_url,
+                    content=document,
+                    headers={'content-type': 'application/rss+xml'}
+                )
+            )
+        self.assertEqual(len(items), 2)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('Cannot parse 2 dates', logs.output[0])
+
     def test_html_tags_and_code_removal(self):
         raw_text = '<p>this&nbsp;&nbsp;string</p>'
         cleaned_text = clean_text(raw_text)
         self.assertEqual(cleaned_text, 'this  string')
+
+    def test_html_entities_are_unescaped(self):
+        raw_text = '<b>AT&amp;T</b> &#8217;s caf&eacute; &#x2014; &lt;3'
+        cleaned_text = clean_text(raw_text)
+        self.assertEqual(cleaned_text, 'AT&T \u2019s caf\u00e9 \u2014 <3')
+
+    def test_text_that_is_not_markup_is_kept(self):
+        for raw_text in ['a < b > c', 'under <10ms', 'x <b', 'plain text']:
+            self.assertEqual(clean_text(raw_text), raw_text)
+
+    def test_tags_formed_by_removing_tags_are_removed(self):
+        raw_text = '<<b>script>alert(1)<</b>/script>'
+        self.assertEqual(clean_text(raw_text), 'alert(1)')
+
+    def test_escaped_tags_are_removed(self):
+        raw_text = (
+            'one &lt;script&gt;alert(1)&lt;/script&gt;'
+            '&lt;b&gt;two&lt;/b&gt;'
+        )
+        self.assertEqual(clean_text(raw_text), 'one two')
+
+    def test_scripts_and_styles_are_removed_with_content(self):
+        raw_text = '<style>p {}</style>one<SCRIPT>alert(1)</SCRIPT> two'
+        self.assertEqual(clean_text(raw_text), 'one two')
+
+    def test_quoted_attribute_values_and_comments(self):
+        raw_text = '<a title="1 > 0">one</a><!-- <p> > --> two'
+        self.assertEqual(clean_text(raw_text), 'one two')
+
+    def test_same_output_as_strip_tags_on_feed_summaries(self):
+        with open(FEED_SUMMARIES_PATH, encoding='utf-8') as f:
+            summaries = json.load(f)
+
+        for summary in summaries:
+            # Unlike strip_tags, scripts and styles are dropped whole
+            summary = UNSAFE_HTML_ELEMENT_RE.sub('', summary)
+            expected = html.unescape(strip_tags(summary)).replace('\xa0', ' ')
+            self.assertEqual(clean_text(summary), expected)
@@ -0,0 +1,279 @@
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+import requests
+
+from feeds.tests.helpers import get_metric_value
+from feeds.utils.fetcher import (
+    download_feed, download_feeds, FeedResponse, FeedTooLargeError,
+    get_host_semaphore, interleave_hosts, open_feed
+)
+from feeds.utils.throttling import FetchThrottledError
+
+
+def make_fake_http_response(url, chunks=(b'<rss>', b'</rss>'), status=200):
+    """Creates a fake streamed `requests` response."""
+    response = MagicMock()
+    response.__enter__.return_value = response
+    response.url = url
+    response.status_code = status
+    response.headers = {'Content-Type': 'application/rss+xml'}
+    response.iter_content.return_value = iter(chunks)
+    if status >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(status)
+    return response
+
+
+@patch('feeds.utils.fetcher.get_session')
+class DownloadFeedTest(TestCase):
+
+    def setUp(self):
+        self.feed_url = 'https://www.samplefeeds.com/rss'   # fake URL
+        cache.clear()
+
+    def test_returns_feed_response(self, mock_session):
+        mock_session.return_value.get.return_value = make_fake_http_response(
+            self.feed_url
+        )
+        response = download_feed(self.feed_url)
+        self.assertIsInstance(response, FeedResponse)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.content, b'<rss></rss>')
+        self.assertEqual(
+            response.headers,
+            {'content-type': 'application/rss+xml'}
+        )
+
+    @override_settings(FEED_FETCH_TIMEOUT=12)
+    def test_request_uses_timeout(self, mock_session):
+        mock_session.return_value.get.return_value = make_fake_http_response(
+            self.feed_url
+        )
+        download_feed(self.feed_url)
+        self.assertEqual(
+            mock_session.return_value.get.call_args[1]['timeout'],
+            12
+        )
+
+    def test_conditional_request_headers(self, mock_session):
+        mock_session.return_value.get.return_value = make_fake_http_response(
+            self.feed_url,
+            chunks=(),
+            status=304
+        )
+        response = download_feed(
+            self.feed_url,
+            etag='"abc123"',
+            modified='Mon, 02 Dec 2019 10:00:00 GMT'
+        )
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(
+            mock_session.return_value.get.call_args[1]['headers'],
+            {
+                'If-None-Match': '"abc123"',
+                'If-Modified-Since': 'Mon, 02 Dec 2019 10:00:00 GMT',
+            }
+        )
+
+    def test_unconditional_request_without_validators(self, mock_session):
+        mock_session.return_value.get.return_value = make_fake_http_response(
+            self.feed_url
+        )
+        download_feed(self.feed_url)
+        self.assertEqual(
+            mock_session.return_value.get.call_args[1]['headers'],
+            {}
+        )
+
+    def test_http_errors_are_raised(self, mock_session):
+        mock_session.return_value.get.return_value = make_fake_http_response(
+            self.feed_url,
+            status=404
+        )
+        with self.assertRaises(requests.HTTPError):
+            download_feed(self.feed_url)
+
+    @patch('feeds.utils.fetcher.time.monotonic')
+    def test_slow_downloads_time_out(self, mock_monotonic, mock_session):
+        mock_monotonic.side_effect = [0, 1, 2, 1000]
+        mock_session.return_value.get.return_value = make_fake_http_response(
+            self.feed_url
+        )
+        with self.assertRaises(requests.Timeout):
+            download_feed(self.feed_url)
+
+    def test_fetch_time_and_size_are_recorded(self, mock_session):
+        fetches = get_metric_value('rss_apifier_feed_fetch_seconds_count')
+        downloads = get_metric_value('rss_apifier_feed_download_bytes_count')
+        downloaded = get_metric_value('rss_apifier_feed_download_bytes_sum')
+        mock_session.return_value.get.return_value = make_fake_http_response(
+            self.feed_url
+        )
+        download_feed(self.feed_url)
+        self.assertEqual(
+            get_metric_value('rss_apifier_feed_fetch_seconds_count'),
+            fetches + 1
+        )
+        self.assertEqual(
+            get_metric_value('rss_apifier_feed_download_bytes_count'),
+            downloads + 1
+        )
+        self.assertEqual(
+            get_metric_value('rss_apifier_feed_download_bytes_sum'),
+            downloaded + len(b'<rss></rss>')
+        )
+
+    def test_documents_larger_than_max_size(self, mock_session):
+        http_response = make_fake_http_response(
+            self.feed_url,
+            chunks=(b'<rss>', b'<channel>', b'</channel>', b'</rss>')
+        )
+        mock_session.return_value.get.return_value = http_response
+        with self.assertRaises(FeedTooLargeError) as cm:
+            download_feed(self.feed_url, max_size=10)
+        self.assertFalse(http_response.__exit__.called)
+        self.assertEqual(
+            b''.join(cm.exception.stream.chunks),
+            b'<rss><channel></channel></rss>'
+        )
+        cm.exception.close()
+        self.assertTrue(http_response.__exit__.called)
+
+        mock_session.return_value.get.return_value = make_fake_http_response(
+            self.feed_url
+        )
+        response = download_feed(self.feed_url, max_size=11)
+        self.assertEqual(response.content, b'<rss></rss>')
+
+    def test_content_length_larger_than_max_size(self, mock_session):
+        http_response = make_fake_http_response(self.feed_url)
+        http_response.headers['Content-Length'] = '100000'
+        mock_session.return_value.get.return_value = http_response
+        with self.assertRaises(FeedTooLargeError) as cm:
+            download_feed(self.feed_url, max_size=1000)
+        self.assertFalse(http_response.iter_content.called)
+        self.assertEqual(b''.join(cm.exception.stream.chunks), b'<rss></rss>')
+        cm.exception.close()
+        self.assertTrue(http_response.__exit__.called)
+
+    def test_open_feed_streams_chunks(self, mock_session):
+        mock_session.return_value.get.return_value = make_fake_http_response(
+            self.feed_url
+        )
+        with open_feed(self.feed_url) as stream:
+            self.assertEqual(stream.status, 200)
+            self.assertEqual(next(stream.chunks), b'<rss>')
+            self.assertEqual(list(stream.chunks), [b'</rss>'])
+
+    def test_too_many_requests_blocks_host(self, mock_session):
+        http_response = make_fake_http_response(self.feed_url, status=429)
+        http_response.headers['Retry-After'] = '120'
+        mock_session.return_value.get.return_value = http_response
+        with self.assertRaises(FetchThrottledError):
+            download_feed(self.feed_url)
+
+        with self.assertRaises(FetchThrottledError):
+            download_feed('https://www.samplefeeds.com/atom')
+        self.assertEqual(mock_session.return_value.get.call_count, 1)
+
+    @patch('feeds.utils.fetcher.time.sleep')
+    def test_waits_for_turn_of_host(self, mock_sleep, mock_session):
+        mock_session.return_value.get.side_effect = (
+            lambda url, **kwargs: make_fake_http_response(url)
+        )
+        with override_settings(FEED_HOST_RATE=0.5, FEED_HOST_BURST=1):
+            download_feed(self.feed_url)
+            download_feed(self.feed_url)
+        self.assertGreater(mock_sleep.call_args_list[-1][0][0], 0)
+
+    def test_same_host_shares_semaphore(self, mock_session):
+        self.assertIs(
+            get_host_semaphore('https://www.samplefeeds.com/rss'),
+            get_host_semaphore('https://WWW.samplefeeds.com/atom')
+        )
+        self.assertIsNot(
+            get_host_semaphore('https://www.samplefeeds.com/rss'),
+            get_host_semaphore('https://www.otherfeeds.com/rss')
+        )
+
+
+@patch('feeds.utils.fetcher.download_feed')
+class DownloadFeedsTest(TestCase):
+
+    def setUp(self):
+        self.feed_urls = [f'https://www.feed{i}.com/rss' for i in range(10)]
+
+    def test_downloads_all_feeds(self, mock_download):
+        mock_download.side_effect = lambda url: FeedResponse(
+            url, 200, b'', {}
+        )
+        results = dict(download_feeds(self.feed_urls, max_workers=4))
+        self.assertCountEqual(results.keys(), self.feed_urls)
+        for url, response in results.items():
+            self.assertEqual(response.url, url)
+
+    def test_errors_are_yielded_in_place_of_responses(self, mock_download):
+        failed_url = self.feed_urls[3]
+
+        def fake_download(url):
+            if url == failed_url:
+                raise requests.ConnectionError
+            return FeedResponse(url, 200, b'', {})
+
+        mock_download.side_effect = fake_download
+        results = dict(download_feeds(self.feed_urls, max_workers=4))
+        self.assertEqual(len(results), len(self.feed_urls))
+        self.assertIsInstance(results[failed_url], requests.ConnectionError)
+
+    def test_validators_are_passed_per_feed(self, mock_download):
+        mock_download.side_effect = lambda url, *args: FeedResponse(
+            url, 200, b'', {}
+        )
+        validators = {self.feed_urls[0]: ('"abc"', '')}
+        list(download_feeds(self.feed_urls[:2], validators, max_workers=1))
+        mock_download.assert_any_call(self.feed_urls[0], '"abc"', '')
+        mock_download.assert_any_call(self.feed_urls[1])
+
+    def test_downloads_are_started_as_feeds_are_consumed(self, mock_download):
+        mock_download.side_effect = lambda url: FeedResponse(
+            url, 200, b'', {}
+        )
+        results = download_feeds(self.feed_urls, max_workers=2, max_pending=3)
+        next(results)
+        self.assertEqual(mock_download.call_count, 3)
+        self.assertEqual(len(list(results)), len(self.feed_urls) - 1)
+
+
+    def test_unconsumed_open_downloads_are_closed(self, mock_download):
+        started = []
+        closed = []
+
+        def fake_download(url, **kwargs):
+            started.append(url)
+            raise FeedTooLargeError(close=lambda: closed.append(url))
+
+        mock_download.side_effect = fake_download
+        results = download_feeds(self.feed_urls, max_workers=3, max_pending=3)
+        url, error = next(results)
+        results.close()
+        # Downloads that had not started yet are cancelled instead
+        self.assertCountEqual(closed, set(started) - {url})
+        self.assertNotIn(url, closed)
+
+
+class InterleaveHostsTest(TestCase):
+
+    def test_hosts_take_turns(self):
+        feed_urls = [
+            'https://a.com/1', 'https://a.com/2', 'https://a.com/3',
+            'https://b.com/1', 'https://c.com/1', 'https://c.com/2',
+        ]
+        self.assertEqual(
+            interleave_hosts(feed_urls),
+            [
+                'https://a.com/1', 'https://b.com/1', 'https://c.com/1',
+                'https://a.com/2', 'https://c.com/2', 'https://a.com/3',
+            ]
+        )
@@ -0,0 +1,174 @@
+import time
+from unittest.mock import MagicMock, patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from feeds.utils.leases import (
+    feed_lease, Heartbeat, Lease, LeaseUnavailableError, RELEASE_SCRIPT,
+    RENEW_SCRIPT
+)
+
+
+@override_settings(FETCH_LEASE_TIMEOUT=30)
+class LeaseTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_lease_is_held_by_one_worker(self):
+        lease = Lease('sample')
+        other_lease = Lease('sample')
+        self.assertTrue(lease.acquire())
+        self.assertFalse(other_lease.acquire())
+        self.assertTrue(lease.held)
+        self.assertFalse(other_lease.held)
+
+    def test_leases_have_separate_names(self):
+        self.assertTrue(feed_lease(1).acquire())
+        self.assertTrue(feed_lease(2).acquire())
+        self.assertTrue(Lease('sample').acquire())
+
+    def test_released_lease_can_be_taken(self):
+        lease = Lease('sample')
+        lease.acquire()
+        lease.release()
+        self.assertFalse(lease.held)
+        self.assertTrue(Lease('sample').acquire())
+
+    def test_lease_expires_after_its_timeout(self):
+        lease = Lease('sample', timeout=10)
+        lease.acquire()
+        now = time.time()
+        with patch('time.time', return_value=now + 11):
+            self.assertTrue(Lease('sample').acquire())
+            self.assertFalse(lease.renew())
+
+    def test_renewed_lease_is_kept(self):
+        lease = Lease('sample', timeout=10)
+        lease.acquire()
+        now = time.time()
+        with patch('time.time', return_value=now + 8) as mock_time:
+            self.assertTrue(lease.renew())
+            mock_time.return_value += 8
+            self.assertFalse(Lease('sample').acquire())
+
+    def test_only_the_holder_releases_a_lease(self):
+        lease = Lease('sample', timeout=10)
+        lease.acquire()
+        cache.clear()
+        other_lease = Lease('sample')
+        other_lease.acquire()
+
+        lease.held = True
+        lease.release()
+        self.assertFalse(Lease('sample').acquire())
+        self.assertFalse(lease.renew())
+
+    def test_handed_over_lease_is_released_by_new_holder(self):
+        lease = Lease('sample', timeout=10)
+        lease.acquire()
+        token = lease.hand_over(100)
+        self.assertFalse(lease.held)
+        lease.release()
+
+        now = time.time()
+        with patch('time.time', return_value=now + 50):
+            self.assertFalse(Lease('sample').acquire())
+            Lease('sample', token=token).release()
+            self.assertTrue(Lease('sample').acquire())
+
+    def test_context_manager(self):
+        with Lease('sample') as lease:
+            self.assertTrue(lease.held)
+            with self.assertRaises(LeaseUnavailableError):
+                with Lease('sample'):
+                    pass
+        self.assertFalse(lease.held)
+        self.assertTrue(Lease('sample').acquire())
+
+
+class RedisLeaseTest(TestCase):
+
+    def setUp(self):
+        self.client = MagicMock()
+        patcher = patch(
+            'feeds.utils.leases.get_redis_client',
+            return_value=self.client
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lease = Lease('sample', timeout=30)
+        self.key = cache.make_key('lease:sample')
+
+    def test_lease_is_set_if_not_held(self):
+        self.client.set.return_value = True
+        self.assertTrue(self.lease.acquire())
+        self.client.set.assert_called_once_with(
+            self.key,
+            self.lease.token,
+            nx=True,
+            px=30000
+        )
+
+        self.client.set.return_value = None
+        self.assertFalse(Lease('sample').acquire())
+
+    def test_lease_is_renewed_and_released_by_token(self):
+        self.client.set.return_value = True
+        self.client.eval.return_value = 1
+        self.lease.acquire()
+        self.assertTrue(self.lease.renew())
+        self.client.eval.assert_called_with(
+            RENEW_SCRIPT, 1, self.key, self.lease.token, 30000
+        )
+        self.lease.release()
+        self.client.eval.assert_called_with(
+            RELEASE_SCRIPT, 1, self.key, self.lease.token
+        )
+
+    def test_lost_lease_is_not_held(self):
+        self.client.set.return_value = True
+        self.client.eval.return_value = 0
+        self.lease.acquire()
+        self.assertFalse(self.lease.renew())
+        self.assertFalse(self.lease.held)
+
+
+class HeartbeatTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_leases_are_renewed_until_stopped(self):
+        lease = Lease('sample', timeout=0.15)
+        lease.acquire()
+        with patch.object(lease, 'renew', wraps=lease.renew) as mock_renew:
+            with Heartbeat([lease]):
+                time.sleep(0.25)
+            renewals = mock_renew.call_count
+            time.sleep(0.1)
+
+        self.assertGreaterEqual(renewals, 2)
+        self.assertEqual(mock_renew.call_count, renewals)
+        self.assertTrue(lease.held)
+
+    def test_added_leases_are_renewed(self):
+        lease = Lease('sample', timeout=0.15)
+        other_lease = Lease('other', timeout=0.15)
+        other_lease.acquire()
+        with patch.object(lease, 'renew', wraps=lease.renew) as mock_renew:
+            with Heartbeat([other_lease]) as heartbeat:
+                lease.acquire()
+                heartbeat.add(lease)
+                time.sleep(0.25)
+        self.assertTrue(mock_renew.called)
+
+    def test_released_leases_are_not_renewed(self):
+        lease = Lease('sample', timeout=0.15)
+        lease.acquire()
+        with patch.object(lease, 'renew') as mock_renew:
+            with Heartbeat([lease]):
+                lease.release()
+                time.sleep(0.15)
+        self.assertFalse(mock_renew.called)
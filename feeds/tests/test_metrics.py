@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+import tempfile
+from unittest.mock import patch
+
+from django.conf import settings
+from django.test import TestCase
+
+from feeds.tests.helpers import get_metric_value
+from feeds.utils import metrics
+
+
+class GenerateMetricsTest(TestCase):
+
+    def test_metrics_of_this_process_are_exposed(self):
+        metrics.ENTRIES_SAVED.inc(3)
+        saved = get_metric_value('rss_apifier_entries_saved_total')
+        with patch.dict(os.environ):
+            os.environ.pop(metrics.MULTIPROCESS_DIR_ENV, None)
+            output = metrics.generate_metrics().decode()
+
+        self.assertIn(f'rss_apifier_entries_saved_total {saved}', output)
+        self.assertIn('rss_apifier_feed_fetch_seconds_bucket', output)
+
+    def test_metrics_of_all_processes_are_added_up(self):
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            environ = {**os.environ, metrics.MULTIPROCESS_DIR_ENV: metrics_dir}
+            for amount in [3, 4]:
+                subprocess.run(
+                    [
+                        sys.executable, '-c',
+                        'from feeds.utils import metrics; '
+                        f'metrics.ENTRIES_SAVED.inc({amount})'
+                    ],
+                    cwd=settings.BASE_DIR,
+                    env=environ,
+                    check=True
+                )
+
+            with patch.dict(os.environ, environ):
+                output = metrics.generate_metrics().decode()
+
+        self.assertIn('rss_apifier_entries_saved_total 7.0', output)
+
+    def test_processes_of_containers_have_separate_files(self):
+        # Processes of two containers with the same process ID
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            environ = {**os.environ, metrics.MULTIPROCESS_DIR_ENV: metrics_dir}
+            for hostname, amount in [('app', 3), ('worker', 4)]:
+                subprocess.run(
+                    [
+                        sys.executable, '-c',
+                        'import os, socket; '
+                        'os.getpid = lambda: 1; '
+                        f'socket.gethostname = lambda: {hostname!r}; '
+                        'from feeds.utils import metrics; '
+                        f'metrics.ENTRIES_SAVED.inc({amount})'
+                    ],
+                    cwd=settings.BASE_DIR,
+                    env=environ,
+                    check=True
+                )
+            filenames = os.listdir(metrics_dir)
+
+            with patch.dict(os.environ, environ):
+                output = metrics.generate_metrics().decode()
+
+        self.assertIn('counter_app_1.db', filenames)
+        self.assertIn('counter_worker_1.db', filenames)
+        self.assertIn('rss_apifier_entries_saved_total 7.0', output)
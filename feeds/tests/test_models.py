@@ -1,14 +1,20 @@
+from datetime import timedelta
 from unittest.mock import patch
+from urllib.parse import urljoin
 
 from django.conf import settings
-from django.db import IntegrityError
-from django.test import TestCase
+from django.utils import timezone
+from django.db import DataError, IntegrityError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from feeds.tests.helpers import (
+    create_and_save_feeds, get_metric_value, make_fake_feed_response,
     make_fake_feedparser_dict, make_feed_entries_list,
-    make_preprocessed_entries_list
+    make_preprocessed_entries_list, make_rss_document
 )
 from feeds.models import Entry, Feed
+from feeds.utils.fetcher import FeedStream, FeedTooLargeError, hash_content
 
 
 class FeedModelTest(TestCase):
@@ -131,6 +137,112 @@ class FeedModelTest(TestCase):
         with self.assertRaises(TypeError):
             feed.fetch_and_set_feed_details()
 
+    def test_due_feeds(self):
+        now = timezone.now()
+        never_fetched = Feed.objects.create(link=self.feed_url)
+        overdue = Feed.objects.create(
+            link='https://www.samplefeeds.com/overdue',
+            next_fetch_at=now - timedelta(minutes=1)
+        )
+        Feed.objects.create(
+            link='https://www.samplefeeds.com/later',
+            next_fetch_at=now + timedelta(minutes=1)
+        )
+        self.assertCountEqual(
+            Feed.objects.due(now),
+            [never_fetched, overdue]
+        )
+
+
+@override_settings(
+    FEED_POLL_MIN_INTERVAL=60 * 5,
+    FEED_POLL_MAX_INTERVAL=60 * 60 * 24,
+    FEED_POLL_SMOOTHING=0.5,
+    FEED_POLL_BACKOFF=0.5
+)
+class FeedSchedulingTest(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.feed = Feed(link='https://www.samplefeeds.com/rss')
+
+    def test_first_new_entries(self):
+        self.feed.schedule_next_fetch(10, now=self.now)
+        self.assertEqual(self.feed.last_new_entry_at, self.now)
+        self.assertIsNone(self.feed.publish_interval)
+        self.assertEqual(
+            self.feed.next_fetch_at,
+            self.now + timedelta(minutes=5)
+        )
+
+    def test_publish_interval_is_estimated(self):
+        self.feed.last_new_entry_at = self.now - timedelta(hours=2)
+        self.feed.publish_interval = timedelta(hours=1)
+        self.feed.schedule_next_fetch(2, now=self.now)
+
+        # Observed 1 hour per entry, smoothed with the previous hour
+        self.assertEqual(self.feed.publish_interval, timedelta(hours=1))
+        self.assertEqual(self.feed.last_new_entry_at, self.now)
+        self.assertEqual(self.feed.next_fetch_at, self.now + timedelta(hours=1))
+
+    def test_quiet_feed_is_backed_off(self):
+        self.feed.last_new_entry_at = self.now - timedelta(hours=10)
+        self.feed.publish_interval = timedelta(hours=1)
+        self.feed.schedule_next_fetch(0, now=self.now)
+
+        self.assertEqual(self.feed.publish_interval, timedelta(hours=1))
+        self.assertEqual(self.feed.next_fetch_at, self.now + timedelta(hours=5))
+
+
+@override_settings(
+    FEED_FAILURE_BACKOFF=60 * 5,
+    FEED_FAILURE_MAX_BACKOFF=60 * 60 * 24,
+    FEED_UNHEALTHY_FAILURES=3
+)
+class FeedHealthTest(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        self.feed = create_and_save_feeds(1).first()
+
+    def test_failures_back_off_feed(self):
+        self.feed.record_failure(ValueError('Invalid feed'), now=self.now)
+        self.feed.record_failure(ValueError('Invalid feed'), now=self.now)
+
+        feed = Feed.objects.get(pk=self.feed.pk)
+        self.assertEqual(feed.consecutive_failures, 2)
+        self.assertEqual(feed.last_error, 'ValueError: Invalid feed')
+        self.assertEqual(
+            feed.disabled_until,
+            self.now + timedelta(minutes=10)
+        )
+
+    def test_backed_off_feeds_are_not_due(self):
+        self.feed.record_failure(ValueError(), now=self.now)
+        self.assertNotIn(self.feed, Feed.objects.due(self.now))
+        self.assertIn(
+            self.feed,
+            Feed.objects.due(self.now + timedelta(minutes=6))
+        )
+
+    def test_success_resets_health(self):
+        self.feed.record_failure(ValueError(), now=self.now)
+        self.feed.record_update(Feed.FETCH_STATUS_UPDATED, 1)
+
+        feed = Feed.objects.get(pk=self.feed.pk)
+        self.assertEqual(feed.consecutive_failures, 0)
+        self.assertEqual(feed.last_error, '')
+        self.assertIsNone(feed.disabled_until)
+        self.assertGreaterEqual(feed.last_success_at, self.now)
+
+    def test_unhealthy_feeds(self):
+        for i in range(2):
+            self.feed.record_failure(ValueError(), now=self.now)
+        self.assertNotIn(self.feed, Feed.objects.unhealthy())
+
+        self.feed.record_failure(ValueError(), now=self.now)
+        self.assertIn(self.feed, Feed.objects.unhealthy())
+
 
 class EntryModelTest(TestCase):
 
@@ -208,7 +320,7 @@ class EntryModelTest(TestCase):
 
 
 @patch('feeds.models.preprocess_feed_entry_item')
-@patch('feeds.models.fetch_feedparser_dict')
+@patch('feeds.models.parse_feed_response')
 class EntryProcessingAndSavingTest(TestCase):
 
     def setUp(self):
@@ -230,6 +342,14 @@ class EntryProcessingAndSavingTest(TestCase):
             feed_url=self.feed_url
         )
 
+        # Patch the downloader so that no HTTP requests are made
+        patcher = patch(
+            'feeds.models.download_feed',
+            return_value=make_fake_feed_response(self.feed_url)
+        )
+        self.mock_download = patcher.start()
+        self.addCleanup(patcher.stop)
+
     def test_entries_processing_and_saving(self, mock_fetch, mock_parse):
         mock_fetch.return_value = self.feed_dict
         mock_parse.side_effect = self.parsed_entries
@@ -299,3 +419,430 @@ class EntryProcessingAndSavingTest(TestCase):
         self.assertIn(e2, self.feed.entries.all())
         self.assertIn(e3, self.feed.entries.all())
         self.assertNotIn(e4, self.feed.entries.all())
+
+    def test_uses_already_downloaded_response(self, mock_fetch, mock_parse):
+        mock_fetch.return_value = self.feed_dict
+        mock_parse.side_effect = self.parsed_entries
+        response = make_fake_feed_response(self.feed_url, content=b'<rss/>')
+
+        res = self.feed.update_feed_entries(response=response)
+        self.assertEqual(res, self.total_entries)
+        self.assertFalse(self.mock_download.called)
+        mock_fetch.assert_called_once_with(response)
+
+    def test_uses_already_parsed_items(self, mock_fetch, mock_parse):
+        response = make_fake_feed_response(self.feed_url, content=b'<rss/>')
+
+        res = self.feed.update_feed_entries(
+            response=response,
+            items=self.parsed_entries
+        )
+        self.assertEqual(res, self.total_entries)
+        self.assertEqual(self.feed.entries.count(), self.total_entries)
+        self.assertFalse(mock_fetch.called)
+        self.assertFalse(mock_parse.called)
+        self.assertEqual(self.feed.content_hash, hash_content(b'<rss/>'))
+
+    def test_needs_parsing(self, mock_fetch, mock_parse):
+        response = make_fake_feed_response(self.feed_url, content=b'<rss/>')
+        self.assertTrue(self.feed.needs_parsing(response))
+
+        self.feed.content_hash = hash_content(b'<rss/>')
+        self.assertFalse(self.feed.needs_parsing(response))
+
+        not_modified = make_fake_feed_response(self.feed_url, status=304)
+        self.assertFalse(self.feed.needs_parsing(not_modified))
+
+    @patch('feeds.utils.fetcher.hash_content', wraps=hash_content)
+    def test_documents_are_hashed_once(
+            self,
+            mock_hash,
+            mock_fetch,
+            mock_parse
+        ):
+        response = make_fake_feed_response(self.feed_url, content=b'<rss/>')
+        self.assertTrue(self.feed.needs_parsing(response))
+        self.feed.update_feed_entries(
+            response=response,
+            items=self.parsed_entries
+        )
+        self.assertEqual(mock_hash.call_count, 1)
+
+    def test_downloads_with_saved_validators(self, mock_fetch, mock_parse):
+        mock_fetch.return_value = self.feed_dict
+        mock_parse.side_effect = self.parsed_entries
+        self.feed.etag = '"abc123"'
+        self.feed.modified = 'Mon, 02 Dec 2019 10:00:00 GMT'
+
+        self.feed.update_feed_entries()
+        self.mock_download.assert_called_once_with(
+            self.feed_url,
+            etag='"abc123"',
+            modified='Mon, 02 Dec 2019 10:00:00 GMT',
+            max_size=settings.FEED_STREAM_MIN_SIZE
+        )
+
+    def test_saves_validators_from_response(self, mock_fetch, mock_parse):
+        mock_fetch.return_value = self.feed_dict
+        mock_parse.side_effect = self.parsed_entries
+        self.mock_download.return_value = make_fake_feed_response(
+            self.feed_url,
+            headers={
+                'etag': '"abc123"',
+                'last-modified': 'Mon, 02 Dec 2019 10:00:00 GMT',
+            }
+        )
+
+        self.feed.update_feed_entries()
+        feed = Feed.objects.get(pk=self.feed.pk)
+        self.assertEqual(feed.etag, '"abc123"')
+        self.assertEqual(feed.modified, 'Mon, 02 Dec 2019 10:00:00 GMT')
+        self.assertEqual(feed.fetch_status, Feed.FETCH_STATUS_UPDATED)
+
+    def test_overlong_validators_are_dropped(self, mock_fetch, mock_parse):
+        mock_fetch.return_value = self.feed_dict
+        mock_parse.side_effect = self.parsed_entries
+        self.mock_download.return_value = make_fake_feed_response(
+            self.feed_url,
+            headers={'etag': 'x' * 1000}
+        )
+
+        self.feed.update_feed_entries()
+        self.assertEqual(Feed.objects.get(pk=self.feed.pk).etag, '')
+
+    def test_not_modified_response_skips_parsing(self, mock_fetch, mock_parse):
+        self.mock_download.return_value = make_fake_feed_response(
+            self.feed_url,
+            status=304
+        )
+
+        res = self.feed.update_feed_entries()
+        self.assertEqual(res, 0)
+        self.assertFalse(mock_fetch.called)
+        self.assertFalse(mock_parse.called)
+        self.assertEqual(
+            Feed.objects.get(pk=self.feed.pk).fetch_status,
+            Feed.FETCH_STATUS_NOT_MODIFIED
+        )
+
+    def test_entries_are_saved_in_bulk(self, mock_fetch, mock_parse):
+        mock_parse.side_effect = self.parsed_entries
+
+        with CaptureQueriesContext(connection) as queries:
+            res = self.feed.ingest_entries(self.feed_dict.entries)
+
+        self.assertEqual(res, self.total_entries)
+        self.assertEqual(self.feed.entries.count(), self.total_entries)
+        self.assertLessEqual(len(queries), 7)
+
+    def test_saved_entries_are_searchable(self, mock_fetch, mock_parse):
+        mock_parse.side_effect = self.parsed_entries
+
+        self.feed.ingest_entries(self.feed_dict.entries)
+        self.assertFalse(
+            Entry.objects.filter(search_vector__isnull=True).exists()
+        )
+        self.assertEqual(
+            list(Entry.objects.search('title').values_list('link', flat=True)),
+            list(Entry.objects.order_by(
+                '-published', '-id'
+            ).values_list('link', flat=True))
+        )
+
+    def test_entries_saved_one_by_one_are_searchable(
+            self,
+            mock_fetch,
+            mock_parse
+        ):
+        mock_parse.side_effect = self.parsed_entries
+
+        with patch.object(Entry.objects, 'bulk_create') as mock_bulk:
+            mock_bulk.side_effect = DataError
+            self.feed.ingest_entries(self.feed_dict.entries)
+
+        self.assertEqual(
+            Entry.objects.search('summary').count(),
+            self.total_entries
+        )
+
+    def test_duplicate_links_within_feed(self, mock_fetch, mock_parse):
+        self.parsed_entries[1] = dict(
+            self.parsed_entries[1],
+            link=self.parsed_entries[0]['link']
+        )
+        mock_parse.side_effect = self.parsed_entries
+
+        res = self.feed.ingest_entries(self.feed_dict.entries)
+        self.assertEqual(res, self.total_entries - 1)
+        self.assertEqual(self.feed.entries.count(), self.total_entries - 1)
+
+    def test_saved_and_duplicate_entries_are_counted(
+            self,
+            mock_fetch,
+            mock_parse
+        ):
+        saved = get_metric_value('rss_apifier_entries_saved_total')
+        duplicates = get_metric_value('rss_apifier_entry_duplicates_total')
+        writes = get_metric_value('rss_apifier_entry_write_seconds_count')
+        self.feed.entries.create(**self.parsed_entries[1])
+        mock_parse.side_effect = self.parsed_entries
+
+        self.feed.ingest_entries(self.feed_dict.entries)
+        self.assertEqual(
+            get_metric_value('rss_apifier_entries_saved_total'),
+            saved + self.total_entries - 1
+        )
+        self.assertEqual(
+            get_metric_value('rss_apifier_entry_duplicates_total'),
+            duplicates + 1
+        )
+        self.assertEqual(
+            get_metric_value('rss_apifier_entry_write_seconds_count'),
+            writes + 1
+        )
+
+    @patch('feeds.models.bump_generations')
+    @patch('feeds.models.transaction.on_commit')
+    def test_saving_entries_invalidates_cached_pages(
+            self,
+            mock_on_commit,
+            mock_bump,
+            mock_fetch,
+            mock_parse
+        ):
+        mock_parse.side_effect = self.parsed_entries
+
+        self.feed.ingest_entries(self.feed_dict.entries)
+        self.assertEqual(mock_on_commit.call_count, 1)
+        self.assertFalse(mock_bump.called)
+
+        # Cached pages are invalidated only once entries are committed
+        on_commit_func = mock_on_commit.call_args[0][0]
+        on_commit_func()
+        mock_bump.assert_called_once_with([self.feed.pk])
+
+    @patch('feeds.models.transaction.on_commit')
+    def test_no_new_entries_keeps_cached_pages(
+            self,
+            mock_on_commit,
+            mock_fetch,
+            mock_parse
+        ):
+        self.assertEqual(self.feed.save_new_entries([]), 0)
+        self.assertFalse(mock_on_commit.called)
+
+    def test_bulk_insert_errors_fall_back_to_single_inserts(
+            self,
+            mock_fetch,
+            mock_parse
+        ):
+        mock_parse.side_effect = self.parsed_entries
+
+        with patch.object(Entry.objects, 'bulk_create') as mock_bulk:
+            mock_bulk.side_effect = DataError
+            res = self.feed.ingest_entries(self.feed_dict.entries)
+
+        self.assertTrue(mock_bulk.called)
+        self.assertEqual(res, self.total_entries)
+        self.assertEqual(self.feed.entries.count(), self.total_entries)
+
+    def test_saves_content_hash(self, mock_fetch, mock_parse):
+        mock_fetch.return_value = self.feed_dict
+        mock_parse.side_effect = self.parsed_entries
+        self.mock_download.return_value = make_fake_feed_response(
+            self.feed_url,
+            content=b'<rss>v1</rss>'
+        )
+
+        self.feed.update_feed_entries()
+        self.assertEqual(
+            Feed.objects.get(pk=self.feed.pk).content_hash,
+            hash_content(b'<rss>v1</rss>')
+        )
+
+    def test_unchanged_content_skips_parsing(self, mock_fetch, mock_parse):
+        self.feed.content_hash = hash_content(b'<rss>v1</rss>')
+        self.feed.save()
+        self.mock_download.return_value = make_fake_feed_response(
+            self.feed_url,
+            content=b'<rss>v1</rss>'
+        )
+
+        res = self.feed.update_feed_entries()
+        self.assertEqual(res, 0)
+        self.assertFalse(mock_fetch.called)
+        self.assertFalse(mock_parse.called)
+        self.assertEqual(
+            Feed.objects.get(pk=self.feed.pk).fetch_status,
+            Feed.FETCH_STATUS_UNCHANGED
+        )
+
+    def test_changed_content_is_parsed(self, mock_fetch, mock_parse):
+        mock_fetch.return_value = self.feed_dict
+        mock_parse.side_effect = self.parsed_entries
+        self.feed.content_hash = hash_content(b'<rss>v1</rss>')
+        self.feed.save()
+        self.mock_download.return_value = make_fake_feed_response(
+            self.feed_url,
+            content=b'<rss>v2</rss>'
+        )
+
+        res = self.feed.update_feed_entries()
+        self.assertEqual(res, self.total_entries)
+        self.assertTrue(mock_fetch.called)
+
+    def test_update_schedules_next_fetch(self, mock_fetch, mock_parse):
+        mock_fetch.return_value = self.feed_dict
+        mock_parse.side_effect = self.parsed_entries
+
+        self.feed.update_feed_entries()
+        feed = Feed.objects.get(pk=self.feed.pk)
+        self.assertIsNotNone(feed.last_new_entry_at)
+        self.assertGreater(feed.next_fetch_at, timezone.now())
+        self.assertFalse(Feed.objects.due().filter(pk=feed.pk).exists())
+
+
+class FeedStreamingTest(TestCase):
+
+    def setUp(self):
+        self.feed = create_and_save_feeds(1).first()
+        self.feed_entries = make_feed_entries_list(
+            n_items=500,
+            feed_url=self.feed.link
+        )
+        self.chunks_read = 0
+
+        patcher = patch('feeds.models.open_feed')
+        self.mock_open = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.set_document(self.feed_entries)
+
+    def set_document(self, feed_entries, status=200):
+        """Makes the patched `open_feed` stream a document of entries."""
+        document = make_rss_document(feed_entries, self.feed.link)
+        self.chunks = [
+            document[i:i + 1024] for i in range(0, len(document), 1024)
+        ]
+
+        def iter_chunks():
+            for chunk in self.chunks:
+                self.chunks_read += 1
+                yield chunk
+
+        self.mock_open.return_value.__enter__.return_value = FeedStream(
+            url=self.feed.link,
+            status=status,
+            chunks=iter_chunks(),
+            headers={'etag': '"abc123"'}
+        )
+
+    def test_saves_new_entries(self):
+        res = self.feed.stream_feed_entries()
+        self.assertEqual(res, len(self.feed_entries))
+        self.assertEqual(self.feed.entries.count(), len(self.feed_entries))
+        self.assertEqual(
+            self.feed.entries.get(link=self.feed_entries[0]['link']).title,
+            self.feed_entries[0]['title']
+        )
+
+        feed = Feed.objects.get(pk=self.feed.pk)
+        self.assertEqual(feed.fetch_status, Feed.FETCH_STATUS_UPDATED)
+        self.assertEqual(feed.etag, '"abc123"')
+        self.assertEqual(feed.content_hash, '')
+
+    def test_stops_reading_after_known_entries(self):
+        self.feed.stream_feed_entries()
+
+        new_entries = make_feed_entries_list(
+            n_items=2,
+            feed_url=urljoin(self.feed.link, 'new/')
+        )
+        self.set_document(new_entries + self.feed_entries)
+        self.chunks_read = 0
+
+        res = self.feed.stream_feed_entries()
+        self.assertEqual(res, 2)
+        self.assertEqual(
+            self.feed.entries.count(),
+            len(self.feed_entries) + 2
+        )
+        self.assertLess(self.chunks_read, len(self.chunks) / 2)
+
+    def test_not_modified_feed_is_not_read(self):
+        self.set_document(self.feed_entries, status=304)
+        res = self.feed.stream_feed_entries()
+        self.assertEqual(res, 0)
+        self.assertEqual(self.chunks_read, 0)
+        self.assertEqual(
+            Feed.objects.get(pk=self.feed.pk).fetch_status,
+            Feed.FETCH_STATUS_NOT_MODIFIED
+        )
+
+    @patch('feeds.models.download_feed')
+    def test_large_documents_are_read_from_open_download(self, mock_download):
+        closed = []
+        mock_download.side_effect = FeedTooLargeError(
+            stream=self.mock_open.return_value.__enter__.return_value,
+            close=lambda: closed.append(True)
+        )
+        res = self.feed.update_feed_entries()
+        self.assertEqual(res, len(self.feed_entries))
+        self.assertEqual(mock_download.call_count, 1)
+        self.assertFalse(self.mock_open.called)
+        self.assertEqual(closed, [True])
+
+    @patch('feeds.models.download_feed')
+    def test_malformed_documents_are_parsed_whole(self, mock_download):
+        document = make_rss_document(self.feed_entries[:5], self.feed.link)
+        malformed = document.replace(b'<channel>', b'<channel><br>', 1)
+        self.mock_open.return_value.__enter__.return_value = FeedStream(
+            url=self.feed.link,
+            status=200,
+            chunks=iter([malformed]),
+            headers={}
+        )
+        mock_download.return_value = make_fake_feed_response(
+            self.feed.link,
+            content=document,
+            headers={'content-type': 'application/rss+xml'}
+        )
+        self.feed.etag = '"old"'
+        res = self.feed.stream_feed_entries()
+        self.assertEqual(res, 5)
+        self.assertEqual(self.feed.entries.count(), 5)
+        self.assertEqual(
+            Feed.objects.get(pk=self.feed.pk).fetch_status,
+            Feed.FETCH_STATUS_UPDATED
+        )
+        self.assertEqual(mock_download.call_args[1]['etag'], '"old"')
+        self.assertEqual(
+            mock_download.call_args[1]['max_size'],
+            settings.FEED_STREAM_MIN_SIZE
+        )
+
+    @patch('feeds.models.download_feed')
+    def test_large_malformed_documents_fail(self, mock_download):
+        closed = []
+        self.mock_open.return_value.__enter__.return_value = FeedStream(
+            url=self.feed.link,
+            status=200,
+            chunks=iter([b'<rss><channel><br>']),
+            headers={}
+        )
+        mock_download.side_effect = FeedTooLargeError(
+            close=lambda: closed.append(True)
+        )
+        with self.assertRaises(ValueError):
+            self.feed.stream_feed_entries()
+        self.assertEqual(closed, [True])
+        self.assertEqual(self.feed.entries.count(), 0)
+
+    @patch('feeds.models.download_feed')
+    def test_large_documents_are_streamed(self, mock_download):
+        mock_download.side_effect = FeedTooLargeError
+        res = self.feed.update_feed_entries()
+        self.assertEqual(res, len(self.feed_entries))
+        self.assertEqual(
+            mock_download.call_args[1]['max_size'],
+            settings.FEED_STREAM_MIN_SIZE
+        )
@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from django.test import TestCase
+
+from feeds.utils.pipeline import map_bounded
+
+
+def fail_on_odd(n):
+    if n % 2:
+        raise ValueError(n)
+    return n * 10
+
+
+class MapBoundedTest(TestCase):
+
+    def test_yields_results_by_key(self):
+        jobs = [(f'job-{n}', (n,)) for n in range(0, 10, 2)]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = dict(map_bounded(executor, fail_on_odd, jobs, 3))
+        self.assertEqual(
+            results,
+            {f'job-{n}': n * 10 for n in range(0, 10, 2)}
+        )
+
+    def test_errors_are_yielded_in_place_of_results(self):
+        jobs = [(n, (n,)) for n in range(4)]
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = dict(map_bounded(executor, fail_on_odd, jobs, 2))
+        self.assertEqual(results[2], 20)
+        self.assertIsInstance(results[3], ValueError)
+
+    def test_jobs_are_taken_in_as_results_are_consumed(self):
+        taken = []
+
+        def jobs():
+            for n in range(20):
+                taken.append(n)
+                yield n, (n * 2,)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            results = map_bounded(executor, fail_on_odd, jobs(), 4)
+            next(results)
+            self.assertEqual(len(taken), 4)
+            next(results)
+            self.assertLessEqual(len(taken), 5)
+            self.assertEqual(len(dict(results)), 18)
+
+    def test_unconsumed_results_are_discarded(self):
+        discarded = []
+        # The first four jobs only finish once they have all started
+        barrier = threading.Barrier(4)
+
+        def run_together(n):
+            barrier.wait()
+            return n
+
+        jobs = [(n, (n,)) for n in range(10)]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = map_bounded(
+                executor, run_together, jobs, 4, discard=discarded.append
+            )
+            consumed = next(results)[1]
+            results.close()
+
+        self.assertCountEqual(discarded, set(range(4)) - {consumed})
+
+    def test_empty_jobs(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            self.assertEqual(
+                list(map_bounded(executor, fail_on_odd, [], 4)),
+                []
+            )
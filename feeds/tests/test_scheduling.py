@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.test import TestCase, override_settings
+
+from feeds.utils.scheduling import (
+    compute_failure_backoff, compute_poll_delay, smooth_interval
+)
+
+
+@override_settings(FEED_POLL_SMOOTHING=0.25)
+class SmoothIntervalTest(TestCase):
+
+    def test_first_observation_is_used_as_is(self):
+        observed = timedelta(hours=2)
+        self.assertEqual(smooth_interval(None, observed), observed)
+
+    def test_observations_are_smoothed(self):
+        self.assertEqual(
+            smooth_interval(timedelta(hours=4), timedelta(hours=8)),
+            timedelta(hours=5)
+        )
+
+
+@override_settings(
+    FEED_POLL_MIN_INTERVAL=60 * 5,
+    FEED_POLL_MAX_INTERVAL=60 * 60 * 24,
+    FEED_POLL_BACKOFF=0.5
+)
+class ComputePollDelayTest(TestCase):
+
+    def test_unknown_interval_uses_minimum_delay(self):
+        self.assertEqual(compute_poll_delay(), timedelta(minutes=5))
+
+    def test_busy_feed_is_polled_at_publish_interval(self):
+        self.assertEqual(
+            compute_poll_delay(timedelta(minutes=30), timedelta(minutes=10)),
+            timedelta(minutes=30)
+        )
+
+    def test_idle_feed_is_backed_off(self):
+        self.assertEqual(
+            compute_poll_delay(timedelta(minutes=30), timedelta(hours=6)),
+            timedelta(hours=3)
+        )
+
+    def test_delay_is_within_bounds(self):
+        self.assertEqual(
+            compute_poll_delay(timedelta(seconds=10)),
+            timedelta(minutes=5)
+        )
+        self.assertEqual(
+            compute_poll_delay(timedelta(hours=1), timedelta(days=365)),
+            timedelta(days=1)
+        )
+
+
+@override_settings(
+    FEED_FAILURE_BACKOFF=60 * 5,
+    FEED_FAILURE_MAX_BACKOFF=60 * 60 * 24
+)
+class ComputeFailureBackoffTest(TestCase):
+
+    def test_backoff_doubles_with_each_failure(self):
+        self.assertEqual(compute_failure_backoff(1), timedelta(minutes=5))
+        self.assertEqual(compute_failure_backoff(2), timedelta(minutes=10))
+        self.assertEqual(compute_failure_backoff(4), timedelta(minutes=40))
+
+    def test_backoff_is_capped(self):
+        self.assertEqual(compute_failure_backoff(10), timedelta(days=1))
+        self.assertEqual(compute_failure_backoff(1000), timedelta(days=1))
@@ -1,11 +1,25 @@
+from datetime import timedelta
 import random
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
-from feeds.models import Feed
-from feeds.tasks import fetch_entries
-from feeds.tests.helpers import create_and_save_feeds
+from feeds.models import Entry, Feed
+from feeds.tasks import (
+    fetch_entries, fetch_feed_entries, purge_entries,
+    summarize_fetch_results, update_feeds
+)
+from feeds.tests.helpers import (
+    create_and_save_feeds, get_metric_value, make_fake_feed_response,
+    make_feed_entries_list, make_preprocessed_entries_list,
+    make_rss_document, run_in_daemonic_process
+)
+from feeds.utils.fetcher import FeedTooLargeError, hash_content
+from feeds.utils.leases import FETCH_ENTRIES_LEASE, feed_lease, Lease
+from feeds.utils.throttling import FetchThrottledError
 
 
 @patch('feeds.tasks.Feed.update_feed_entries')
@@ -17,27 +31,531 @@ class FetchEntriesTest(TestCase):
             random.randint(5, 20) for i in range(self.feeds.count())
         ]
 
+        # Patch the downloader so that no HTTP requests are made
+        patcher = patch(
+            'feeds.tasks.download_feeds',
+            side_effect=lambda urls, validators, **kwargs: [
+                (url, make_fake_feed_response(url)) for url in urls
+            ]
+        )
+        self.mock_download = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Patch the parser so that documents are not parsed in
+        # worker processes
+        patcher = patch(
+            'feeds.tasks.parse_feeds',
+            side_effect=lambda responses: [
+                (link, []) for link, response in responses
+            ]
+        )
+        self.mock_parse = patcher.start()
+        self.addCleanup(patcher.stop)
+
     def tearDown(self):
         Feed.objects.all().delete()
 
     def test_successful_fetch_process(self, mock_update):
         mock_update.side_effect = self.saved_entry_counts
         res = fetch_entries()
-        self.assertEqual(res, sum(self.saved_entry_counts))
+        self.assertEqual(res['entries_saved'], sum(self.saved_entry_counts))
+        self.assertEqual(res['feeds'], self.feeds.count())
         self.assertEqual(mock_update.call_count, self.feeds.count())
 
+    def test_downloads_use_saved_validators(self, mock_update):
+        mock_update.side_effect = self.saved_entry_counts
+        feed = self.feeds[0]
+        feed.etag = '"abc123"'
+        feed.save()
+
+        fetch_entries()
+        validators = self.mock_download.call_args[0][1]
+        self.assertEqual(validators[feed.link], ('"abc123"', ''))
+
+    def test_only_due_feeds_are_fetched(self, mock_update):
+        mock_update.side_effect = self.saved_entry_counts
+        later = timezone.now() + timedelta(hours=1)
+        Feed.objects.filter(
+            pk__in=[feed.pk for feed in self.feeds[:2]]
+        ).update(next_fetch_at=later)
+
+        res = fetch_entries()
+        self.assertEqual(res['feeds'], self.feeds.count() - 2)
+        self.assertEqual(mock_update.call_count, self.feeds.count() - 2)
+
     def test_when_no_feeds_are_found(self, mock_update):
         self.feeds.delete()
         res = fetch_entries()
         self.assertIsNone(res)
         self.assertFalse(mock_update.called)
 
+    def test_download_errors_skip_feed(self, mock_update):
+        failed_url = self.feeds[0].link
+        self.mock_download.side_effect = lambda urls, validators, **kwargs: [
+            (url, ValueError() if url == failed_url
+             else make_fake_feed_response(url))
+            for url in urls
+        ]
+        mock_update.side_effect = self.saved_entry_counts[1:]
+        res = fetch_entries()
+        self.assertEqual(res['entries_saved'], sum(self.saved_entry_counts[1:]))
+        self.assertEqual(res['errors'], 1)
+        self.assertEqual(mock_update.call_count, self.feeds.count() - 1)
+
+    @patch('feeds.tasks.Feed.stream_feed_entries')
+    def test_large_documents_are_streamed(self, mock_stream, mock_update):
+        large_url = self.feeds[0].link
+        self.mock_download.side_effect = lambda urls, validators, **kwargs: [
+            (url, FeedTooLargeError() if url == large_url
+             else make_fake_feed_response(url))
+            for url in urls
+        ]
+        mock_stream.return_value = 50
+        mock_update.return_value = 1
+        res = fetch_entries()
+        self.assertEqual(res['entries_saved'], 50 + self.feeds.count() - 1)
+        self.assertEqual(res['errors'], 0)
+        self.assertEqual(mock_stream.call_count, 1)
+        self.assertEqual(mock_update.call_count, self.feeds.count() - 1)
+        self.assertEqual(
+            self.mock_download.call_args[1]['max_size'],
+            settings.FEED_STREAM_MIN_SIZE
+        )
+
+    def test_throttled_feeds_are_skipped(self, mock_update):
+        throttled_url = self.feeds[0].link
+        self.mock_download.side_effect = lambda urls, validators, **kwargs: [
+            (url, FetchThrottledError() if url == throttled_url
+             else make_fake_feed_response(url))
+            for url in urls
+        ]
+        mock_update.side_effect = self.saved_entry_counts[1:]
+        res = fetch_entries()
+        self.assertEqual(res['throttled'], 1)
+        self.assertEqual(res['errors'], 0)
+        self.assertFalse(
+            Feed.objects.filter(consecutive_failures__gt=0).exists()
+        )
+        self.assertEqual(mock_update.call_count, self.feeds.count() - 1)
+
+    def test_parse_errors_skip_feed(self, mock_update):
+        failed_url = self.feeds[0].link
+        self.mock_parse.side_effect = lambda responses: [
+            (link, ValueError() if link == failed_url else [])
+            for link, response in responses
+        ]
+        mock_update.side_effect = self.saved_entry_counts[1:]
+        res = fetch_entries()
+        self.assertEqual(res['errors'], 1)
+        self.assertEqual(mock_update.call_count, self.feeds.count() - 1)
+
+    def test_only_changed_documents_are_parsed(self, mock_update):
+        mock_update.side_effect = self.saved_entry_counts
+        unchanged_feed = self.feeds[0]
+        unchanged_feed.content_hash = hash_content(b'')
+        unchanged_feed.save()
+
+        parsed_links = []
+
+        def fake_parse(responses):
+            for link, response in responses:
+                parsed_links.append(link)
+                yield link, []
+
+        self.mock_parse.side_effect = fake_parse
+        fetch_entries()
+        self.assertEqual(len(parsed_links), self.feeds.count() - 1)
+        self.assertNotIn(unchanged_feed.link, parsed_links)
+
+    def test_parsed_items_are_saved(self, mock_update):
+        mock_update.side_effect = self.saved_entry_counts
+        items = make_preprocessed_entries_list(n_items=3)
+        self.mock_parse.side_effect = lambda responses: [
+            (link, items) for link, response in responses
+        ]
+        fetch_entries()
+        for call in mock_update.call_args_list:
+            self.assertIs(call[1]['items'], items)
+
     def test_errors_during_processing(self, mock_update):
         self.saved_entry_counts[1] = Exception
         mock_update.side_effect = self.saved_entry_counts
         res = fetch_entries()
         self.assertEqual(
-            res,
+            res['entries_saved'],
             sum(filter(lambda x: x != Exception, self.saved_entry_counts))
         )
+        self.assertEqual(res['errors'], 1)
         self.assertEqual(mock_update.call_count, self.feeds.count())
+
+    def test_skips_run_while_another_is_in_progress(self, mock_update):
+        with Lease(FETCH_ENTRIES_LEASE):
+            res = fetch_entries()
+        self.assertIsNone(res)
+        self.assertFalse(self.mock_download.called)
+
+        # The lease is released after each run
+        mock_update.return_value = 1
+        for i in range(2):
+            self.assertEqual(fetch_entries()['feeds'], self.feeds.count())
+
+    def test_feeds_leased_by_another_worker_are_skipped(self, mock_update):
+        mock_update.side_effect = self.saved_entry_counts
+        downloaded_urls = []
+
+        def download(urls, validators, **kwargs):
+            for url in urls:
+                downloaded_urls.append(url)
+                yield url, make_fake_feed_response(url)
+
+        self.mock_download.side_effect = download
+        leased_feed = self.feeds[0]
+        with feed_lease(leased_feed.pk):
+            res = fetch_entries()
+        self.assertEqual(res['feeds'], self.feeds.count())
+        self.assertEqual(res['locked'], 1)
+        self.assertEqual(mock_update.call_count, self.feeds.count() - 1)
+        self.assertEqual(len(downloaded_urls), self.feeds.count() - 1)
+        self.assertNotIn(leased_feed.link, downloaded_urls)
+
+    def test_feeds_updated_meanwhile_are_skipped(self, mock_update):
+        mock_update.side_effect = self.saved_entry_counts
+        updated_feed = self.feeds[0]
+        acquire = Lease.acquire
+
+        def acquire_after_update(lease):
+            # Another worker updates the feed before its lease is taken
+            if lease.name == f'feed:{updated_feed.pk}':
+                Feed.objects.filter(pk=updated_feed.pk).update(
+                    next_fetch_at=timezone.now() + timedelta(hours=1)
+                )
+            return acquire(lease)
+
+        with patch.object(Lease, 'acquire', acquire_after_update):
+            res = fetch_entries()
+        self.assertEqual(res['locked'], 1)
+        self.assertEqual(mock_update.call_count, self.feeds.count() - 1)
+
+    def test_leases_are_released_as_feeds_are_updated(self, mock_update):
+        free_lease_counts = []
+
+        def count_free_leases(**kwargs):
+            free_leases = [feed_lease(feed.pk) for feed in self.feeds]
+            free_lease_counts.append(sum(
+                lease.acquire() for lease in free_leases
+            ))
+            for lease in free_leases:
+                lease.release()
+            return 0
+
+        mock_update.side_effect = count_free_leases
+        fetch_entries()
+        # Only the feed being updated, and those yet to be, are leased
+        self.assertEqual(free_lease_counts, list(range(self.feeds.count())))
+
+    def test_errors_are_recorded_on_feed(self, mock_update):
+        self.saved_entry_counts[1] = ValueError('Invalid feed')
+        mock_update.side_effect = self.saved_entry_counts
+        fetch_entries()
+        failed_feeds = Feed.objects.filter(consecutive_failures=1)
+        self.assertEqual(
+            list(failed_feeds.values_list('last_error', flat=True)),
+            ['ValueError: Invalid feed']
+        )
+
+
+class UpdateFeedsInCeleryWorkerTest(TransactionTestCase):
+    """Tests updating feeds from a daemonic process.
+
+    Celery's prefork pool runs tasks in daemonic processes, which may 
+    not start the processes that parse feeds elsewhere. Data must be 
+    committed for the child process to see it.
+    """
+
+    def setUp(self):
+        self.feeds = create_and_save_feeds(2)
+        patcher = patch(
+            'feeds.tasks.download_feeds',
+            side_effect=lambda urls, validators, **kwargs: [
+                (url, make_fake_feed_response(
+                    url,
+                    content=make_rss_document(
+                        make_feed_entries_list(5, feed_url=url),
+                        feed_url=url
+                    ),
+                    headers={'content-type': 'application/rss+xml'}
+                ))
+                for url in urls
+            ]
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_feeds_are_parsed_and_saved(self):
+        results = run_in_daemonic_process(update_feeds, self.feeds)
+        self.assertIsInstance(results, list)
+        self.assertEqual(
+            [result['status'] for result in results],
+            [Feed.FETCH_STATUS_UPDATED] * 2
+        )
+        self.assertEqual(Entry.objects.count(), 10)
+
+
+@patch('feeds.tasks.chord')
+class FetchEntriesFanOutTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.feeds = create_and_save_feeds(5)
+
+    def test_dispatches_one_subtask_per_feed(self, mock_chord):
+        mock_chord.return_value.return_value.id = 'chord-id'
+        res = fetch_entries(fan_out=True)
+        self.assertEqual(res, 'chord-id')
+
+        header = list(mock_chord.call_args[0][0])
+        self.assertEqual(len(header), self.feeds.count())
+        self.assertCountEqual(
+            [sig.args[0] for sig in header],
+            self.feeds.values_list('id', flat=True)
+        )
+        callback = mock_chord.return_value.call_args[0][0]
+        self.assertEqual(callback.task, 'summarize-fetch-results')
+
+    def test_run_lease_is_held_until_results_are_summarized(self, mock_chord):
+        mock_chord.return_value.return_value.id = 'chord-id'
+        fetch_entries(fan_out=True)
+        self.assertIsNone(fetch_entries(fan_out=True))
+        self.assertEqual(mock_chord.call_count, 1)
+
+        callback = mock_chord.return_value.call_args[0][0]
+        self.assertEqual(
+            [errback.task for errback in callback.options['link_error']],
+            ['release-fetch-lease']
+        )
+        summarize_fetch_results([], **callback.kwargs)
+        self.assertEqual(fetch_entries(fan_out=True), 'chord-id')
+        self.assertEqual(mock_chord.call_count, 2)
+
+    def test_run_lease_is_released_when_chord_fails(self, mock_chord):
+        mock_chord.return_value.return_value.id = 'chord-id'
+        fetch_entries(fan_out=True)
+        callback = mock_chord.return_value.call_args[0][0]
+        callback.options['link_error'][0].apply()
+        self.assertEqual(fetch_entries(fan_out=True), 'chord-id')
+
+    def test_does_not_dispatch_without_feeds(self, mock_chord):
+        self.feeds.delete()
+        res = fetch_entries(fan_out=True)
+        self.assertIsNone(res)
+        self.assertFalse(mock_chord.called)
+
+
+@patch('feeds.tasks.Feed.update_feed_entries')
+class FetchFeedEntriesTest(TestCase):
+
+    def setUp(self):
+        self.feed = create_and_save_feeds(1).first()
+
+    def test_returns_saved_entries_count(self, mock_update):
+        mock_update.return_value = 7
+        res = fetch_feed_entries(self.feed.pk)
+        self.assertEqual(res['feed_id'], self.feed.pk)
+        self.assertEqual(res['entries_saved'], 7)
+
+    def test_due_feed_is_read_with_one_query(self, mock_update):
+        mock_update.return_value = 7
+        with self.assertNumQueries(1):
+            fetch_feed_entries(self.feed.pk)
+
+    def test_result_records_fetch_status(self, mock_update):
+        def not_modified(feed, response=None, items=None):
+            feed.fetch_status = Feed.FETCH_STATUS_NOT_MODIFIED
+            return 0
+
+        with patch.object(Feed, 'update_feed_entries', not_modified):
+            res = fetch_feed_entries(self.feed.pk)
+        self.assertEqual(res['entries_saved'], 0)
+        self.assertEqual(res['status'], Feed.FETCH_STATUS_NOT_MODIFIED)
+
+    def test_outcomes_are_counted(self, mock_update):
+        def not_modified(feed, response=None, items=None):
+            feed.fetch_status = Feed.FETCH_STATUS_NOT_MODIFIED
+            return 0
+
+        not_modified_count = get_metric_value(
+            'rss_apifier_feed_updates_total',
+            status=Feed.FETCH_STATUS_NOT_MODIFIED
+        )
+        errors = get_metric_value(
+            'rss_apifier_feed_updates_total',
+            status='error'
+        )
+        with patch.object(Feed, 'update_feed_entries', not_modified):
+            fetch_feed_entries(self.feed.pk)
+        mock_update.side_effect = ValueError
+        fetch_feed_entries(self.feed.pk)
+
+        self.assertEqual(
+            get_metric_value(
+                'rss_apifier_feed_updates_total',
+                status=Feed.FETCH_STATUS_NOT_MODIFIED
+            ),
+            not_modified_count + 1
+        )
+        self.assertEqual(
+            get_metric_value('rss_apifier_feed_updates_total', status='error'),
+            errors + 1
+        )
+
+    def test_errors_return_zero(self, mock_update):
+        mock_update.side_effect = ValueError
+        res = fetch_feed_entries(self.feed.pk)
+        self.assertEqual(res['entries_saved'], 0)
+        self.assertEqual(res['status'], 'error')
+
+    def test_feed_leased_by_another_worker_is_skipped(self, mock_update):
+        with feed_lease(self.feed.pk):
+            res = fetch_feed_entries(self.feed.pk)
+        self.assertEqual(res['status'], 'locked')
+        self.assertFalse(mock_update.called)
+
+        mock_update.return_value = 7
+        res = fetch_feed_entries(self.feed.pk)
+        self.assertEqual(res['entries_saved'], 7)
+
+    def test_feed_no_longer_due_is_skipped(self, mock_update):
+        self.feed.next_fetch_at = timezone.now() + timedelta(hours=1)
+        self.feed.save()
+        res = fetch_feed_entries(self.feed.pk)
+        self.assertEqual(res['status'], 'locked')
+        self.assertFalse(mock_update.called)
+
+    def test_nonexistent_feed_returns_zero(self, mock_update):
+        res = fetch_feed_entries(self.feed.pk + 100)
+        self.assertEqual(res['entries_saved'], 0)
+        self.assertFalse(mock_update.called)
+
+
+@patch('feeds.utils.fetcher.get_session')
+class ThrottledFetchTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.feed = create_and_save_feeds(1).first()
+
+    def test_too_many_requests_is_not_a_failure(self, mock_session):
+        http_response = MagicMock()
+        http_response.__enter__.return_value = http_response
+        http_response.url = self.feed.link
+        http_response.status_code = 429
+        http_response.headers = {'Retry-After': '120'}
+        mock_session.return_value.get.return_value = http_response
+
+        res = fetch_feed_entries(self.feed.pk)
+        self.assertEqual(res['status'], 'throttled')
+        feed = Feed.objects.get(pk=self.feed.pk)
+        self.assertEqual(feed.consecutive_failures, 0)
+        self.assertIsNone(feed.disabled_until)
+
+
+class SummarizeFetchResultsTest(TestCase):
+
+    def test_adds_up_subtask_results(self):
+        results = [
+            {'feed_id': 1, 'entries_saved': 3, 'status': 'updated'},
+            {'feed_id': 2, 'entries_saved': 0, 'status': 'not_modified'},
+            {'feed_id': 3, 'entries_saved': 12, 'status': 'updated'},
+            {'feed_id': 4, 'entries_saved': 0, 'status': 'unchanged'},
+            {'feed_id': 5, 'entries_saved': 0, 'status': 'unchanged'},
+            {'feed_id': 6, 'entries_saved': 0, 'status': 'error'},
+            {'feed_id': 7, 'entries_saved': 0, 'status': 'throttled'},
+            {'feed_id': 8, 'entries_saved': 0, 'status': 'locked'},
+        ]
+        self.assertEqual(
+            summarize_fetch_results(results),
+            {
+                'feeds': 8,
+                'entries_saved': 15,
+                'not_modified': 1,
+                'unchanged': 2,
+                'throttled': 1,
+                'locked': 1,
+                'errors': 1,
+            }
+        )
+
+
+@override_settings(ENTRY_PURGE_BATCH_SIZE=4)
+class PurgeEntriesTest(TestCase):
+
+    def setUp(self):
+        self.feeds = list(create_and_save_feeds(2))
+        self.links = {}
+        now = timezone.now() + timedelta(hours=1)
+        for feed in self.feeds:
+            items = make_preprocessed_entries_list(10, feed.link)
+            for i, item in enumerate(items):
+                item['published'] = now - timedelta(days=i)
+            feed.save_new_entries(items)
+            self.links[feed.pk] = [item['link'] for item in items]
+
+    @override_settings(ENTRY_MAX_AGE_DAYS=0, ENTRY_MAX_PER_FEED=0)
+    def test_keeps_entries_without_limits(self):
+        self.assertEqual(purge_entries(), {'expired': 0, 'trimmed': 0})
+        self.assertEqual(Entry.objects.count(), 20)
+
+    @override_settings(ENTRY_MAX_AGE_DAYS=3)
+    def test_deletes_expired_entries(self):
+        summary = purge_entries()
+        self.assertEqual(summary['expired'], 12)
+        self.assertEqual(Entry.objects.count(), 8)
+        self.assertFalse(Entry.objects.filter(
+            published__lt=timezone.now() - timedelta(days=3)
+        ).exists())
+        for feed in self.feeds:
+            self.assertEqual(feed.entries.count(), 4)
+
+        # Links to deleted entries are deleted as well
+        self.assertEqual(Entry.feeds.through.objects.count(), 8)
+
+    @override_settings(ENTRY_MAX_AGE_DAYS=3)
+    def test_expired_entries_are_not_saved_again(self):
+        purge_entries()
+        feed = self.feeds[0]
+        items = make_preprocessed_entries_list(10, f'{feed.link}new/')
+        now = timezone.now() + timedelta(hours=1)
+        for i, item in enumerate(items):
+            item['published'] = now - timedelta(days=i)
+        self.assertEqual(feed.ingest_entries(items, preprocessed=True), 4)
+        self.assertEqual(feed.entries.count(), 8)
+        self.assertEqual(purge_entries()['expired'], 0)
+
+    @override_settings(ENTRY_MAX_PER_FEED=3)
+    def test_trims_feeds_to_newest_entries(self):
+        summary = purge_entries()
+        self.assertEqual(summary['trimmed'], 14)
+        self.assertEqual(Entry.objects.count(), 6)
+        for feed in self.feeds:
+            self.assertEqual(
+                list(feed.entries.values_list('link', flat=True)),
+                self.links[feed.pk][:3]
+            )
+
+    @override_settings(ENTRY_MAX_PER_FEED=3)
+    def test_keeps_entries_still_in_other_feeds(self):
+        shared_entries = self.feeds[0].entries.all()
+        self.feeds[1].entries.add(*shared_entries)
+
+        purge_entries()
+        self.assertEqual(self.feeds[0].entries.count(), 3)
+        self.assertEqual(self.feeds[1].entries.count(), 3)
+
+        # Entries still linked to a feed are kept
+        self.assertFalse(Entry.objects.filter(feeds__isnull=True).exists())
+
+    @override_settings(ENTRY_MAX_AGE_DAYS=3)
+    @patch('feeds.models.transaction.on_commit')
+    def test_purging_invalidates_cached_pages(self, mock_on_commit):
+        purge_entries()
+        self.assertTrue(mock_on_commit.called)
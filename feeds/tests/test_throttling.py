@@ -0,0 +1,115 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from feeds.utils.throttling import (
+    block_host, download_slot, FetchThrottledError, parse_retry_after,
+    reserve_host_slot
+)
+
+
+@override_settings(FEED_HOST_RATE=2, FEED_HOST_BURST=3, FEED_HOST_MAX_WAIT=2)
+class ReserveHostSlotTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.host = 'www.samplefeeds.com'
+        self.now = 1575540000.0
+
+    def test_idle_host_serves_a_burst(self):
+        delays = [reserve_host_slot(self.host, self.now) for i in range(3)]
+        self.assertEqual(delays, [0, 0, 0])
+
+    def test_busy_host_is_served_at_its_rate(self):
+        for i in range(3):
+            reserve_host_slot(self.host, self.now)
+        delays = [reserve_host_slot(self.host, self.now) for i in range(3)]
+        self.assertEqual(delays, [0.5, 1, 1.5])
+
+    def test_slots_are_freed_as_time_goes_by(self):
+        for i in range(3):
+            reserve_host_slot(self.host, self.now)
+        self.assertEqual(reserve_host_slot(self.host, self.now + 10), 0)
+
+    def test_hosts_have_separate_buckets(self):
+        for i in range(3):
+            reserve_host_slot(self.host, self.now)
+        self.assertEqual(
+            reserve_host_slot('www.otherfeeds.com', self.now),
+            0
+        )
+
+    def test_no_slot_within_max_wait(self):
+        with self.assertRaises(FetchThrottledError):
+            for i in range(10):
+                reserve_host_slot(self.host, self.now)
+
+    def test_blocked_host(self):
+        block_host(self.host, '60', now=self.now)
+        with self.assertRaises(FetchThrottledError):
+            reserve_host_slot(self.host, self.now + 30)
+        self.assertEqual(reserve_host_slot(self.host, self.now + 61), 0)
+
+
+class DownloadSlotTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(FEED_FETCH_MAX_CONCURRENCY=2, FEED_HOST_MAX_WAIT=0)
+    @patch('feeds.utils.throttling.time.sleep')
+    def test_concurrent_downloads_are_capped(self, mock_sleep):
+        with download_slot(), download_slot():
+            with self.assertRaises(FetchThrottledError):
+                with download_slot():
+                    pass
+
+        # Slots are freed once downloads are done
+        with download_slot(), download_slot():
+            pass
+
+
+class BlockHostTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.now = 1575540000.0
+
+    @override_settings(FEED_HOST_RETRY_AFTER=300)
+    def test_default_delay(self):
+        self.assertEqual(
+            block_host('www.samplefeeds.com', now=self.now),
+            self.now + 300
+        )
+
+    @override_settings(FEED_POLL_MAX_INTERVAL=3600)
+    def test_delay_is_capped(self):
+        self.assertEqual(
+            block_host('www.samplefeeds.com', '86400', now=self.now),
+            self.now + 3600
+        )
+
+
+class ParseRetryAfterTest(TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after('120'), 120)
+
+    def test_http_date(self):
+        now = datetime(2019, 12, 5, 10, tzinfo=timezone.utc)
+        retry_at = datetime(2019, 12, 5, 10, 2, tzinfo=timezone.utc)
+        self.assertEqual(
+            parse_retry_after(
+                format_datetime(retry_at, usegmt=True),
+                now.timestamp()
+            ),
+            120
+        )
+
+    def test_missing_or_invalid_values(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after(''))
+        self.assertIsNone(parse_retry_after('soon'))
@@ -0,0 +1,131 @@
+"""
+Module for caching serialized pages of entries
+
+Cached pages are keyed by the URL they were requested with and by a
+"generation" counter: a global one for the list of all entries, and
+one per feed for the entries of each feed. Saving new entries bumps
+the counters (see `bump_generations`), so pages cached before then
+are never served again and simply expire from the cache. The same
+counters let API clients revalidate pages they already have (see
+`make_etag` and `get_last_modified`).
+
+Functions:
+    get_generation(feed_id=None)
+    get_last_modified(feed_id=None)
+    bump_generations(feed_ids)
+    make_page_key(url, feed_id=None)
+    make_etag(url, feed_id=None)
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+
+KEY_PREFIX = 'entries'
+
+
+def _generation_key(feed_id=None):
+    if feed_id is None:
+        return f'{KEY_PREFIX}:generation'
+    return f'{KEY_PREFIX}:generation:feed:{feed_id}'
+
+
+def _last_modified_key(feed_id=None):
+    return _generation_key(feed_id).replace(':generation', ':modified', 1)
+
+
+def _new_generation():
+    # Counters start from the current time in milliseconds, so that
+    # a counter evicted from the cache never restarts below a value
+    # that may still be part of a cached page's key
+    return int(time.time() * 1000)
+
+
+def get_generation(feed_id=None):
+    """Returns the current generation of a list of entries.
+
+    Args:
+        feed_id (int): ID of the feed whose entries are listed, or
+            None for the list of all entries
+
+    Returns:
+        int: the generation counter
+    """
+    key = _generation_key(feed_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _new_generation(), None)
+        generation = cache.get(key)
+    return generation
+
+
+def get_last_modified(feed_id=None):
+    """Returns when a list of entries last changed, if known.
+
+    Args:
+        feed_id (int): ID of the feed whose entries are listed, or
+            None for the list of all entries
+
+    Returns:
+        int: POSIX timestamp of the last bump of the generation, or
+            None if it has not been bumped since the cache was cleared
+    """
+    return cache.get(_last_modified_key(feed_id))
+
+
+def bump_generations(feed_ids):
+    """Invalidates the cached pages affected by newly saved entries.
+
+    Args:
+        feed_ids (iterable): IDs of the feeds that have new entries;
+            the generation of the list of all entries is always bumped
+    """
+    feed_ids = [None, *feed_ids]
+    for feed_id in feed_ids:
+        try:
+            cache.incr(_generation_key(feed_id))
+        except ValueError:
+            cache.set(_generation_key(feed_id), _new_generation(), None)
+
+    now = int(time.time())
+    cache.set_many(
+        {_last_modified_key(feed_id): now for feed_id in feed_ids},
+        None
+    )
+
+
+def make_page_key(url, feed_id=None):
+    """Returns the cache key of a page of entries.
+
+    Args:
+        url (str): absolute URL of the request, including
+            its query string
+        feed_id (int): ID of the feed whose entries are listed, or
+            None for the list of all entries
+
+    Returns:
+        str: key under which the serialized page is cached
+    """
+    scope = 'all' if feed_id is None else f'feed:{feed_id}'
+    digest = hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+    return f'{KEY_PREFIX}:page:{scope}:{get_generation(feed_id)}:{digest}'
+
+
+def make_etag(url, feed_id=None):
+    """Returns the entity tag of a page of entries.
+
+    The tag changes whenever the page's cache key does, i.e., when 
+    the page is requested with other parameters or new entries 
+    are saved.
+
+    Args:
+        url (str): absolute URL of the request, including
+            its query string
+        feed_id (int): ID of the feed whose entries are listed, or
+            None for the list of all entries
+
+    Returns:
+        str: quoted entity tag, as used in the ETag header
+    """
+    page_key = make_page_key(url, feed_id).encode()
+    return '"%s"' % hashlib.blake2b(page_key, digest_size=16).hexdigest()
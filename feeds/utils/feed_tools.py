@@ -1,9 +1,76 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+import html
+from html.entities import html5 as HTML5_ENTITIES
+import logging
+import re
+import multiprocessing
+from urllib.parse import urljoin
+from xml.etree import ElementTree
+
 from dateutil import parser
+from defusedxml.common import DefusedXmlException
+from defusedxml.ElementTree import DefusedXMLParser
+from django.conf import settings
 from django.utils import timezone
-from django.utils.html import strip_tags
+from django.utils.dateparse import parse_datetime
 import feedparser
 import pytz
 
+from feeds.utils import metrics
+from feeds.utils.fetcher import download_feed
+from feeds.utils.pipeline import map_bounded
+
+# Response headers passed on to feedparser; the body has already been
+# decompressed, so Content-Encoding in particular must not be passed on
+PARSER_RESPONSE_HEADERS = [
+    'content-language',
+    'content-location',
+    'content-type',
+]
+
+# HTML comments, and tags (a `<` followed by a tag name, `/`, `!`, or
+# `?`, up to the first `>` outside quoted attribute values), the same
+# markup that `django.utils.html.strip_tags` removes
+HTML_MARKUP_RE = re.compile(
+    r'<!--.*?-->'
+    r'|<[a-zA-Z/!?](?:[^>"\']|"[^"]*"|\'[^\']*\')*>',
+    re.DOTALL
+)
+
+# Elements dropped along with their content by feedparser's sanitizer,
+# up to their end tag (or the end of the text if there is none)
+UNSAFE_HTML_ELEMENT_RE = re.compile(
+    r'<(script|style|applet)\b.*?(?:</\1\s*>|$)',
+    re.DOTALL | re.IGNORECASE
+)
+
+# Named character references, e.g., `&nbsp;`; those defined by HTML but
+# not by XML are not allowed in XML documents, but many feeds use them
+CHAR_REFERENCE_RE = re.compile(rb'&([A-Za-z][A-Za-z0-9]{1,31});')
+XML_ENTITY_NAMES = {b'amp', b'apos', b'gt', b'lt', b'quot'}
+
+# Longest named character reference, which may be split across chunks
+CHAR_REFERENCE_MAX_SIZE = 34
+
+# Start of an RFC 822 date, e.g., `Thu, 05 Dec 2019 10:00`
+RFC822_DATE_RE = re.compile(
+    r'\s*(?:[A-Za-z]{3},\s*)?\d{1,2}\s+[A-Za-z]{3}\s+\d{2,4}\s+\d{1,2}:\d{2}'
+)
+
+# Root elements of RSS 0.9x and 2.0, RSS 1.0 (RDF), and Atom documents,
+# and elements holding the entries of a feed
+FEED_ROOT_TAGS = {'rss', 'RDF', 'feed'}
+FEED_ENTRY_TAGS = {'item', 'entry'}
+
+# Elements of an entry holding each field, in order of preference
+FEED_ENTRY_FIELD_TAGS = {
+    'published': ['pubDate', 'published', 'date', 'issued', 'updated'],
+    'summary': ['description', 'summary', 'content', 'encoded'],
+    'title': ['title'],
+}
+
 # Required entry item fields
 ENTRY_ITEM_FIELDS = [
     'link',
@@ -23,51 +90,421 @@ def fetch_feedparser_dict(feed_url):
     Raises:
         ValueError: if the URL points to an unrecognized or invalid 
             RSS or Atom format
+        requests.RequestException: if the feed cannot be downloaded
     """
-    feed = feedparser.parse(feed_url)
+    return parse_feed_response(download_feed(feed_url))
+
+
+def parse_feed_response(response):
+    """Parses a downloaded feed document with feedparser.
+
+    Args:
+        response (FeedResponse): the downloaded feed
+
+    Returns:
+        feedparser.FeedParserDict object
+
+    Raises:
+        ValueError: if the document is in an unrecognized or invalid 
+            RSS or Atom format
+    """
+    headers = {k.lower(): v for k, v in response.headers.items()}
+    response_headers = {
+        k: headers[k] for k in PARSER_RESPONSE_HEADERS if k in headers
+    }
+    response_headers.setdefault('content-location', response.url)
+
+    with metrics.FEED_PARSE_SECONDS.time():
+        feed = feedparser.parse(
+            replace_html_entities(response.content),
+            response_headers=response_headers
+        )
     if (not feed or not feed.get('version') or 
             feed.get('bozo') or 'feed' not in feed):
+        metrics.PARSE_FAILURES.labels(kind='document').inc()
         raise ValueError('Invalid or unrecognized feed format')
     return feed
 
 
-def preprocess_feed_entry_item(entry_item):
+def parse_feed_items(response):
+    """Parses a downloaded feed document and processes its entries.
+
+    This is the CPU-bound part of updating a feed, which `parse_feeds` 
+    runs in worker processes. Entries that cannot be processed 
+    are skipped.
+
+    Args:
+        response (FeedResponse): the downloaded feed
+
+    Returns:
+        list: processed entries (see `preprocess_feed_entry_item`) 
+            in the order they appear in the feed
+
+    Raises:
+        ValueError: if the document is in an unrecognized or invalid 
+            RSS or Atom format
+    """
+    items = []
+    invalid_dates = []
+    for entry in parse_feed_response(response).entries:
+        try:
+            items.append(preprocess_feed_entry_item(entry, invalid_dates))
+        except Exception as e:
+            continue
+    log_invalid_dates(response.url, invalid_dates)
+    return items
+
+
+def parse_feeds(responses, max_workers=None, max_pending=None):
+    """Parses several downloaded feeds at once using a process pool.
+
+    Parsing documents and cleaning their entries is pure-Python work 
+    that threads could not run in parallel, so each document is 
+    parsed in a worker process (see `parse_feed_items`). Documents 
+    are taken from `responses` as earlier ones are consumed, so that 
+    no more than `max_pending` of them are being parsed or waiting 
+    in memory at any time.
+
+    Worker processes are started by a fork server (or spawned, where 
+    there is none) rather than forked from the current process: the 
+    download and lease renewal threads running here may hold locks, 
+    e.g., that of the metrics files, which a forked child would 
+    inherit held forever.
+
+    Daemonic processes may not start processes of their own, so 
+    documents are instead parsed one after the other in the current 
+    process when it is daemonic, e.g., a child of Celery's prefork 
+    pool (which runs workers as daemonic billiard processes).
+
+    Args:
+        responses (iterable): (key, FeedResponse) tuples, e.g., as 
+            yielded by `download_feeds`
+        max_workers (int): number of worker processes (defaults to 
+            `settings.FEED_PARSE_MAX_WORKERS`)
+        max_pending (int): maximum number of documents taken in but 
+            not yet consumed (defaults to `max_workers` plus 
+            `settings.FEED_PIPELINE_QUEUE_SIZE`)
+
+    Yields:
+        tuple: (key, list of processed entries) for each document in 
+            the order parsing finishes; if parsing fails, the raised 
+            exception takes the place of the list
+    """
+    if multiprocessing.current_process().daemon:
+        for key, response in responses:
+            try:
+                items = parse_feed_items(response)
+            except Exception as e:
+                items = e
+            yield key, items
+        return
+
+    max_workers = max_workers or settings.FEED_PARSE_MAX_WORKERS
+    max_pending = max_pending or (
+        max_workers + settings.FEED_PIPELINE_QUEUE_SIZE
+    )
+    jobs = ((key, (response,)) for key, response in responses)
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=get_parse_context()) as executor:
+        yield from map_bounded(executor, parse_feed_items, jobs, max_pending)
+
+
+def get_parse_context():
+    """Returns the multiprocessing context of the parsing processes.
+
+    The fork server, if any, imports this module once when it starts, 
+    so that each parsing process does not import it again.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def iter_feed_entries(chunks, base_url=''):
+    """Parses a feed document a chunk at a time, yielding its entries.
+
+    Unlike feedparser, which needs the whole document, this parser 
+    only keeps the entry being read in memory, so that the caller 
+    can stop reading (and downloading) a large document as soon as 
+    it has the entries it needs. Only RSS and Atom documents that are 
+    well-formed XML are supported. As the documents are untrusted, 
+    entity declarations and external references are refused (see 
+    `defusedxml`).
+
+    Args:
+        chunks (iterable): chunks of the raw document (bytes)
+        base_url (str): URL against which relative links are resolved
+
+    Yields:
+        dict: link, published, summary, and title of each entry, 
+            as far as the entry has them (see 
+            `preprocess_feed_entry_item`)
+
+    Raises:
+        ValueError: if the document is not well-formed XML, declares 
+            entities, or is not an RSS or Atom document
+    """
+    parser = ElementTree.XMLPullParser(
+        events=('start', 'end'),
+        _parser=DefusedXMLParser(target=ElementTree.TreeBuilder())
+    )
+    parents = []
+    try:
+        for chunk in iter_replaced_html_entities(chunks):
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                name = get_local_name(element.tag)
+                if event == 'start':
+                    if not parents and name not in FEED_ROOT_TAGS:
+                        metrics.PARSE_FAILURES.labels(kind='document').inc()
+                        raise ValueError(
+                            'Invalid or unrecognized feed format'
+                        )
+                    parents.append(element)
+                    continue
+
+                parents.pop()
+                if name in FEED_ENTRY_TAGS and parents:
+                    yield read_feed_entry(element, base_url)
+                    # Drop entries once read so that the document
+                    # is never held in memory whole
+                    parents[-1].remove(element)
+        parser.close()
+    # The pure-Python parser that defusedxml extends raises its own
+    # copy of ParseError, which is a SyntaxError like the original
+    except (SyntaxError, DefusedXmlException) as e:
+        metrics.PARSE_FAILURES.labels(kind='document').inc()
+        raise ValueError(f'Invalid feed document: {e}') from e
+
+
+def replace_numeric_reference(match):
+    """Returns the numeric form of a matched HTML reference."""
+    name = match.group(1)
+    if name in XML_ENTITY_NAMES:
+        return match.group(0)
+    text = HTML5_ENTITIES.get(name.decode() + ';')
+    if text is None:
+        return match.group(0)
+    return ''.join(f'&#{ord(char)};' for char in text).encode()
+
+
+def replace_html_entities(content):
+    """Replaces HTML named character references with numeric ones.
+
+    XML parsers reject references to entities that XML does not 
+    define, such as `&nbsp;` or `&mdash;`, which feeds often use 
+    anyway. Numeric references (e.g., `&#160;`) are the same 
+    characters in any ASCII-compatible encoding.
+
+    Args:
+        content (bytes): raw feed document, or part of one
+
+    Returns:
+        bytes: the content with HTML references replaced
+    """
+    return CHAR_REFERENCE_RE.sub(replace_numeric_reference, content)
+
+
+def iter_replaced_html_entities(chunks):
+    """Replaces HTML named character references in chunks of bytes.
+
+    See `replace_html_entities`. The end of a chunk that may be the 
+    start of a reference is held back until the next chunk is read.
+    """
+    rest = b''
+    for chunk in chunks:
+        data = rest + chunk
+        start = data.rfind(b'&', -CHAR_REFERENCE_MAX_SIZE)
+        if start != -1 and b';' not in data[start:]:
+            data, rest = data[:start], data[start:]
+        else:
+            rest = b''
+        if data:
+            yield replace_html_entities(data)
+    if rest:
+        yield replace_html_entities(rest)
+
+
+def read_feed_entry(element, base_url=''):
+    """Reads the fields of an entry parsed by `iter_feed_entries`.
+
+    Args:
+        element (xml.etree.ElementTree.Element): the entry element
+        base_url (str): URL against which relative links are resolved
+
+    Returns:
+        dict: the fields found in the entry
+    """
+    children = {}
+    links = []
+    permalinks = []
+    for child in element:
+        name = get_local_name(child.tag)
+        children.setdefault(name, child)
+        if name == 'link' and child.get('rel', 'alternate') == 'alternate':
+            links.append(child.get('href') or child.text or '')
+        elif name == 'guid' and child.get('isPermaLink') != 'false':
+            permalinks.append(child.text or '')
+
+    # As with feedparser, a permalink GUID is used for entries
+    # without a link
+    entry = {}
+    links = [link.strip() for link in links + permalinks if link.strip()]
+    if links:
+        entry['link'] = urljoin(base_url, links[0])
+
+    for field, names in FEED_ENTRY_FIELD_TAGS.items():
+        for name in names:
+            if name in children:
+                entry[field] = ''.join(children[name].itertext()).strip()
+                break
+    return entry
+
+
+def get_local_name(tag):
+    """Returns the tag name of an element without its namespace."""
+    return tag.rpartition('}')[2]
+
+
+def preprocess_feed_entry_item(entry_item, invalid_dates=None):
     """Makes an entry item ready for saving into database.
 
     This function applies the following operations to the given entry item:
     1. Checks if all required fields are present
-    2. Converts published date into tz-aware datetime object (UTC)
+    2. Converts published date into tz-aware datetime object (UTC), 
+       using the date already parsed by feedparser if any
     3. Removes any HTML tags from values
     4. Excludes any unnecessary fields
 
     Args:
         entry_item (FeedParserDict): the entry item to be processed
+        invalid_dates (list): see `convert_to_utc`
 
     Returns:
         dict: dictionary containing the processed values
     """
     for field in ENTRY_ITEM_FIELDS:
         if field not in entry_item:
+            metrics.PARSE_FAILURES.labels(kind='entry').inc()
             raise TypeError('{field} not found in feed entry item')
 
     return {
         'link': entry_item['link'],
-        'published': convert_to_utc(entry_item['published']),
+        'published': convert_to_utc(
+            entry_item['published'],
+            entry_item.get('published_parsed'),
+            entry_item.get('updated_parsed'),
+            invalid_dates
+        ),
         'summary': clean_text(entry_item['summary']),
         'title': clean_text(entry_item['title'])
     }
 
 
-def convert_to_utc(published):
-    """Parses datetime string and converts it to tz-aware datetime."""
+def convert_to_utc(published, published_parsed=None, updated_parsed=None,
+                   invalid_dates=None):
+    """Parses datetime string and converts it to tz-aware datetime.
+
+    The date parsed by feedparser is used if given. Otherwise, the 
+    string is parsed as an RFC 822 (RSS) or ISO 8601 (Atom) date, 
+    and only dates in neither format are parsed with dateutil. Dates 
+    without a time zone are taken to be in UTC. If the string cannot 
+    be parsed either, the update date parsed by feedparser is used, 
+    if any. If all fails, the current time is used, and the fallback 
+    is counted in `metrics.ENTRY_DATE_FALLBACKS`.
+
+    Args:
+        published (str): the date as found in the feed
+        published_parsed (time.struct_time): the date as parsed 
+            by feedparser (in UTC), if any
+        updated_parsed (time.struct_time): the date the entry was 
+            last updated, as parsed by feedparser (in UTC), if any
+        invalid_dates (list): if given, dates that cannot be parsed 
+            are added to it, so that they are logged once for the 
+            whole feed (see `log_invalid_dates`) rather than one by one
+
+    Returns:
+        datetime: tz-aware datetime in UTC
+    """
+    if published_parsed:
+        return datetime(*published_parsed[:6], tzinfo=pytz.UTC)
+
     try:
-        published_dt = parser.parse(published)
+        published_dt = parse_fixed_format_date(published)
+        if published_dt is None:
+            published_dt = parser.parse(published)
+        if timezone.is_naive(published_dt):
+            return published_dt.replace(tzinfo=pytz.UTC)
         return published_dt.astimezone(pytz.UTC)
     except Exception as e:
+        if updated_parsed:
+            return datetime(*updated_parsed[:6], tzinfo=pytz.UTC)
+
+        metrics.ENTRY_DATE_FALLBACKS.inc()
+        if invalid_dates is None:
+            logging.warning(
+                f'Cannot parse date {published!r}, using current time'
+            )
+        else:
+            invalid_dates.append(published)
         return timezone.now()
 
 
+def log_invalid_dates(feed_url, invalid_dates):
+    """Logs the dates of a feed that could not be parsed, if any.
+
+    Args:
+        feed_url (str): URL of the feed
+        invalid_dates (list): the dates (see `convert_to_utc`)
+    """
+    if invalid_dates:
+        logging.warning(
+            f'Cannot parse {len(invalid_dates)} dates of {feed_url} '
+            f'(e.g., {invalid_dates[0]!r}), using current time'
+        )
+
+
+def parse_fixed_format_date(value):
+    """Parses a date in RFC 822 or ISO 8601 format.
+
+    Returns:
+        datetime: the parsed date, or None if the value is in 
+            neither format
+    """
+    if RFC822_DATE_RE.match(value):
+        try:
+            return parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+    try:
+        return parse_datetime(value)
+    except ValueError:
+        return None
+
+
 def clean_text(text):
-    """Removes HTML tags and entities from given text."""
-    no_html_tags = strip_tags(text)
-    return no_html_tags.replace('&nbsp;', ' ')
+    """Removes HTML tags and entities from given text.
+
+    All HTML entities are unescaped first, with non-breaking spaces 
+    turned into plain spaces, so that escaped markup (e.g., 
+    `&lt;script&gt;`) is removed like any other. Script, style, and 
+    applet elements are removed along with their content, as 
+    feedparser's sanitizer does, so that entries read without 
+    feedparser (see `iter_feed_entries`) are cleaned the same. Other 
+    tags are removed with a precompiled regex (repeatedly, in case 
+    removing a tag forms a new one). Text without markup or entities 
+    is returned as is.
+    """
+    if '&' in text:
+        text = html.unescape(text)
+    if '<' in text:
+        text = UNSAFE_HTML_ELEMENT_RE.sub('', text)
+        while True:
+            no_html_tags = HTML_MARKUP_RE.sub('', text)
+            if no_html_tags == text:
+                break
+            text = no_html_tags
+    return text.replace('\xa0', ' ')
@@ -0,0 +1,377 @@
+"""
+Module for downloading feed documents over pooled HTTP connections
+
+Feeds are downloaded with a shared `requests` session so that
+keep-alive connections are reused across downloads, and many feeds
+can be downloaded at once with a bounded thread pool. Parsing is left
+to `feeds.utils.feed_tools`. Documents too large to be held in memory
+whole can be read a chunk at a time instead.
+
+Functions:
+    get_session()
+    open_feed(feed_url, etag='', modified='')
+    download_feed(feed_url, etag='', modified='', max_size=None)
+    download_feeds(feed_urls, validators=None, max_workers=None,
+                   max_pending=None, max_size=None, interleave=True)
+    hash_content(content)
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from functools import partial
+import hashlib
+from itertools import chain, zip_longest
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.utils.functional import cached_property
+import requests
+from requests.adapters import HTTPAdapter
+
+from feeds.utils import metrics
+from feeds.utils.pipeline import map_bounded
+from feeds.utils.throttling import (
+    block_host, download_slot, FetchThrottledError, reserve_host_slot
+)
+
+USER_AGENT = 'rss-apifier/1.0 (+https://github.com/ralphqq/rss-apifier)'
+
+CHUNK_SIZE = 64 * 1024
+
+# Status codes with which hosts ask to be downloaded from less often
+THROTTLED_STATUS_CODES = (429, 503)
+
+
+class FeedResponse(namedtuple('FeedResponse',
+                              ['url', 'status', 'content', 'headers'])):
+    """A downloaded feed document."""
+
+    @cached_property
+    def content_hash(self):
+        """Digest of the document, computed once (see `hash_content`)."""
+        return hash_content(self.content)
+
+
+FeedStream = namedtuple(
+    'FeedStream',
+    ['url', 'status', 'chunks', 'headers']
+)
+
+
+class FeedTooLargeError(Exception):
+    """Raised when a feed document is too large to be downloaded whole.
+
+    The download is left open, so that the document can be read on 
+    a chunk at a time rather than requested again; whoever handles 
+    the error must call `close()` once done with it.
+
+    Attributes:
+        stream (FeedStream): the open document, whose chunks start 
+            from the beginning of the body (None if there is none)
+    """
+
+    def __init__(self, message='', stream=None, close=None):
+        super().__init__(message)
+        self.stream = stream
+        self._close = close
+
+    def close(self):
+        """Closes the download of the document, if still open."""
+        close, self._close = self._close, None
+        if close is not None:
+            close()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the process-wide session used for downloading feeds.
+
+    The session's connection pools are sized to the number of
+    download workers, so that concurrent downloads from the same host
+    reuse keep-alive connections instead of opening new ones.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            pool_size = settings.FEED_FETCH_MAX_WORKERS
+            adapter = HTTPAdapter(
+                pool_connections=pool_size,
+                pool_maxsize=pool_size
+            )
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = USER_AGENT
+            _session = session
+    return _session
+
+
+def get_host(feed_url):
+    """Returns the host (network location) of a feed URL."""
+    return urlsplit(feed_url).netloc.lower()
+
+
+def get_host_semaphore(feed_url):
+    """Returns the semaphore that limits concurrent downloads per host."""
+    host = get_host(feed_url)
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(
+                settings.FEED_FETCH_MAX_PER_HOST
+            )
+        return _host_semaphores[host]
+
+
+@contextmanager
+def open_feed(feed_url, etag='', modified=''):
+    """Opens a feed document to be read a chunk at a time.
+
+    The download waits for its turn in the host's token bucket and 
+    for a free download slot (see `feeds.utils.throttling`), and a 
+    host that answers with HTTP 429 or 503 is not downloaded from 
+    again until its Retry-After delay is over. Once started, the 
+    whole download, not just each socket read, must finish within
+    `settings.FEED_FETCH_TIMEOUT` seconds of waiting for the host 
+    (time the caller spends between chunks is not counted). If 
+    validators from a previous download are given, the request is 
+    made conditional, and a server whose feed has not changed answers 
+    with an empty 304 response. 
+    The connection is closed on leaving the context, so that the 
+    document need not be read to the end. The time until the host 
+    answers and the size of the document read are recorded (see 
+    `feeds.utils.metrics`).
+
+    Args:
+        feed_url (str): URL of the feed to download
+        etag (str): value of the ETag header from the last download
+        modified (str): value of the Last-Modified header from 
+            the last download
+
+    Yields:
+        FeedStream: namedtuple with the final URL, HTTP status code,
+            iterator over chunks of the raw body (bytes), and response
+            headers (lowercased names)
+
+    Raises:
+        FetchThrottledError: if the host asked not to be downloaded 
+            from for now (including with this request's answer), or 
+            no download slot is free in time
+        requests.RequestException: on connection errors, timeouts,
+            and HTTP error status codes
+    """
+    timeout = settings.FEED_FETCH_TIMEOUT
+    host = get_host(feed_url)
+
+    request_headers = {}
+    if etag:
+        request_headers['If-None-Match'] = etag
+    if modified:
+        request_headers['If-Modified-Since'] = modified
+
+    size = 0
+
+    def iter_chunks(response, elapsed):
+        nonlocal size
+        chunks = response.iter_content(CHUNK_SIZE)
+        while True:
+            started = time.monotonic()
+            chunk = next(chunks, None)
+            elapsed += time.monotonic() - started
+            if elapsed > timeout:
+                raise requests.Timeout(
+                    f'Download of {feed_url} exceeded {timeout} seconds'
+                )
+            if chunk is None:
+                return
+            size += len(chunk)
+            yield chunk
+
+    with get_host_semaphore(feed_url):
+        time.sleep(reserve_host_slot(host))
+        with download_slot():
+            started = time.monotonic()
+            with get_session().get(
+                    feed_url,
+                    headers=request_headers,
+                    timeout=timeout,
+                    stream=True) as response:
+                elapsed = time.monotonic() - started
+                metrics.FEED_FETCH_SECONDS.observe(elapsed)
+                if response.status_code in THROTTLED_STATUS_CODES:
+                    block_host(host, response.headers.get('Retry-After'))
+                    raise FetchThrottledError(
+                        f'{host} answered with HTTP {response.status_code}'
+                    )
+                response.raise_for_status()
+
+                try:
+                    yield FeedStream(
+                        url=response.url,
+                        status=response.status_code,
+                        chunks=iter_chunks(response, elapsed),
+                        headers={
+                            k.lower(): v
+                            for k, v in response.headers.items()
+                        }
+                    )
+                finally:
+                    if size:
+                        metrics.FEED_DOWNLOAD_BYTES.observe(size)
+
+
+def download_feed(feed_url, etag='', modified='', max_size=None):
+    """Downloads the raw document found at the given feed URL.
+
+    See `open_feed` for how the download is made.
+
+    Args:
+        feed_url (str): URL of the feed to download
+        etag (str): value of the ETag header from the last download
+        modified (str): value of the Last-Modified header from 
+            the last download
+        max_size (int): maximum size of the document in bytes, if any
+
+    Returns:
+        FeedResponse: namedtuple with the final URL, HTTP status code,
+            raw body (bytes), and response headers (lowercased names)
+
+    Raises:
+        FeedTooLargeError: if the document is larger than `max_size`;
+            the download is left open in the error, so that the rest 
+            of the document can be read from it
+        FetchThrottledError: if the download may not be made for now
+        requests.RequestException: on connection errors, timeouts,
+            and HTTP error status codes
+    """
+    with ExitStack() as stack:
+        stream = stack.enter_context(
+            open_feed(feed_url, etag=etag, modified=modified)
+        )
+        message = f'{feed_url} is larger than {max_size} bytes'
+        content_length = stream.headers.get('content-length', '')
+        if (max_size is not None and content_length.isdecimal() and
+                int(content_length) > max_size):
+            raise FeedTooLargeError(
+                message,
+                stream=stream,
+                close=stack.pop_all().close
+            )
+
+        chunks = []
+        size = 0
+        for chunk in stream.chunks:
+            chunks.append(chunk)
+            size += len(chunk)
+            if max_size is not None and size > max_size:
+                # Chunks already read are handed on with the rest
+                raise FeedTooLargeError(
+                    message,
+                    stream=stream._replace(
+                        chunks=chain(chunks, stream.chunks)
+                    ),
+                    close=stack.pop_all().close
+                )
+
+        return FeedResponse(
+            url=stream.url,
+            status=stream.status,
+            content=b''.join(chunks),
+            headers=stream.headers
+        )
+
+
+def download_feeds(feed_urls, validators=None, max_workers=None,
+                   max_pending=None, max_size=None, interleave=True):
+    """Downloads several feeds at once using a bounded thread pool.
+
+    Downloads are started as earlier ones are consumed, so that no 
+    more than `max_pending` documents are downloading or waiting in 
+    memory at any time. Feeds are downloaded from each host in turn 
+    (see `interleave_hosts`), unless `interleave` is False, in which 
+    case `feed_urls` is only consumed as downloads are started.
+
+    Args:
+        feed_urls (iterable): URLs of the feeds to download
+        validators (dict): maps feed URLs to (etag, modified) tuples 
+            used to make conditional requests (see `download_feed`)
+        max_workers (int): maximum number of concurrent downloads
+            (defaults to `settings.FEED_FETCH_MAX_WORKERS`)
+        max_pending (int): maximum number of downloads started but 
+            not yet consumed (defaults to `max_workers` plus 
+            `settings.FEED_PIPELINE_QUEUE_SIZE`)
+        max_size (int): maximum size of each document in bytes, if any
+            (see `download_feed`)
+        interleave (bool): whether to reorder the URLs by host; pass
+            False if they are already in the order to download them
+
+    Yields:
+        tuple: (feed URL, FeedResponse) for each feed in the order
+            the downloads finish; if a download fails, the raised
+            exception takes the place of the FeedResponse (downloads 
+            left open in FeedTooLargeError errors are closed if the 
+            iteration stops before they are consumed)
+    """
+    validators = validators or {}
+    max_workers = max_workers or settings.FEED_FETCH_MAX_WORKERS
+    max_pending = max_pending or (
+        max_workers + settings.FEED_PIPELINE_QUEUE_SIZE
+    )
+    download = download_feed
+    if max_size is not None:
+        download = partial(download_feed, max_size=max_size)
+
+    if interleave:
+        feed_urls = interleave_hosts(feed_urls)
+    jobs = (
+        (url, (url, *validators.get(url, ())))
+        for url in feed_urls
+    )
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from map_bounded(
+            executor,
+            download,
+            jobs,
+            max_pending,
+            discard=close_download
+        )
+
+
+def close_download(response):
+    """Closes a download left open by `download_feed`, if any."""
+    if isinstance(response, FeedTooLargeError):
+        response.close()
+
+
+def hash_content(content):
+    """Returns a hex digest of a downloaded feed document."""
+    return hashlib.blake2b(content, digest_size=32).hexdigest()
+
+
+def interleave_hosts(feed_urls):
+    """Orders feed URLs so that URLs of the same host are spread out.
+
+    URLs are taken from each host in turn, so that while downloads 
+    from a host with many feeds wait for their turn, downloads from 
+    other hosts go on (see `feeds.utils.throttling.reserve_host_slot`).
+
+    Args:
+        feed_urls (iterable): URLs of the feeds to download
+
+    Returns:
+        list: the same URLs, in the order they should be downloaded
+    """
+    urls_by_host = {}
+    for url in feed_urls:
+        urls_by_host.setdefault(get_host(url), []).append(url)
+    return [
+        url for urls in zip_longest(*urls_by_host.values())
+        for url in urls if url is not None
+    ]
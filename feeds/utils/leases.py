@@ -0,0 +1,267 @@
+"""
+Module for keeping workers from doing the same fetching work at once
+
+A lease is a key in the cache that one worker holds for a limited time
+(see `Lease`), e.g., while it updates a feed, so that other workers
+leave the feed alone. Work that may outlast a lease's timeout keeps
+its leases alive with a `Heartbeat`, which renews them from a
+background thread; the leases of a worker that died expire once
+their timeout is over, so that other workers may take them.
+
+In production, the cache is Redis, where leases are taken, renewed,
+and released atomically, and only by the worker holding them. Other
+cache backends (e.g., the local memory cache used in development)
+are used through the cache API, which is enough within a single
+process.
+
+Classes:
+    Lease
+    Heartbeat
+
+Functions:
+    feed_lease(feed_id)
+"""
+import logging
+import math
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = 'lease'
+
+# Name of the lease held by a `fetch-entries` run, so that runs do not
+# overlap
+FETCH_ENTRIES_LEASE = 'fetch-entries'
+
+# Lua scripts renewing and releasing a lease in Redis only if it is
+# still held with the given token
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def get_redis_client():
+    """Returns the Redis client of the cache, or None if not Redis."""
+    try:
+        from django_redis import get_redis_connection
+    except ImportError:
+        return None
+
+    try:
+        return get_redis_connection('default')
+    except NotImplementedError:
+        return None
+
+
+class LeaseUnavailableError(Exception):
+    """Raised when a lease is held by another worker."""
+
+
+class Lease:
+    """A named lease held in the cache by at most one worker at a time.
+
+    Each Lease object has a random token, stored as the value of its
+    key, so that a worker only renews or releases the leases it holds.
+
+    A lease may be handed over to another task (see `hand_over`), 
+    which takes it over by creating a Lease with the same token.
+
+    Args:
+        name (str): name of the lease, shared by all workers
+        timeout (int): seconds the lease is held without being
+            renewed (defaults to `settings.FETCH_LEASE_TIMEOUT`)
+        token (str): token of a lease handed over by another task, 
+            if any; the lease is then taken to be held
+
+    Raises (when used as a context manager):
+        LeaseUnavailableError: if another worker holds the lease
+    """
+
+    def __init__(self, name, timeout=None, token=None):
+        self.name = name
+        self.timeout = timeout or settings.FETCH_LEASE_TIMEOUT
+        self.key = f'{KEY_PREFIX}:{name}'
+        self.token = token or uuid.uuid4().hex
+        self.held = token is not None
+        self._lock = threading.Lock()
+        self._redis = get_redis_client()
+
+    def acquire(self):
+        """Takes the lease if no worker holds it.
+
+        Returns:
+            bool: True if the lease was taken
+        """
+        with self._lock:
+            if self._redis is not None:
+                acquired = self._redis.set(
+                    cache.make_key(self.key),
+                    self.token,
+                    nx=True,
+                    px=int(self.timeout * 1000)
+                )
+            else:
+                acquired = cache.add(
+                    self.key,
+                    self.token,
+                    math.ceil(self.timeout)
+                )
+            self.held = bool(acquired)
+            return self.held
+
+    def renew(self, timeout=None):
+        """Restarts the lease's timeout, if it is still held.
+
+        Args:
+            timeout (int): seconds until the lease expires this time 
+                (defaults to the lease's timeout)
+
+        Returns:
+            bool: False if the lease has expired or was taken by
+                another worker
+        """
+        timeout = timeout or self.timeout
+        with self._lock:
+            if not self.held:
+                return False
+
+            if self._redis is not None:
+                renewed = self._redis.eval(
+                    RENEW_SCRIPT,
+                    1,
+                    cache.make_key(self.key),
+                    self.token,
+                    int(timeout * 1000)
+                )
+            else:
+                renewed = (
+                    cache.get(self.key) == self.token and
+                    cache.touch(self.key, math.ceil(timeout))
+                )
+            self.held = bool(renewed)
+            return self.held
+
+    def hand_over(self, timeout):
+        """Leaves the lease to be released by another task.
+
+        The lease is renewed for long enough for the other task to 
+        finish, and is no longer renewed or released by this object.
+
+        Args:
+            timeout (int): seconds until the lease expires, unless 
+                released sooner
+
+        Returns:
+            str: the token with which the lease is taken over, or 
+                None if the lease was lost
+        """
+        if not self.renew(timeout):
+            return None
+        with self._lock:
+            self.held = False
+        return self.token
+
+    def release(self):
+        """Gives up the lease, if it is still held."""
+        with self._lock:
+            if not self.held:
+                return
+
+            self.held = False
+            if self._redis is not None:
+                self._redis.eval(
+                    RELEASE_SCRIPT,
+                    1,
+                    cache.make_key(self.key),
+                    self.token
+                )
+            elif cache.get(self.key) == self.token:
+                cache.delete(self.key)
+
+    def __enter__(self):
+        if not self.acquire():
+            raise LeaseUnavailableError(f'Lease {self.name} is held')
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def __repr__(self):
+        return f'<Lease {self.name}>'
+
+
+class Heartbeat:
+    """Renews leases from a background thread until it is stopped.
+
+    Leases are renewed every third of their timeout, so that a lease
+    is only lost if its worker cannot reach the cache for that long.
+    Leases that are released are no longer renewed.
+
+    Usage:
+        with Heartbeat([lease]) as heartbeat:
+            heartbeat.add(another_lease)
+            ...
+
+    Args:
+        leases (iterable): the leases to renew, if any yet
+    """
+
+    def __init__(self, leases=()):
+        self._leases = set(leases)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def add(self, lease):
+        with self._lock:
+            self._leases.add(lease)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                self._leases = {
+                    lease for lease in self._leases if lease.held
+                }
+                leases = list(self._leases)
+            interval = min(
+                (lease.timeout for lease in leases),
+                default=settings.FETCH_LEASE_TIMEOUT
+            ) / 3
+            if self._stopped.wait(interval):
+                return
+
+            for lease in leases:
+                if lease.held and not lease.renew():
+                    logging.warning(
+                        f'{lease} expired before it could be renewed'
+                    )
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def feed_lease(feed_id):
+    """Returns the lease held by the worker updating a feed."""
+    return Lease(f'feed:{feed_id}')
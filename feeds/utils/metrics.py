@@ -0,0 +1,139 @@
+"""
+Module for measuring feed ingestion with Prometheus metrics
+
+Metrics are recorded by whichever process does the work (gunicorn
+workers, Celery workers, and the processes that parse feeds) and are
+exposed in the Prometheus text format (see `generate_metrics`). When
+the `prometheus_multiproc_dir` environment variable names a directory
+shared by all of these processes, each process writes its metrics to
+files there, and the metrics of all processes are added up when they
+are exposed. Without it, each process only exposes its own metrics.
+Since the directory may be shared by the processes of several
+containers, whose process IDs overlap, each process names its files
+after both its host name and its process ID.
+
+Functions:
+    get_process_identifier()
+    generate_metrics()
+"""
+import os
+import socket
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY,
+    generate_latest
+)
+from prometheus_client import multiprocess, values
+
+NAMESPACE = 'rss_apifier'
+
+# Environment variable naming the directory shared by all processes
+MULTIPROCESS_DIR_ENV = 'prometheus_multiproc_dir'
+
+
+def get_process_identifier():
+    """Returns an identifier of the current process across containers.
+
+    Process IDs are only unique within a container, so the host name 
+    (the container ID, by default) is added to the process ID.
+    """
+    return f'{socket.gethostname()}_{os.getpid()}'
+
+
+# Must be set before any metric is created, as each metric's value
+# class is chosen when the metric is
+if os.environ.get(MULTIPROCESS_DIR_ENV):
+    values.ValueClass = values.MultiProcessValue(get_process_identifier)
+
+# Time until a feed's host answers a download request
+FEED_FETCH_SECONDS = Histogram(
+    'feed_fetch_seconds',
+    'Time until the host of a feed answers a download request',
+    namespace=NAMESPACE,
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+# Size of downloaded feed documents
+FEED_DOWNLOAD_BYTES = Histogram(
+    'feed_download_bytes',
+    'Size of the downloaded feed documents',
+    namespace=NAMESPACE,
+    buckets=(1e3, 1e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 2e6, 5e6, 1e7)
+)
+
+# Time taken by feedparser to parse a whole feed document
+FEED_PARSE_SECONDS = Histogram(
+    'feed_parse_seconds',
+    'Time taken to parse a downloaded feed document',
+    namespace=NAMESPACE,
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+# Time taken to save a feed's new entries in the database
+ENTRY_WRITE_SECONDS = Histogram(
+    'entry_write_seconds',
+    'Time taken to save the new entries of a feed',
+    namespace=NAMESPACE,
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+
+# Outcome of each feed update, by fetch status (e.g., `not_modified`
+# for HTTP 304)
+FEED_UPDATES = Counter(
+    'feed_updates',
+    'Feed updates, by outcome',
+    ['status'],
+    namespace=NAMESPACE
+)
+
+ENTRIES_SAVED = Counter(
+    'entries_saved',
+    'New entries saved',
+    namespace=NAMESPACE
+)
+
+# Entries skipped because they are already saved for their feed
+ENTRY_DUPLICATES = Counter(
+    'entry_duplicates',
+    'Entries skipped because they were already saved for the feed',
+    namespace=NAMESPACE
+)
+
+# Entries skipped because they were published before the retention
+# cutoff (see `settings.ENTRY_MAX_AGE_DAYS`)
+ENTRIES_EXPIRED = Counter(
+    'entries_expired',
+    'Entries skipped because they were older than the retention limit',
+    namespace=NAMESPACE
+)
+
+# Documents (`kind="document"`) or entries (`kind="entry"`) that could
+# not be parsed
+PARSE_FAILURES = Counter(
+    'parse_failures',
+    'Feed documents or entries that could not be parsed',
+    ['kind'],
+    namespace=NAMESPACE
+)
+
+# Entries whose date could not be parsed, so the current time was used
+ENTRY_DATE_FALLBACKS = Counter(
+    'entry_date_fallbacks',
+    'Entries whose date could not be parsed',
+    namespace=NAMESPACE
+)
+
+
+def generate_metrics():
+    """Returns the current metrics in the Prometheus text format.
+
+    Returns:
+        bytes: metrics of all processes if `prometheus_multiproc_dir`
+            is set, otherwise those of the current process
+    """
+    if os.environ.get(MULTIPROCESS_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
@@ -0,0 +1,68 @@
+"""
+Module for running the stages of feed updates concurrently
+
+Each stage of an update (downloading feeds, parsing them) runs its
+jobs in an executor and hands each result on as soon as it is ready.
+A stage only takes in new jobs while fewer than a given number of its
+jobs are running or waiting to be consumed, so that the documents
+held in memory between stages stay bounded however many feeds are
+updated.
+
+Functions:
+    map_bounded(executor, func, jobs, max_pending, discard=None)
+"""
+from concurrent.futures import FIRST_COMPLETED, wait
+from itertools import islice
+
+
+def map_bounded(executor, func, jobs, max_pending, discard=None):
+    """Runs a function over jobs with a bounded number in flight.
+
+    Jobs are only taken from `jobs` while fewer than `max_pending`
+    of them have been submitted but not yet consumed, so `jobs` may
+    be a lazy iterable such as the output of a previous stage. If
+    the results stop being consumed (e.g., the consumer fails), the
+    jobs not started yet are cancelled, and the results of the others
+    are passed to `discard`, so that any resources they hold can be
+    released.
+
+    Args:
+        executor (concurrent.futures.Executor): runs the jobs
+        func (callable): function called with each job's arguments
+        jobs (iterable): (key, args) tuples, where args is the tuple
+            of arguments to call `func` with
+        max_pending (int): maximum number of jobs submitted but
+            not yet consumed
+        discard (callable): called with the result (or exception) of
+            each job left unconsumed, if given
+
+    Yields:
+        tuple: (key, return value of `func`) for each job in the order
+            the jobs finish; if a job fails, the raised exception takes
+            the place of the return value
+    """
+    jobs = iter(jobs)
+    pending = {}
+    try:
+        while True:
+            for key, args in islice(jobs, max_pending - len(pending)):
+                pending[executor.submit(func, *args)] = key
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                yield key, get_result(future)
+    finally:
+        for future in pending:
+            if not future.cancel() and discard is not None:
+                discard(get_result(future))
+
+
+def get_result(future):
+    """Returns the result of a future, or the exception it raised."""
+    try:
+        return future.result()
+    except Exception as e:
+        return e
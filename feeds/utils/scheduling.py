@@ -0,0 +1,72 @@
+"""
+Module for working out how often each feed should be polled
+
+Each feed keeps an exponentially smoothed estimate of the time between
+its new entries. Busy feeds are polled about as often as they publish,
+while feeds that have gone quiet are backed off in proportion to how
+long they have been idle. Delays are kept within
+`settings.FEED_POLL_MIN_INTERVAL` and `settings.FEED_POLL_MAX_INTERVAL`.
+Feeds whose updates keep failing are backed off exponentially instead.
+
+Functions:
+    smooth_interval(previous, observed)
+    compute_poll_delay(publish_interval=None, idle_time=None)
+    compute_failure_backoff(failures)
+"""
+from datetime import timedelta
+
+from django.conf import settings
+
+
+def smooth_interval(previous, observed):
+    """Updates an exponentially smoothed publish interval.
+
+    Args:
+        previous (timedelta): the current estimate, if any
+        observed (timedelta): the latest observed interval
+
+    Returns:
+        timedelta: the new estimate
+    """
+    if previous is None:
+        return observed
+    alpha = settings.FEED_POLL_SMOOTHING
+    return observed * alpha + previous * (1 - alpha)
+
+
+def compute_poll_delay(publish_interval=None, idle_time=None):
+    """Works out how long to wait before polling a feed again.
+
+    Args:
+        publish_interval (timedelta): smoothed time between the feed's
+            new entries, if known
+        idle_time (timedelta): time since the feed's last new entry,
+            if any
+
+    Returns:
+        timedelta: delay until the next poll
+    """
+    min_delay = timedelta(seconds=settings.FEED_POLL_MIN_INTERVAL)
+    max_delay = timedelta(seconds=settings.FEED_POLL_MAX_INTERVAL)
+
+    delay = publish_interval or min_delay
+    if idle_time is not None:
+        delay = max(delay, idle_time * settings.FEED_POLL_BACKOFF)
+    return min(max(delay, min_delay), max_delay)
+
+
+def compute_failure_backoff(failures):
+    """Works out how long to leave a failing feed alone.
+
+    Args:
+        failures (int): count of consecutive failed updates
+
+    Returns:
+        timedelta: `settings.FEED_FAILURE_BACKOFF` seconds, doubled for 
+            each failure after the first, up to 
+            `settings.FEED_FAILURE_MAX_BACKOFF` seconds
+    """
+    # Cap the exponent so that the delay never overflows
+    exponent = min(max(failures - 1, 0), 32)
+    backoff = settings.FEED_FAILURE_BACKOFF * 2 ** exponent
+    return timedelta(seconds=min(backoff, settings.FEED_FAILURE_MAX_BACKOFF))
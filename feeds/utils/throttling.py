@@ -0,0 +1,175 @@
+"""
+Module for keeping feed downloads polite to the hosts serving them
+
+Downloads from each host are spaced out with a token bucket (see
+`reserve_host_slot`), downloads in progress across all workers are
+capped (see `download_slot`), and hosts that answer with HTTP 429 or
+503 are left alone for as long as their Retry-After header asks (see
+`block_host`). All of this state is kept in the cache, which is shared
+by all Celery workers in production, so that the workers obey the same
+limits.
+
+Functions:
+    reserve_host_slot(host, now=None)
+    download_slot()
+    block_host(host, retry_after=None, now=None)
+    parse_retry_after(value, now=None)
+"""
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import math
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = 'fetch'
+
+# Seconds between attempts to take a download slot when all are in use
+SLOT_POLL_INTERVAL = 0.1
+
+
+class FetchThrottledError(Exception):
+    """Raised when a download may not be made for the time being."""
+
+
+def _host_key(host, name):
+    return f'{KEY_PREFIX}:host:{host}:{name}'
+
+
+def reserve_host_slot(host, now=None):
+    """Reserves a download from a host in the host's token bucket.
+
+    Time is divided into slots of `1 / settings.FEED_HOST_RATE`
+    seconds, each allowing one download from the host. A download
+    takes the earliest free slot, starting from the last
+    `settings.FEED_HOST_BURST` slots, so that a host that has been
+    idle serves a burst of downloads at once, and a busy host serves
+    them at the given rate. Slots are taken with atomic cache adds,
+    so that all workers share each host's bucket.
+
+    Args:
+        host (str): network location of the feed URL
+        now (float): current POSIX timestamp (defaults to the
+            system time)
+
+    Returns:
+        float: seconds to wait before starting the download
+
+    Raises:
+        FetchThrottledError: if the host asked not to be downloaded
+            from for now (see `block_host`), or has no free slot
+            within `settings.FEED_HOST_MAX_WAIT` seconds
+    """
+    now = time.time() if now is None else now
+    blocked_until = cache.get(_host_key(host, 'blocked'))
+    if blocked_until is not None and blocked_until > now:
+        raise FetchThrottledError(
+            f'{host} asked not to be downloaded from for '
+            f'{blocked_until - now:.0f} more seconds'
+        )
+
+    interval = 1 / settings.FEED_HOST_RATE
+    burst = settings.FEED_HOST_BURST
+    max_wait = settings.FEED_HOST_MAX_WAIT
+    timeout = math.ceil((burst + 1) * interval + max_wait)
+
+    current_slot = int(now / interval)
+    last_slot = int((now + max_wait) / interval)
+    for slot in range(current_slot - burst + 1, last_slot + 1):
+        if cache.add(_host_key(host, f'slot:{slot}'), 1, timeout):
+            return max(slot * interval - now, 0)
+
+    raise FetchThrottledError(
+        f'{host} has no download slot free within {max_wait} seconds'
+    )
+
+
+@contextmanager
+def download_slot():
+    """Holds one of the download slots shared by all workers.
+
+    No more than `settings.FEED_FETCH_MAX_CONCURRENCY` downloads are
+    in progress at once across all workers. Slots expire after twice
+    `settings.FEED_FETCH_TIMEOUT` seconds, longer than any download
+    may take, so that slots held by a worker that died are freed.
+
+    Raises:
+        FetchThrottledError: if no slot is freed within
+            `settings.FEED_HOST_MAX_WAIT` seconds
+    """
+    max_concurrency = settings.FEED_FETCH_MAX_CONCURRENCY
+    timeout = settings.FEED_FETCH_TIMEOUT * 2
+    deadline = time.time() + settings.FEED_HOST_MAX_WAIT
+
+    # Start from a random slot so that workers do not all contend
+    # for the first ones
+    offset = random.randrange(max_concurrency)
+    while True:
+        for i in range(max_concurrency):
+            key = f'{KEY_PREFIX}:slot:{(offset + i) % max_concurrency}'
+            if cache.add(key, 1, timeout):
+                try:
+                    yield
+                finally:
+                    cache.delete(key)
+                return
+
+        if time.time() > deadline:
+            raise FetchThrottledError('All download slots are in use')
+        time.sleep(SLOT_POLL_INTERVAL)
+
+
+def block_host(host, retry_after=None, now=None):
+    """Stops downloads from a host until it can serve them again.
+
+    Args:
+        host (str): network location of the feed URL
+        retry_after (str): value of the Retry-After header the host
+            answered with, if any; without it, downloads are stopped
+            for `settings.FEED_HOST_RETRY_AFTER` seconds
+        now (float): current POSIX timestamp (defaults to the
+            system time)
+
+    Returns:
+        float: POSIX timestamp until which the host is blocked
+    """
+    now = time.time() if now is None else now
+    delay = parse_retry_after(retry_after, now)
+    if delay is None:
+        delay = settings.FEED_HOST_RETRY_AFTER
+
+    # Do not let a host put itself off for longer than the longest
+    # delay between fetches of a feed
+    delay = min(max(delay, 1), settings.FEED_POLL_MAX_INTERVAL)
+    blocked_until = now + delay
+    cache.set(_host_key(host, 'blocked'), blocked_until, math.ceil(delay))
+    return blocked_until
+
+
+def parse_retry_after(value, now=None):
+    """Parses the value of a Retry-After header.
+
+    Args:
+        value (str): either a number of seconds or an HTTP date
+        now (float): current POSIX timestamp (defaults to the
+            system time)
+
+    Returns:
+        float: seconds to wait, or None if the value is missing
+            or invalid
+    """
+    value = (value or '').strip()
+    if value.isdecimal():
+        return float(value)
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if retry_at is None or retry_at.tzinfo is None:
+        return None
+
+    now = time.time() if now is None else now
+    return max(retry_at.timestamp() - now, 0)
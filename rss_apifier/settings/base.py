@@ -32,6 +32,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     # Third-party apps
     'django_celery_beat',
@@ -136,6 +137,102 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 # This ensures entries already saved in db are not parsed again
 MAX_SAVED_ENTRIES_COUNT = 3
 
+# Number of entries whose links are looked up at once when checking
+# which entries of a feed are already saved
+ENTRY_LOOKUP_BATCH_SIZE = 100
+
+# Feed downloads: total seconds allowed per download, number of feeds
+# downloaded at once, and number of simultaneous downloads per host
+FEED_FETCH_TIMEOUT = 30
+FEED_FETCH_MAX_WORKERS = 16
+FEED_FETCH_MAX_PER_HOST = 4
+
+# Politeness towards hosts, shared by all workers through the cache:
+# downloads per second from each host, downloads a host that has been
+# idle may serve at once, downloads in progress at once across all
+# workers, the longest a download waits for its turn (in seconds), and
+# how long a host that answers 429 or 503 without a Retry-After header
+# is left alone (in seconds)
+FEED_HOST_RATE = 1
+FEED_HOST_BURST = 4
+FEED_FETCH_MAX_CONCURRENCY = 32
+FEED_HOST_MAX_WAIT = 30
+FEED_HOST_RETRY_AFTER = 60 * 5
+
+# Feed parsing: number of worker processes that parse downloaded feeds
+# (defaults to one per CPU core), and number of documents that may wait
+# between the download, parse, and save stages of an update
+FEED_PARSE_MAX_WORKERS = (
+    int(os.environ.get('FEED_PARSE_MAX_WORKERS', 0)) or os.cpu_count()
+)
+FEED_PIPELINE_QUEUE_SIZE = 32
+
+# Size in bytes above which feed documents are not downloaded whole,
+# but parsed as they are downloaded until no more new entries are found
+FEED_STREAM_MIN_SIZE = 2 * 1024 * 1024
+
+# Adaptive polling: bounds (in seconds) of the delay between fetches
+# of a feed, weight of the latest interval between new entries in the
+# smoothed estimate, and share of a feed's idle time to wait before
+# polling it again (see feeds.utils.scheduling)
+FEED_POLL_MIN_INTERVAL = 60 * 5
+FEED_POLL_MAX_INTERVAL = 60 * 60 * 24
+FEED_POLL_SMOOTHING = 0.3
+FEED_POLL_BACKOFF = 0.5
+
+# Failing feeds: seconds a feed is left alone after a failed update
+# (doubled with each further consecutive failure, up to the maximum),
+# and consecutive failures after which a feed is listed as unhealthy
+FEED_FAILURE_BACKOFF = 60 * 5
+FEED_FAILURE_MAX_BACKOFF = 60 * 60 * 24 * 7
+FEED_UNHEALTHY_FAILURES = 3
+
+# Cache, shared by the web app and the Celery workers when it is on the
+# Redis server at CACHE_REDIS_URL (always the case in production).
+# Without it, each process has a cache of its own, which does not see
+# the entries saved by the workers, so pages of entries are not cached
+# (ENTRY_PAGE_CACHE_ENABLED); and throttling and leases only hold within
+# each process. Cached pages of entries are invalidated when new entries
+# are saved, and otherwise kept for ENTRY_PAGE_CACHE_TIMEOUT seconds
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', '')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+ENTRY_PAGE_CACHE_ENABLED = bool(CACHE_REDIS_URL)
+ENTRY_PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Text search configuration (language) used to index and search entries;
+# changing it requires filling the search vectors of all entries again
+ENTRY_SEARCH_CONFIG = 'english'
+
+# Number of entries read from the database at a time when streaming
+# the export of all entries
+ENTRY_EXPORT_CHUNK_SIZE = 2000
+
+# Sync tokens only cover entries saved (or, for a feed's entries, linked
+# to the feed) at least ENTRY_SYNC_TOKEN_LAG seconds earlier, so that
+# entries committed out of order are not skipped; it must be longer than
+# any transaction saving entries takes
+ENTRY_SYNC_TOKEN_LAG = 60
+
+# Retention of entries, enforced by the `purge-entries` task: maximum
+# age in days (by publication date) and maximum number of entries kept
+# per feed (0 keeps entries forever), and number of entries deleted
+# per transaction
+ENTRY_MAX_AGE_DAYS = int(os.environ.get('ENTRY_MAX_AGE_DAYS', 0))
+ENTRY_MAX_PER_FEED = int(os.environ.get('ENTRY_MAX_PER_FEED', 0))
+ENTRY_PURGE_BATCH_SIZE = 1000
+
 # Celery settings
 CELERY_BROKER_URL = os.environ.get(
     'CELERY_BROKER_URL',
@@ -150,6 +247,23 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# When True, `fetch-entries` enqueues one `fetch-feed-entries` subtask
+# per feed so that feeds are processed concurrently by the workers
+FETCH_ENTRIES_FAN_OUT = os.environ.get(
+    'FETCH_ENTRIES_FAN_OUT', ''
+).lower() in ('1', 'true', 'yes')
+
+# Seconds a worker holds the lease of a feed it is updating, or of a
+# `fetch-entries` run, without renewing it; leases are renewed every
+# third of this while the work goes on, and expire this long after
+# their worker dies (see `feeds.utils.leases`)
+FETCH_LEASE_TIMEOUT = 60
+
+# Seconds the lease of a `fetch-entries` run that fanned out its feeds
+# is held at most, should its chord never release it; a run whose
+# subtasks take longer than this may overlap the next one
+FETCH_ENTRIES_FAN_OUT_TIMEOUT = 60 * 60
+
 # DRF settings
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
@@ -160,3 +274,8 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
     ],
 }
+
+# Number of times a query of the same shape may run while handling an
+# API request before it is flagged as a likely N+1 query pattern (see
+# `api.queries.find_repeated_queries`)
+API_QUERY_REPEAT_LIMIT = 3
@@ -7,3 +7,7 @@ DEBUG = True
 SECRET_KEY = '&dpdz+qsx+t09f(l^)0*k2v!3@)ut3&n=#w@$!e9+1vn7hcn*&'
 ALLOWED_HOSTS = ['*']
 PRODUCTION = False
+
+# Record the queries run for each request, flagging N+1 query patterns
+# and requests over their view's query budget (see api.middleware)
+MIDDLEWARE = ['api.middleware.QueryCountMiddleware', *MIDDLEWARE]
@@ -6,4 +6,15 @@ from .base import *
 DEBUG = False
 SECRET_KEY = os.environ['SECRET_KEY']
 ALLOWED_HOSTS = [os.environ.get('SITENAME', 'localhost')]
-PRODUCTION = True
\ No newline at end of file
+PRODUCTION = True
+
+# Cache on the Redis server used as Celery broker, so that the web app
+# and the workers share the counters that invalidate cached pages
+CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL', 'redis://redis:6379/1')
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': CACHE_REDIS_URL,
+    }
+}
+ENTRY_PAGE_CACHE_ENABLED = True